@@ -2,16 +2,29 @@ import os
 import asyncio
 import logging
 import aiohttp
+from aiohttp import web
 import json
 import asyncpg
+import signal
 import time
 import hashlib
+import heapq
+import hmac
+import math
 import re
+import sqlite3
+import threading
+import uuid
+from array import array
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, ChatMember
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from telegram.error import BadRequest, TimedOut, NetworkError
+from telegram.ext import Application, BaseRateLimiter, BaseUpdateProcessor, ChatMemberHandler, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.error import BadRequest, Forbidden, TimedOut, NetworkError, RetryAfter, TelegramError
 import random
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from functools import wraps
 from typing import Dict, List, Optional, Tuple
 
@@ -24,10 +37,37 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')  # optional streaming replica for reads
 SOL_API_KEY = os.environ.get('SOL_API_KEY')
 TOKEN_CONTRACT_ADDRESS = os.environ.get('TOKEN_CONTRACT_ADDRESS')
 NOTIFICATION_CHAT_ID = os.environ.get('NOTIFICATION_CHAT_ID')
 
+# Webhook mode: Telegram pushes updates to our aiohttp server (Render sets RENDER_EXTERNAL_URL and PORT)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL') or os.environ.get('RENDER_EXTERNAL_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')  # derived from the bot token when not set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')    # bearer token for /metrics, derived from the webhook secret when not set
+BOT_MODE = os.environ.get('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling')
+PORT = int(os.environ.get('PORT', 10000))
+WEBAPP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webapp')
+WEBHOOK_CONFIG = {
+    'path': '/telegram',      # Telegram posts updates here
+    'max_connections': 40     # concurrent webhook connections Telegram may open
+}
+# chat_member / my_chat_member keep the admin cache current
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member", "my_chat_member"]
+
+# Group administrators, fetched in bulk and reused by is_admin
+ADMIN_CACHE = {
+    'ttl': 600,          # seconds an administrator list is trusted without a chat_member update
+    'max_chats': 1000    # least recently used chats evicted past this
+}
+
+# Concurrent update handling; updates of the same chat still run one at a time, in order
+UPDATE_PROCESSING = {
+    'max_in_flight': 256,   # updates holding a processing slot (at most one per chat)
+    'workers': 32           # handlers actually running at once
+}
+
 # Anti-spam configuration
 SPAM_THRESHOLD = {
     'messages_per_minute': 10,
@@ -37,6 +77,142 @@ SPAM_THRESHOLD = {
     'emoji_threshold': 20
 }
 
+# Leaderboard cache configuration (bounded for the 512 MB Render plan)
+LEADERBOARD_CACHE = {
+    'max_groups': 128,           # group boards kept in memory, least recently used evicted first
+    'max_entries': 1000,         # best scores kept per group board
+    'global_max_entries': 20000, # best scores kept on the global board
+    'player_count_ttl': 60,      # seconds a players-per-scope count is reused for rank percentiles
+    'page_size': 10              # rows per leaderboard page
+}
+
+# Background jobs run by JobScheduler
+SCHEDULER_CONFIG = {
+    'default_timeout': 300,      # seconds before a job run is cancelled
+    'default_misfire_grace': 60  # seconds late a run may start; later ones follow the job's misfire policy
+}
+
+# Priority classes of outbound Bot API calls, served lowest value first
+PRIORITY_MODERATION = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_PURCHASE = 2
+PRIORITY_SCHEDULED = 3
+PRIORITY_NAMES = {
+    PRIORITY_MODERATION: 'moderation',
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_PURCHASE: 'purchase',
+    PRIORITY_SCHEDULED: 'scheduled'
+}
+
+# Every Bot API call goes through OutboundQueue, kept under Telegram's flood limits
+OUTBOUND_CONFIG = {
+    'global_rate': 30,          # messages/second for the whole bot
+    'per_chat_rate': 20 / 60,   # messages/second in a single group or channel (20/min)
+    'per_chat_burst': 3,        # short burst allowed per chat
+    'max_chat_buckets': 2000,   # idle per-chat buckets are pruned past this size
+    'max_retry_after': 3,       # RetryAfter retries per request
+    # Seconds a request may wait in the queue before it is dropped as stale (None = never)
+    'max_wait': {
+        PRIORITY_MODERATION: None,
+        PRIORITY_INTERACTIVE: None,
+        PRIORITY_PURCHASE: 120,
+        PRIORITY_SCHEDULED: 600
+    },
+    'moderation_endpoints': ('deleteMessage', 'deleteMessages', 'banChatMember', 'unbanChatMember', 'restrictChatMember')
+}
+
+# Fan-out to fomo_channels
+BROADCAST_CONFIG = {
+    'concurrency': 10,          # sends in flight at once
+    'max_attempts': 3           # per channel, for network errors
+}
+
+# Per-chat activity for the chat animator / community engager
+CHAT_ACTIVITY_CONFIG = {
+    'window_minutes': 60,         # sliding window of the per-chat message rate
+    'sender_period': 3600,        # distinct senders count the current and the previous period
+    'sender_threshold': 32,       # exact distinct senders before switching to a sketch
+    'sender_sketch_p': 8,         # 256-byte HyperLogLog per chat above the threshold
+    'max_chats': 5000,            # least recently active chats are evicted past this
+    'idle_eviction': 7 * 86400,   # chats silent this long are forgotten
+    'engager_quiet_after': 600    # community_engager skips chats active in the last 10 min
+}
+
+# In-memory metric history (raised, buy rate, chatters, game plays)
+TIMESERIES_CONFIG = {
+    # (tier, bucket seconds, buckets kept): 1 day of minutes, 30 days of hours, 2 years of days
+    'tiers': (('minute', 60, 1440), ('hour', 3600, 720), ('day', 86400, 730)),
+    'sample_interval': 60   # seconds between gauge samples
+}
+
+# Time-based community messages, keyed by the local hour community_engager fires at
+COMMUNITY_ENGAGER_MESSAGES = {
+    9: [  # Morning
+        "☀️ **GM CAT FAM!** ☀️\n\nNew day, new opportunities! Let's make it count! 🚀",
+        "🌅 **Rise and shine CaptainCats!**\n\nWho's ready to conquer the crypto world today? 💪",
+        "☕ **Morning coffee + Chart checking = Perfect combo!**\n\nHow's everyone feeling? 📈"
+    ],
+    13: [  # Afternoon
+        "🍔 **Lunch break check-in!**\n\nDon't forget to play a quick game! 🎮",
+        "⚡ **Afternoon energy boost!**\n\nPresale progress looking amazing! Who's excited? 🔥",
+        "📊 **Mid-day update!**\n\nWe're growing fast! Welcome all new members! 🎉"
+    ],
+    18: [  # Evening
+        "🌆 **Evening vibes with the best community!**\n\nHow was your day, CAT fam? 💫",
+        "🍻 **After work = CAT time!**\n\nWho's checking the game leaderboard? 🏆",
+        "🎯 **Daily reminder:**\n\nYou're early to something special! 🚀"
+    ],
+    22: [  # Night
+        "🌙 **Goodnight from CaptainCat!**\n\nRest well, tomorrow we moon! 🚀",
+        "⭐ **Night shift crew, where you at?**\n\nChart never sleeps! 📈",
+        "😴 **Sweet dreams of green candles!**\n\nSee you tomorrow, legends! 💎"
+    ]
+}
+
+# Prebuilt text/keyboards of the heavy presale commands
+RENDER_CACHE = {
+    'max_entries': 256,  # least recently used evicted first
+    'ttl': 30,           # seconds, on top of the snapshot version in the key
+    'status_ttl': 60     # /status also shows service health, which the snapshot version doesn't track
+}
+
+# Score ingestion buffer: rows are flushed with COPY every interval or batch size
+SCORE_BUFFER = {
+    'flush_interval': 0.25,  # seconds
+    'max_batch': 200
+}
+
+# Database resilience: fail fast while Postgres is down, reconnect in the background
+DB_RESILIENCE = {
+    'command_timeout': 15,          # seconds per statement
+    'acquire_timeout': 5,           # seconds waiting for a pooled connection
+    'reconnect_min_delay': 1,       # seconds, doubled after every failed attempt
+    'reconnect_max_delay': 60,
+    'breaker_failure_threshold': 5, # consecutive connection failures before opening
+    'breaker_reset_timeout': 30,    # seconds before a trial request is let through
+    'replica_pool_size': 10,
+    'replica_max_lag': 5,           # seconds of replication lag reads may tolerate before going to the primary
+    'replica_check_interval': 10    # seconds between replica lag checks
+}
+
+# Local spool for scores and transactions written while Postgres is unreachable
+SPOOL_CONFIG = {
+    'path': os.environ.get('SPOOL_PATH', 'captaincat_spool.db'),
+    'max_rows': 100000,     # rows kept on disk before new writes are refused
+    'replay_batch': 2000,   # rows per replay round trip
+    'replay_interval': 15   # seconds between replay checks
+}
+
+# Monthly range partitions on created_at
+PARTITION_CONFIG = {
+    'months_ahead': 3,                 # future partitions kept ready
+    'spam_logs_retention_months': 3,   # spam-log months kept, counting the current one
+    'spam_logs_expired': 'drop',       # 'drop' or 'archive' (detach into the archive schema)
+    'maintenance_interval': 86400,     # seconds between maintenance runs
+    'retry_interval': 300,             # seconds before retrying a failed run
+    'migration_batch': 10000           # rows copied per transaction when a table is partitioned
+}
+
 # ===== FOMO SYSTEM CONFIGURATION =====
 PRESALE_CONFIG = {
     'target': 500,  # SOL target
@@ -46,7 +222,11 @@ PRESALE_CONFIG = {
     'early_bird_bonus': 20,
     'whale_bonus': 15,
     'minimum_whale': 50,
+    'minimum_shark': 25,
     'token_price': 26787781,  # 1 SOL = 26,787,781 CAT
+    'initial_raised': 0.077168252,  # Shown until presale_state loads from the database
+    'snapshot_tick': 60,  # seconds a presale snapshot is reused when no purchase arrives
+    'announce_milestones': [25, 50, 60, 70, 75, 80, 85, 90, 95, 98, 99],  # percent
 }
 
 FOMO_MESSAGES = {
@@ -76,6 +256,16 @@ FOMO_MESSAGES = {
     ]
 }
 
+# One of these heads each /fomo message, picked per request after the cached body
+FOMO_FACTS = [
+    "🔥 {recent_buyers} people bought in the last hour!",
+    "⚡ Only {remaining} SOL spots left!",
+    "🚀 {percent:.1f}% already sold!",
+    "💎 Last buyer got {last_buyer_tokens} CAT!",
+    "⏰ Presale ends in {days_left} days!",
+    "🐋 Biggest buy today: {biggest} SOL!"
+]
+
 # Rate limiting decorator
 def rate_limit(max_calls=5, period=60, group_max_calls=10, group_period=30):
     def decorator(func):
@@ -114,10 +304,14 @@ def rate_limit(max_calls=5, period=60, group_max_calls=10, group_period=30):
         return wrapper
     return decorator
 
+# Handler name -> LatencyHistogram, exported on /metrics
+HANDLER_LATENCY: Dict[str, 'LatencyHistogram'] = {}
+
 # Error handling decorator
 def handle_errors(func):
     @wraps(func)
     async def wrapper(self, update, context):
+        started = time.monotonic()
         try:
             return await func(self, update, context)
         except BadRequest as e:
@@ -138,6 +332,11 @@ def handle_errors(func):
                 except:
                     pass
             return
+        finally:
+            histogram = HANDLER_LATENCY.get(func.__name__)
+            if histogram is None:
+                histogram = HANDLER_LATENCY[func.__name__] = LatencyHistogram()
+            histogram.observe(time.monotonic() - started)
     return wrapper
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -298,43 +497,50 @@ class SOLMonitor:
         self.notification_chat = NOTIFICATION_CHAT_ID
         self.last_transaction_lt = None
         self.monitoring = False
-        
+        # URL del tuo endpoint QuickNode (prendi quello completo dalla dashboard)
+        self.rpc_url = os.environ.get('QUICKNODE_URL', 'https://polished-lively-knowledge.solana-mainnet.quiknode.pro/77c0572ca90d17beba6759585521e1f08a39ef0c')
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.rpc_latency = LatencyHistogram()
+        self.rpc_errors = 0
+        
+    async def _rpc(self, method: str, params: list):
+        """Solana JSON-RPC call (POST) on a reused session; returns `result` or None"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        started = time.monotonic()
+        try:
+            async with self._session.post(self.rpc_url, json=payload) as response:
+                if response.status != 200:
+                    self.rpc_errors += 1
+                    logger.error(f"SOL API error: {response.status}")
+                    return None
+                data = await response.json()
+                if 'error' in data:
+                    self.rpc_errors += 1
+                    logger.error(f"SOL API error: {data['error']}")
+                    return None
+                return data.get('result')
+        finally:
+            self.rpc_latency.observe(time.monotonic() - started)
+
     async def get_latest_transactions(self) -> List[dict]:
         """Get latest transactions from SOL blockchain"""
         if not self.api_key or not self.contract_address:
             return []
         
         try:
-            # URL del tuo endpoint QuickNode (prendi quello completo dalla dashboard)
-            url = os.environ.get('QUICKNODE_URL', 'https://polished-lively-knowledge.solana-mainnet.quiknode.pro/77c0572ca90d17beba6759585521e1f08a39ef0c')
-    
-            # Solana usa JSON-RPC invece di REST params
-            payload = {
-                "jsonrpc": "2.0",
-                "id": 1,
-                "method": "getSignaturesForAddress",
-                "params": [
-                    self.contract_address,
-                    {"limit": 10}
-                 ]
-            }
-    
-            headers = {"Content-Type": "application/json"}
-    
-            # Cambia da GET a POST
-            response = requests.post(url, json=payload, headers=headers)
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('result', [])
-                    else:
-                        logger.error(f"SOL API error: {response.status}")
-                        return []
+            result = await self._rpc("getSignaturesForAddress", [self.contract_address, {"limit": 10}])
+            return result or []
         except Exception as e:
+            self.rpc_errors += 1
             logger.error(f"Error fetching transactions: {e}")
             return []
+
+    async def close(self):
+        self.monitoring = False
+        if self._session and not self._session.closed:
+            await self._session.close()
     
     def parse_transaction(self, tx: dict) -> Optional[dict]:
         """Parse transaction data"""
@@ -392,24 +598,18 @@ class SOLMonitor:
                     if not self.last_transaction_lt or current_lt > self.last_transaction_lt:
                         self.last_transaction_lt = current_lt
                     
+                    # Persist first so a restart never counts the same purchase twice
+                    if not await self.bot.record_purchase(tx_data):
+                        continue
+                    
                     # Send notification
                     message = await self.bot.format_transaction_message(tx_data)
                     
-                    try:
-                        await self.bot.app.bot.send_message(
-                            chat_id=self.notification_chat,
-                            text=message,
-                            parse_mode='Markdown'
-                        )
+                    result = await self.bot.broadcaster.send(
+                        self.notification_chat, message, PRIORITY_PURCHASE, parse_mode='Markdown'
+                    )
+                    if result.ok:
                         logger.info(f"Transaction notification sent: {tx_data['amount']} SOL")
-                        
-                        # Log transaction to database
-                        await self.bot.db.log_transaction(
-                            tx_data['hash'], tx_data['from_address'], 
-                            tx_data['amount'], tx_data['timestamp']
-                        )
-                    except Exception as e:
-                        logger.error(f"Error sending transaction notification: {e}")
                 
                 # Wait before next check
                 await asyncio.sleep(30)  # Check every 30 seconds
@@ -423,95 +623,1269 @@ class SOLMonitor:
         self.monitoring = False
         logger.info("SOL transaction monitoring stopped")
 
+class LeaderboardBoard:
+    """Best score per user for one scope, sorted like the leaderboard query"""
+    __slots__ = ('keys', 'entries', 'max_entries', 'complete')
+
+    def __init__(self, rows, max_entries: int):
+        self.max_entries = max_entries
+        self.complete = len(rows) <= max_entries
+        # entries: user_id -> (user_id, username, first_name, score, level, created_at)
+        self.entries: Dict[int, tuple] = {}
+        for row in rows[:max_entries]:
+            self.entries[row['user_id']] = (
+                row['user_id'], row['username'], row['first_name'],
+                row['score'], row['level'], row['created_at']
+            )
+        # keys: (-score, created_at, user_id) -> score DESC, created_at ASC
+        self.keys = sorted(self._key(entry) for entry in self.entries.values())
+
+    @staticmethod
+    def _key(entry: tuple) -> tuple:
+        return (-entry[3], entry[5], entry[0])
+
+    def offer(self, entry: tuple):
+        """Apply a new score, keeping only the best one per user"""
+        user_id, score, created_at = entry[0], entry[3], entry[5]
+        current = self.entries.get(user_id)
+        if current:
+            # Same tie-break as ROW_NUMBER() ... ORDER BY score DESC, created_at DESC
+            if score < current[3] or (score == current[3] and created_at < current[5]):
+                return
+            old_key = self._key(current)
+            del self.keys[bisect_left(self.keys, old_key)]
+            del self.entries[user_id]
+
+        key = self._key(entry)
+        if len(self.keys) >= self.max_entries and key > self.keys[-1]:
+            # Below the cut-off of a full board
+            self.complete = False
+            return
+
+        insort(self.keys, key)
+        self.entries[user_id] = entry
+        if len(self.keys) > self.max_entries:
+            dropped = self.keys.pop()
+            del self.entries[dropped[2]]
+            self.complete = False
+
+    def top(self, limit: int) -> Optional[List[dict]]:
+        """Top N rows, or None if the board was truncated below N"""
+        if limit > len(self.keys) and not self.complete:
+            return None
+        return [self._row(self.entries[key[2]]) for key in self.keys[:limit]]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based position of a user, or None if not on the board"""
+        entry = self.entries.get(user_id)
+        if not entry:
+            return None
+        return bisect_left(self.keys, self._key(entry)) + 1
+
+    def page(self, cursor: Optional[tuple], limit: int, backwards: bool = False,
+             strict: bool = True) -> Optional[tuple]:
+        """Keyset page next to a cursor key: (rows, start, more).
+        None if the page runs past a truncated board (unless strict is off)"""
+        if backwards:
+            if strict and not self.complete and (not self.keys or cursor > self.keys[-1]):
+                return None
+            end = bisect_left(self.keys, cursor)
+            start = max(0, end - limit)
+            more = start > 0
+        else:
+            start = bisect_right(self.keys, cursor) if cursor else 0
+            end = start + limit
+            if strict and not self.complete and end >= len(self.keys):
+                return None
+            more = end < len(self.keys)
+        return [self._row(self.entries[key[2]]) for key in self.keys[start:end]], start, more
+
+    def score_rank(self, score: int) -> int:
+        """1-based competition rank of a score: players on equal scores share it"""
+        # (-score,) sorts before every key with that score
+        return bisect_left(self.keys, (-score,)) + 1
+
+    @staticmethod
+    def _row(entry: tuple) -> dict:
+        return {
+            'user_id': entry[0],
+            'username': entry[1],
+            'first_name': entry[2],
+            'score': entry[3],
+            'level': entry[4],
+            'created_at': entry[5]
+        }
+
+_CURSOR_EPOCH = datetime(1970, 1, 1)
+
+def encode_leaderboard_cursor(direction: str, position: int, row) -> str:
+    """Callback data for a leaderboard page button; stays well under Telegram's 64 bytes"""
+    micros = (row['created_at'] - _CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"lb:{direction}:{position}:{row['score']}:{micros}:{row['user_id']}"
+
+def decode_leaderboard_cursor(data: str) -> tuple:
+    """(board key, position, backwards) from encode_leaderboard_cursor data"""
+    _, direction, position, score, micros, user_id = data.split(':')
+    created_at = _CURSOR_EPOCH + timedelta(microseconds=int(micros))
+    return (-int(score), created_at, int(user_id)), int(position), direction == 'p'
+
+class LeaderboardCache:
+    """In-memory best-score boards per group plus a global one, LRU-evicted"""
+    GLOBAL = None
+
+    def __init__(self, loader, max_groups: int = LEADERBOARD_CACHE['max_groups'],
+                 max_entries: int = LEADERBOARD_CACHE['max_entries'],
+                 global_max_entries: int = LEADERBOARD_CACHE['global_max_entries']):
+        self._loader = loader  # async (group_id, limit) -> rows
+        self.max_groups = max_groups
+        self.max_entries = max_entries
+        self.global_max_entries = global_max_entries
+        self._boards: "OrderedDict[Optional[int], LeaderboardBoard]" = OrderedDict()
+        self._loading: Dict[Optional[int], asyncio.Future] = {}
+        self._pending: Dict[Optional[int], List[tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_board(self, group_id: Optional[int]) -> LeaderboardBoard:
+        """Return the board for a group (None = global), loading it on first use"""
+        board = self._boards.get(group_id)
+        if board is not None:
+            self.hits += 1
+            self._boards.move_to_end(group_id)
+            return board
+
+        if group_id in self._loading:
+            return await asyncio.shield(self._loading[group_id])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[group_id] = future
+        self._pending[group_id] = []
+        try:
+            max_entries = self.global_max_entries if group_id is self.GLOBAL else self.max_entries
+            # One extra row tells us whether the board had to be truncated
+            rows = await self._loader(group_id, max_entries + 1)
+            board = LeaderboardBoard(rows, max_entries)
+            # Scores saved while the board was loading
+            for entry in self._pending[group_id]:
+                board.offer(entry)
+            self._store(group_id, board)
+            future.set_result(board)
+            return board
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting on it
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                # Loader cancelled (CancelledError is not an Exception): fail the waiters, don't strand them
+                future.set_exception(RuntimeError(f"leaderboard load for {group_id} was cancelled"))
+                future.exception()
+            self._loading.pop(group_id, None)
+            self._pending.pop(group_id, None)
+
+    def _store(self, group_id: Optional[int], board: LeaderboardBoard):
+        self._boards[group_id] = board
+        self._boards.move_to_end(group_id)
+        group_boards = len(self._boards) - (self.GLOBAL in self._boards)
+        while group_boards > self.max_groups:
+            for key in self._boards:
+                if key is not self.GLOBAL:
+                    del self._boards[key]
+                    break
+            group_boards -= 1
+
+    async def top(self, group_id: Optional[int], limit: int) -> List[dict]:
+        board = await self.get_board(group_id)
+        rows = board.top(limit)
+        if rows is None:
+            # Deeper than what we keep in memory
+            return list(await self._loader(group_id, limit))
+        return rows
+
+    async def rank(self, user_id: int, group_id: Optional[int] = None) -> Optional[int]:
+        board = await self.get_board(group_id)
+        return board.rank(user_id)
+
+    def record(self, user_id, username, first_name, score, level, created_at, group_id=None):
+        """Write-through for a saved score; boards not in memory are left alone"""
+        entry = (user_id, username, first_name, score, level, created_at)
+        scopes = [self.GLOBAL] if group_id is None else [self.GLOBAL, group_id]
+        for scope in scopes:
+            if scope in self._boards:
+                self._boards[scope].offer(entry)
+            elif scope in self._pending:
+                self._pending[scope].append(entry)
+
+    def clear(self):
+        self._boards.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            'boards': len(self._boards),
+            'entries': sum(len(board.keys) for board in self._boards.values()),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+# ===== SCHEMA MIGRATIONS =====
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month_index = dt.year * 12 + dt.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+def _partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+async def ensure_month_partitions(conn, table: str, first_month: datetime, last_month: datetime,
+                                  prefix: Optional[str] = None) -> int:
+    """Create the monthly partitions of a table between two months (inclusive).
+    prefix names the partitions when the table is still a staging copy."""
+    prefix = prefix or table
+    default = f"{prefix}_default"
+    has_default = await conn.fetchval('SELECT to_regclass($1) IS NOT NULL', default)
+    created = 0
+    month = _month_start(first_month)
+    while month <= last_month:
+        next_month = _add_months(month, 1)
+        name = _partition_name(prefix, month)
+        bounds = f"FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')"
+        exists = await conn.fetchval('SELECT to_regclass($1) IS NOT NULL', name)
+        if exists:
+            pass
+        elif has_default and await conn.fetchval(
+            f'SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= $1 AND created_at < $2)', month, next_month
+        ):
+            # Rows landed in the default partition while this month had none:
+            # move them into a new table and attach it, or the attach would fail
+            async with conn.transaction():
+                await conn.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                await conn.execute(f'''
+                    WITH moved AS (
+                        DELETE FROM {default} WHERE created_at >= $1 AND created_at < $2 RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                ''', month, next_month)
+                await conn.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}')
+            created += 1
+        else:
+            await conn.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES {bounds}")
+            created += 1
+        month = next_month
+    return created
+
+async def ensure_default_partition(conn, table: str, prefix: Optional[str] = None):
+    """Catch-all partition, so inserts outside the monthly ones never fail"""
+    await conn.execute(f'CREATE TABLE IF NOT EXISTS {prefix or table}_default PARTITION OF {table} DEFAULT')
+
+async def _partition_table(conn, table: str, columns_ddl: str, indexes: List[Tuple[str, str]]):
+    """Rebuild a plain table as a monthly partitioned one, keeping its rows and id sequence.
+
+    Rows are copied into a staging table in batches while the table stays writable; only
+    the rows written during the copy are moved under the exclusive lock. Both tables are
+    insert-only, so copied rows can't change afterwards. A rerun resumes the copy.
+    """
+    already = await conn.fetchval(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass($1))', table
+    )
+    if already:
+        return
+
+    staging = f"{table}_partitioned"
+    sequence = await conn.fetchval("SELECT pg_get_serial_sequence($1, 'id')", table)
+    names = [row['name'] for row in await conn.fetch('''
+        SELECT quote_ident(column_name) AS name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = $1
+        ORDER BY ordinal_position
+    ''', table)]
+    columns = ', '.join(names)
+    select_list = ', '.join(
+        'COALESCE(created_at, CURRENT_TIMESTAMP)' if name == 'created_at' else name for name in names
+    )
+
+    await conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {staging} (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            {columns_ddl},
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    ''')
+    now = datetime.now()
+    first_row = await conn.fetchval(f'SELECT MIN(created_at) FROM {table}')
+    await ensure_month_partitions(
+        conn, staging, first_row or now, _add_months(_month_start(now), PARTITION_CONFIG['months_ahead']), prefix=table
+    )
+    await ensure_default_partition(conn, staging, prefix=table)
+    for name, definition in indexes:
+        await conn.execute(f'CREATE INDEX IF NOT EXISTS {name}_partitioned ON {staging} {definition}')
+
+    # A brief SHARE lock waits out in-flight inserts, so no id up to `horizon` can still appear
+    async with conn.transaction():
+        await conn.execute(f'LOCK TABLE {table} IN SHARE MODE')
+        horizon = await conn.fetchval(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+    copied = await conn.fetchval(f'SELECT COALESCE(MAX(id), 0) FROM {staging}')
+    while copied < horizon:
+        last = await conn.fetchval(f'''
+            WITH batch AS (
+                INSERT INTO {staging} ({columns})
+                SELECT {select_list} FROM {table}
+                WHERE id > $1 AND id <= $2 ORDER BY id LIMIT {PARTITION_CONFIG['migration_batch']}
+                RETURNING id
+            )
+            SELECT MAX(id) FROM batch
+        ''', copied, horizon)
+        if last is None:
+            break
+        copied = last
+
+    async with conn.transaction():
+        await conn.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        # Rows inserted since the horizon was taken
+        await conn.execute(
+            f'INSERT INTO {staging} ({columns}) SELECT {select_list} FROM {table} WHERE id > $1', horizon
+        )
+        # Keep the id sequence alive when the old table is dropped
+        await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+        await conn.execute(f'DROP TABLE {table}')
+        await conn.execute(f'ALTER TABLE {staging} RENAME TO {table}')
+        await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+        primary_key = await conn.fetchval(
+            "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass($1) AND contype = 'p'", table
+        )
+        await conn.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {primary_key} TO {table}_pkey')
+        for name, _ in indexes:
+            await conn.execute(f'ALTER INDEX {name}_partitioned RENAME TO {name}')
+
+async def _migration_partition_by_month(conn):
+    """captaincat_scores and spam_logs become RANGE (created_at) partitioned by month"""
+    await _partition_table(conn, 'captaincat_scores', '''
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            score INTEGER NOT NULL,
+            level INTEGER DEFAULT 1,
+            coins_collected INTEGER DEFAULT 0,
+            enemies_defeated INTEGER DEFAULT 0,
+            play_time INTEGER DEFAULT 0,
+            group_id BIGINT''', [
+        ('idx_user_scores', '(user_id)'),
+        ('idx_group_scores', '(group_id)'),
+        ('idx_score_ranking', '(score DESC, created_at DESC)'),
+        ('idx_group_user_best', '(group_id, user_id, score DESC, created_at DESC)')
+    ])
+    await _partition_table(conn, 'spam_logs', '''
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            message_text TEXT,
+            spam_score FLOAT DEFAULT 0,
+            action_taken TEXT''', [
+        ('idx_spam_user', '(user_id, created_at)')
+    ])
+
+async def _migration_default_partitions(conn):
+    """Catch-all partitions for tables partitioned before version 4 created them"""
+    for table in ('captaincat_scores', 'spam_logs'):
+        await ensure_default_partition(conn, table)
+
+async def _migration_user_stats(conn):
+    """Per-user aggregate maintained by save_score, backfilled from existing scores"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id BIGINT PRIMARY KEY,
+            best_score INTEGER NOT NULL DEFAULT 0,
+            max_level INTEGER NOT NULL DEFAULT 1,
+            total_coins BIGINT NOT NULL DEFAULT 0,
+            total_enemies BIGINT NOT NULL DEFAULT 0,
+            games_played INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    # Block save_score upserts while we copy
+    await conn.execute('LOCK TABLE user_stats IN SHARE ROW EXCLUSIVE MODE')
+    needs_backfill = await conn.fetchval('''
+        SELECT NOT EXISTS (SELECT 1 FROM user_stats)
+               AND EXISTS (SELECT 1 FROM captaincat_scores)
+    ''')
+    if needs_backfill:
+        result = await conn.execute('''
+            INSERT INTO user_stats
+            (user_id, best_score, max_level, total_coins, total_enemies, games_played)
+            SELECT user_id, MAX(score), COALESCE(MAX(level), 1),
+                   COALESCE(SUM(coins_collected), 0), COALESCE(SUM(enemies_defeated), 0), COUNT(*)
+            FROM captaincat_scores
+            GROUP BY user_id
+            ON CONFLICT (user_id) DO NOTHING
+        ''')
+        logger.info(f"user_stats backfilled: {result}")
+
+# Applied in order; never edit a migration once it has shipped, add a new one.
+# 'sql' statements run one by one, 'apply' is an async callable taking the connection.
+# Non-transactional migrations are needed for CREATE INDEX CONCURRENTLY.
+MIGRATIONS = [
+    {
+        'version': 1,
+        'name': 'baseline',
+        'transactional': True,
+        'sql': [
+            '''
+            CREATE TABLE IF NOT EXISTS captaincat_scores (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                username TEXT,
+                first_name TEXT,
+                score INTEGER NOT NULL,
+                level INTEGER DEFAULT 1,
+                coins_collected INTEGER DEFAULT 0,
+                enemies_defeated INTEGER DEFAULT 0,
+                play_time INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                group_id BIGINT
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS spam_logs (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                chat_id BIGINT NOT NULL,
+                message_text TEXT,
+                spam_score FLOAT DEFAULT 0,
+                action_taken TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS transaction_logs (
+                id SERIAL PRIMARY KEY,
+                tx_hash TEXT UNIQUE NOT NULL,
+                from_address TEXT,
+                amount FLOAT,
+                timestamp BIGINT,
+                notified BOOLEAN DEFAULT FALSE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_user_scores ON captaincat_scores(user_id)',
+            'CREATE INDEX IF NOT EXISTS idx_group_scores ON captaincat_scores(group_id)',
+            'CREATE INDEX IF NOT EXISTS idx_score_ranking ON captaincat_scores(score DESC, created_at DESC)',
+            'CREATE INDEX IF NOT EXISTS idx_spam_user ON spam_logs(user_id, created_at)',
+            'CREATE INDEX IF NOT EXISTS idx_tx_hash ON transaction_logs(tx_hash)'
+        ]
+    },
+    {
+        'version': 2,
+        'name': 'user_stats',
+        'transactional': True,
+        'apply': _migration_user_stats
+    },
+    {
+        'version': 3,
+        'name': 'group_best_score_index',
+        'transactional': False,
+        # Serves the per-group best-score query used to load leaderboard boards
+        'sql': [
+            '''
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_group_user_best
+            ON captaincat_scores(group_id, user_id, score DESC, created_at DESC)
+            '''
+        ]
+    },
+    {
+        'version': 4,
+        'name': 'monthly_partitions',
+        # Copies in batches, each committed on its own; resumes after an interruption
+        'transactional': False,
+        'apply': _migration_partition_by_month
+    },
+    {
+        'version': 5,
+        'name': 'score_uid',
+        'transactional': True,
+        # Client-generated id so spooled scores can be replayed idempotently.
+        # Unique indexes on a partitioned table must include the partition key.
+        'sql': [
+            'ALTER TABLE captaincat_scores ADD COLUMN IF NOT EXISTS score_uid UUID',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_score_uid ON captaincat_scores(score_uid, created_at)'
+        ]
+    },
+    {
+        'version': 6,
+        'name': 'presale_state',
+        'transactional': True,
+        # Single-row presale totals, derived from transaction_logs and kept in step by log_transaction
+        'sql': [
+            '''
+            CREATE TABLE IF NOT EXISTS presale_state (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                raised DOUBLE PRECISION NOT NULL DEFAULT 0,
+                total_buys INTEGER NOT NULL DEFAULT 0,
+                unique_buyers INTEGER NOT NULL DEFAULT 0,
+                last_buy_time TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_tx_from_address ON transaction_logs(from_address)',
+            'LOCK TABLE transaction_logs IN SHARE MODE',
+            '''
+            INSERT INTO presale_state (id, raised, total_buys, unique_buyers, last_buy_time)
+            SELECT 1, COALESCE(SUM(amount), 0), COUNT(*), COUNT(DISTINCT from_address), MAX(created_at)
+            FROM transaction_logs
+            ON CONFLICT (id) DO NOTHING
+            '''
+        ]
+    },
+    {
+        'version': 7,
+        'name': 'user_stats_best_score_index',
+        'transactional': False,
+        # Rank lookups count the players above a score for users beyond the in-memory board
+        'sql': [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_stats_best ON user_stats(best_score DESC)'
+        ]
+    },
+    {
+        'version': 8,
+        'name': 'user_stats_best_row',
+        'transactional': True,
+        # Keep the best game of each player on user_stats so the global board needs no window query
+        'sql': [
+            '''
+            ALTER TABLE user_stats
+                ADD COLUMN IF NOT EXISTS best_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS best_level INTEGER NOT NULL DEFAULT 1,
+                ADD COLUMN IF NOT EXISTS username TEXT,
+                ADD COLUMN IF NOT EXISTS first_name TEXT
+            ''',
+            '''
+            UPDATE user_stats s SET
+                best_at = b.created_at, best_level = COALESCE(b.level, 1),
+                username = b.username, first_name = b.first_name
+            FROM (
+                SELECT DISTINCT ON (user_id) user_id, created_at, level, username, first_name
+                FROM captaincat_scores
+                ORDER BY user_id, score DESC, created_at DESC
+            ) b
+            WHERE s.user_id = b.user_id
+            ''',
+            'UPDATE user_stats SET best_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE best_at IS NULL',
+            '''
+            ALTER TABLE user_stats
+                ALTER COLUMN best_at SET DEFAULT CURRENT_TIMESTAMP,
+                ALTER COLUMN best_at SET NOT NULL
+            '''
+        ]
+    },
+    {
+        'version': 9,
+        'name': 'user_stats_board_index',
+        'transactional': False,
+        # Matches the board order (score DESC, best_at, user_id) so keyset pages are index range scans
+        'sql': [
+            '''
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_stats_board
+            ON user_stats ((-best_score), best_at, user_id)
+            '''
+        ]
+    },
+    {
+        'version': 10,
+        'name': 'announcements',
+        'transactional': True,
+        # Whale and milestone alerts already sent, so restarts and replicas don't repeat them
+        'sql': [
+            '''
+            CREATE TABLE IF NOT EXISTS announcements (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                announced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, key)
+            )
+            '''
+        ]
+    },
+    {
+        'version': 11,
+        'name': 'default_partitions',
+        'transactional': True,
+        'apply': _migration_default_partitions
+    }
+]
+
+USER_STATS_BOARD_SELECT = '''
+    SELECT user_id, username, first_name, best_score AS score, best_level AS level, best_at AS created_at
+    FROM user_stats
+'''
+
+# Logs a purchase and folds it into presale_state in one statement. The EXISTS
+# check runs on the pre-insert snapshot, so it only sees earlier purchases; a NULL
+# buyer never counts, matching COUNT(DISTINCT from_address) in the backfill.
+RECORD_PURCHASE_SQL = '''
+    WITH ins AS (
+        INSERT INTO transaction_logs (tx_hash, from_address, amount, timestamp, notified, created_at)
+        VALUES ($1, $2, $3, $4, TRUE, COALESCE($5::timestamp, CURRENT_TIMESTAMP))
+        ON CONFLICT (tx_hash) DO NOTHING
+        RETURNING from_address, amount, created_at
+    )
+    UPDATE presale_state SET
+        raised = presale_state.raised + ins.amount,
+        total_buys = presale_state.total_buys + 1,
+        unique_buyers = presale_state.unique_buyers + CASE WHEN ins.from_address IS NULL OR EXISTS (
+            SELECT 1 FROM transaction_logs t WHERE t.from_address = ins.from_address
+        ) THEN 0 ELSE 1 END,
+        last_buy_time = ins.created_at,
+        updated_at = CURRENT_TIMESTAMP
+    FROM ins
+    WHERE presale_state.id = 1
+    RETURNING presale_state.raised, presale_state.total_buys,
+              presale_state.unique_buyers, presale_state.last_buy_time
+'''
+
+class SchemaMigrator:
+    """Applies pending MIGRATIONS under an advisory lock"""
+    # Arbitrary key shared by every bot instance running migrations
+    ADVISORY_LOCK_KEY = 0x43415443  # 'CATC'
+
+    def __init__(self, migrations: List[dict]):
+        self.migrations = sorted(migrations, key=lambda m: m['version'])
+        self.latest = self.migrations[-1]['version'] if self.migrations else 0
+
+    async def current_version(self, conn) -> int:
+        try:
+            return await conn.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        except asyncpg.UndefinedTableError:
+            return 0
+
+    async def run(self, pool):
+        async with pool.acquire() as conn:
+            # Fast path: one query and no DDL when the schema is current
+            if await self.current_version(conn) >= self.latest:
+                logger.info(f"Database schema up to date (version {self.latest})")
+                return
+
+            await conn.execute('SELECT pg_advisory_lock($1)', self.ADVISORY_LOCK_KEY)
+            try:
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Another instance may have migrated while we waited for the lock
+                current = await self.current_version(conn)
+                for migration in self.migrations:
+                    if migration['version'] <= current:
+                        continue
+                    started = time.monotonic()
+                    await self._apply(conn, migration)
+                    logger.info(
+                        f"Applied migration {migration['version']} ({migration['name']}) "
+                        f"in {time.monotonic() - started:.2f}s"
+                    )
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', self.ADVISORY_LOCK_KEY)
+
+    async def _apply(self, conn, migration: dict):
+        if migration.get('transactional', True):
+            async with conn.transaction():
+                await self._run_steps(conn, migration)
+                await self._record(conn, migration)
+        else:
+            # Each statement commits on its own; steps must be idempotent so a
+            # failed run can simply be retried on the next boot
+            await self._run_steps(conn, migration)
+            await self._record(conn, migration)
+
+    async def _run_steps(self, conn, migration: dict):
+        for statement in migration.get('sql', []):
+            if 'CONCURRENTLY' in statement.upper():
+                await self._drop_invalid_index(conn, statement)
+            await conn.execute(statement)
+        if migration.get('apply'):
+            await migration['apply'](conn)
+
+    async def _drop_invalid_index(self, conn, statement: str):
+        """An interrupted concurrent build leaves an INVALID index behind that
+        IF NOT EXISTS would otherwise silently keep"""
+        match = re.search(r'INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', statement, re.IGNORECASE)
+        if not match:
+            return
+        invalid = await conn.fetchval('''
+            SELECT NOT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = $1
+        ''', match.group(1))
+        if invalid:
+            logger.warning(f"Dropping invalid index {match.group(1)} left by an interrupted build")
+            await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}')
+
+    async def _record(self, conn, migration: dict):
+        await conn.execute('''
+            INSERT INTO schema_version (version, name) VALUES ($1, $2)
+            ON CONFLICT (version) DO NOTHING
+        ''', migration['version'], migration['name'])
+
+# Column order of the rows handled by ScoreWriteBuffer
+SCORE_COLUMNS = [
+    'user_id', 'username', 'first_name', 'score', 'level', 'coins_collected',
+    'enemies_defeated', 'play_time', 'group_id', 'created_at', 'score_uid'
+]
+
+# Per-connection staging table for idempotent batch inserts
+SCORE_STAGING_DDL = '''
+    CREATE TEMP TABLE IF NOT EXISTS score_staging (
+        user_id BIGINT,
+        username TEXT,
+        first_name TEXT,
+        score INTEGER,
+        level INTEGER,
+        coins_collected INTEGER,
+        enemies_defeated INTEGER,
+        play_time INTEGER,
+        group_id BIGINT,
+        created_at TIMESTAMP,
+        score_uid UUID
+    ) ON COMMIT DELETE ROWS
+'''
+
+# save_score result when the database was down and the score went to the local spool
+SCORE_SPOOLED = 'spooled'
+
+class ScoreWriteBuffer:
+    """Collects finished games and writes them in batches"""
+    def __init__(self, writer, fallback=None, flush_interval: float = SCORE_BUFFER['flush_interval'],
+                 max_batch: int = SCORE_BUFFER['max_batch']):
+        self._writer = writer  # async (rows) -> None
+        self._fallback = fallback  # async (rows) -> bool, used when the database is unreachable
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._rows: List[Tuple[tuple, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.batches_written = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+    
+    async def submit(self, row: tuple) -> bool:
+        """Queue a score row and wait until its batch is written"""
+        if not self._task or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._rows.append((row, future))
+        if len(self._rows) >= self.max_batch:
+            self._wakeup.set()
+        return await future
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self):
+        """Write everything queued so far"""
+        while self._rows:
+            batch, self._rows = self._rows[:self.max_batch], self._rows[self.max_batch:]
+            await self._write(batch)
+    
+    async def _write(self, batch: List[Tuple[tuple, asyncio.Future]]):
+        try:
+            await self._writer([row for row, _ in batch])
+            self.batches_written += 1
+            self.rows_written += len(batch)
+            results = [True] * len(batch)
+        except (DatabaseUnavailable,) + DB_CONNECTION_ERRORS as e:
+            spooled = bool(self._fallback) and await self._fallback([row for row, _ in batch])
+            if spooled:
+                logger.warning(f"Database unreachable ({e}), {len(batch)} scores spooled locally")
+            else:
+                logger.error(f"Error saving score: {e}")
+                self.rows_failed += len(batch)
+            results = [SCORE_SPOOLED if spooled else False] * len(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry one by one so a single bad row doesn't lose the others
+                logger.warning(f"Score batch of {len(batch)} failed ({e}), retrying rows individually")
+                for item in batch:
+                    await self._write([item])
+                return
+            logger.error(f"Error saving score: {e}")
+            self.rows_failed += 1
+            results = [False]
+        
+        for (_, future), saved in zip(batch, results):
+            if not future.done():
+                future.set_result(saved)
+    
+    async def stop(self):
+        """Flush pending rows and stop the background flusher"""
+        self._stopping = True
+        if self._task:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self._stopping = False
+    
+    def get_stats(self) -> dict:
+        return {
+            'pending': len(self._rows),
+            'batches_written': self.batches_written,
+            'rows_written': self.rows_written,
+            'rows_failed': self.rows_failed
+        }
+
+class DatabaseUnavailable(Exception):
+    """Raised instead of querying while the database is down"""
+
+# Errors that mean Postgres is unreachable, as opposed to a bad or slow query.
+# Not OSError: TimeoutError is one, and a query timeout doesn't mean the database is down.
+DB_CONNECTION_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    ConnectionError
+)
+# While acquiring, any socket error or timeout means no connection could be made
+DB_ACQUIRE_ERRORS = DB_CONNECTION_ERRORS + (OSError, asyncio.TimeoutError)
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial -> closed"""
+    def __init__(self, failure_threshold: int = DB_RESILIENCE['breaker_failure_threshold'],
+                 reset_timeout: float = DB_RESILIENCE['breaker_reset_timeout']):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    @property
+    def rejecting(self) -> bool:
+        """Open and still inside the reset timeout"""
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Let a single trial request through
+            self.state = 'half_open'
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != 'closed':
+            logger.info("Database circuit breaker closed")
+        self.state = 'closed'
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.warning(f"Database circuit breaker opened after {self.failures} failures")
+                self.times_opened += 1
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds)"""
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+class LocalSpool:
+    """Append-only SQLite spool, replayed into Postgres once it is reachable again"""
+    def __init__(self, path: str = SPOOL_CONFIG['path'], max_rows: int = SPOOL_CONFIG['max_rows']):
+        self.path = path
+        self.max_rows = max_rows
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS spool (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            ''')
+            self.pending = conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _open(self) -> int:
+        with self._lock:
+            self._db()
+            return self.pending
+
+    async def open(self) -> int:
+        """Open the spool file and count rows left by a previous run"""
+        return await asyncio.to_thread(self._open)
+
+    def _append(self, kind: str, rows: List[tuple]) -> bool:
+        with self._lock:
+            conn = self._db()
+            if self.pending + len(rows) > self.max_rows:
+                self.dropped += len(rows)
+                return False
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(
+                    'INSERT INTO spool (kind, payload) VALUES (?, ?)',
+                    [(kind, json.dumps(row, default=str)) for row in rows]
+                )
+            self.pending += len(rows)
+            self.spooled += len(rows)
+            return True
+
+    def _read(self, kind: str, limit: int) -> List[Tuple[int, list]]:
+        with self._lock:
+            cursor = self._db().execute(
+                'SELECT seq, payload FROM spool WHERE kind = ? ORDER BY seq LIMIT ?', (kind, limit)
+            )
+            return [(seq, json.loads(payload)) for seq, payload in cursor]
+
+    def _delete(self, seqs: List[int]):
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany('DELETE FROM spool WHERE seq = ?', [(seq,) for seq in seqs])
+            self.pending -= len(seqs)
+
+    async def append(self, kind: str, rows: List[tuple]) -> bool:
+        """Store rows on disk; False if the spool is full or unwritable"""
+        try:
+            stored = await asyncio.to_thread(self._append, kind, rows)
+        except Exception as e:
+            logger.error(f"Error writing to local spool: {e}")
+            return False
+        if not stored:
+            logger.error(f"Local spool full ({self.max_rows} rows), {len(rows)} {kind} rows dropped")
+        return stored
+
+    async def read(self, kind: str, limit: int) -> List[Tuple[int, list]]:
+        return await asyncio.to_thread(self._read, kind, limit)
+
+    async def delete(self, seqs: List[int]):
+        await asyncio.to_thread(self._delete, seqs)
+        self.replayed += len(seqs)
+
+    def get_stats(self) -> dict:
+        return {
+            'pending': self.pending,
+            'spooled': self.spooled,
+            'replayed': self.replayed,
+            'dropped': self.dropped
+        }
+
+def _decode_spooled_score(row: list) -> tuple:
+    row[9] = datetime.fromisoformat(row[9])
+    row[10] = uuid.UUID(row[10])
+    return tuple(row)
+
+def _decode_spooled_transaction(row: list) -> tuple:
+    # Rows spooled before created_at was recorded fall back to the replay time
+    if len(row) < 5:
+        row.append(None)
+    elif row[4] is not None:
+        row[4] = datetime.fromisoformat(row[4])
+    return tuple(row)
+
 class GameDatabase:
     def __init__(self):
         self.pool = None
-        self._connection_attempts = 0
-        self._max_attempts = 3
+        self.breaker = CircuitBreaker()
+        self.acquire_wait = LatencyHistogram()
+        self.query_latency: Dict[str, LatencyHistogram] = {}
+        self._reconnect_task: Optional[asyncio.Task] = None
+        # Optional read replica: reads go there while it is reachable and fresh enough
+        self.read_pool = None
+        self.replica_breaker = CircuitBreaker()
+        self.replica_lag: Optional[float] = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._replica_task: Optional[asyncio.Task] = None
+        self.on_transactions_replayed = None  # async callback after spooled purchases reach Postgres
+        self.leaderboard_cache = LeaderboardCache(self._fetch_leaderboard)
+        self._player_counts: Dict[Optional[int], tuple] = {}  # scope -> (count, expires_at)
+        self.spool = LocalSpool()
+        self.score_buffer = ScoreWriteBuffer(self.write_score_batch, self._spool_scores)
     
-    async def init_pool(self):
-        if DATABASE_URL and self._connection_attempts < self._max_attempts:
+    @property
+    def available(self) -> bool:
+        return self.pool is not None and not self.breaker.rejecting
+    
+    @property
+    def replica_usable(self) -> bool:
+        return (self.read_pool is not None and not self.replica_breaker.rejecting
+                and self.replica_lag is not None and self.replica_lag <= DB_RESILIENCE['replica_max_lag'])
+    
+    async def init_pool(self) -> bool:
+        """Create the pool; on failure keep retrying in the background"""
+        if not DATABASE_URL:
+            return False
+        try:
+            # Rows spooled before a crash/redeploy are replayed as soon as the pool is up
+            leftover = await self.spool.open()
+            if leftover:
+                logger.info(f"Local spool holds {leftover} rows from a previous run")
+        except Exception as e:
+            logger.error(f"Error opening local spool: {e}")
+        if DATABASE_READ_URL and not self._replica_task:
+            self._replica_task = asyncio.create_task(self._replica_monitor_loop())
+        try:
+            await self._connect()
+            return True
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}. Retrying in background.")
+            self.start_reconnect()
+            return False
+    
+    async def _connect(self):
+        pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=1,
+            max_size=10,
+            command_timeout=DB_RESILIENCE['command_timeout'],
+            server_settings={'jit': 'off'}
+        )
+        try:
+            await SchemaMigrator(MIGRATIONS).run(pool)
+        except Exception:
+            await pool.close()
+            raise
+        self.pool = pool
+        self.breaker.record_success()
+        logger.info("Database pool created successfully")
+    
+    def start_reconnect(self):
+        if not self._reconnect_task or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+    
+    async def _reconnect_loop(self):
+        """Retry pool creation with exponential backoff and jitter"""
+        delay = DB_RESILIENCE['reconnect_min_delay']
+        attempt = 0
+        while not self.pool:
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            attempt += 1
             try:
-                self.pool = await asyncpg.create_pool(
-                    DATABASE_URL,
-                    min_size=1,
-                    max_size=10,
-                    command_timeout=60,
-                    server_settings={'jit': 'off'}
-                )
-                await self.create_tables()
-                logger.info("Database pool created successfully")
+                await self._connect()
+                logger.info(f"Database reconnected after {attempt} attempts")
             except Exception as e:
-                self._connection_attempts += 1
-                logger.error(f"Database connection failed (attempt {self._connection_attempts}): {e}")
-                if self._connection_attempts >= self._max_attempts:
-                    logger.error("Max database connection attempts reached. Running without database.")
+                logger.warning(f"Database reconnect attempt {attempt} failed: {e}")
+                delay = min(delay * 2, DB_RESILIENCE['reconnect_max_delay'])
     
-    async def create_tables(self):
-        if not self.pool:
-            return
+    async def _replica_monitor_loop(self):
+        """Keep the replica pool open and its replication lag up to date"""
+        while True:
+            try:
+                if not self.read_pool:
+                    self.read_pool = await asyncio.wait_for(asyncpg.create_pool(
+                        DATABASE_READ_URL,
+                        min_size=1,
+                        max_size=DB_RESILIENCE['replica_pool_size'],
+                        command_timeout=DB_RESILIENCE['command_timeout'],
+                        server_settings={'jit': 'off'}
+                    ), timeout=DB_RESILIENCE['command_timeout'])
+                    logger.info("Read replica pool created")
+                async with self.read_pool.acquire(timeout=DB_RESILIENCE['acquire_timeout']) as conn:
+                    # An idle primary sends no WAL, so equal receive/replay positions mean no lag
+                    self.replica_lag = await conn.fetchval('''
+                        SELECT CASE
+                            WHEN NOT pg_is_in_recovery() THEN 0
+                            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                        END::float
+                    ''')
+                self.replica_breaker.record_success()
+            except Exception as e:
+                self.replica_lag = None
+                self.replica_breaker.record_failure()
+                logger.warning(f"Read replica check failed: {e}")
+            await asyncio.sleep(DB_RESILIENCE['replica_check_interval'])
+    
+    @asynccontextmanager
+    async def connection(self, statement: str, read: bool = False):
+        """Pooled connection guarded by the circuit breaker, with latency tracking.
+        Reads go to the replica when it is usable, and to the primary otherwise."""
+        if read and self.replica_usable and self.replica_breaker.allow():
+            try:
+                context = self.read_pool.acquire(timeout=DB_RESILIENCE['acquire_timeout'])
+                conn = await context.__aenter__()
+            except DB_ACQUIRE_ERRORS as e:
+                self.replica_breaker.record_failure()
+                logger.warning(f"Read replica unavailable for {statement} ({e}), using the primary")
+            else:
+                self.replica_reads += 1
+                started = time.monotonic()
+                try:
+                    yield conn
+                except DB_CONNECTION_ERRORS:
+                    self.replica_breaker.record_failure()
+                    raise
+                else:
+                    # Only a completed read proves the replica healthy (not a cancelled one)
+                    self.replica_breaker.record_success()
+                finally:
+                    await context.__aexit__(None, None, None)
+                    self._observe_query(statement, time.monotonic() - started)
+                return
+        
+        if not self.pool or not self.breaker.allow():
+            raise DatabaseUnavailable(f"database unavailable ({statement})")
+        
+        if read:
+            self.primary_reads += 1
+        started = time.monotonic()
+        acquired = None
         try:
-            async with self.pool.acquire() as conn:
-                # Game scores table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS captaincat_scores (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        score INTEGER NOT NULL,
-                        level INTEGER DEFAULT 1,
-                        coins_collected INTEGER DEFAULT 0,
-                        enemies_defeated INTEGER DEFAULT 0,
-                        play_time INTEGER DEFAULT 0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        group_id BIGINT
-                    );
-                ''')
-                
-                # Anti-spam logs table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS spam_logs (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL,
-                        chat_id BIGINT NOT NULL,
-                        message_text TEXT,
-                        spam_score FLOAT DEFAULT 0,
-                        action_taken TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                ''')
-                
-                # Transaction logs table
-                await conn.execute('''
-                    CREATE TABLE IF NOT EXISTS transaction_logs (
-                        id SERIAL PRIMARY KEY,
-                        tx_hash TEXT UNIQUE NOT NULL,
-                        from_address TEXT,
-                        amount FLOAT,
-                        timestamp BIGINT,
-                        notified BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                ''')
-                
-                # Create indexes
-                await conn.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_user_scores ON captaincat_scores(user_id);
-                    CREATE INDEX IF NOT EXISTS idx_group_scores ON captaincat_scores(group_id);
-                    CREATE INDEX IF NOT EXISTS idx_score_ranking ON captaincat_scores(score DESC, created_at DESC);
-                    CREATE INDEX IF NOT EXISTS idx_spam_user ON spam_logs(user_id, created_at);
-                    CREATE INDEX IF NOT EXISTS idx_tx_hash ON transaction_logs(tx_hash);
-                ''')
-        except Exception as e:
-            logger.error(f"Error creating tables: {e}")
+            async with self.pool.acquire(timeout=DB_RESILIENCE['acquire_timeout']) as conn:
+                acquired = time.monotonic()
+                self.acquire_wait.observe(acquired - started)
+                yield conn
+        except DB_CONNECTION_ERRORS:
+            self.breaker.record_failure()
+            raise
+        except DB_ACQUIRE_ERRORS as e:
+            if acquired is None:
+                # No connection at all: callers spool on DatabaseUnavailable
+                self.breaker.record_failure()
+                raise DatabaseUnavailable(f"database unreachable ({statement}): {e!r}") from e
+            # A slow query still proves the database is reachable
+            self.breaker.record_success()
+            raise
+        except Exception:
+            # Query errors still prove the database is reachable
+            self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            if acquired is not None:
+                self._observe_query(statement, time.monotonic() - acquired)
+    
+    def _observe_query(self, statement: str, seconds: float):
+        histogram = self.query_latency.get(statement)
+        if histogram is None:
+            histogram = self.query_latency[statement] = LatencyHistogram()
+        histogram.observe(seconds)
+    
+    def get_pool_stats(self) -> dict:
+        return {
+            'connected': self.pool is not None,
+            'breaker': self.breaker.state,
+            'breaker_opened': self.breaker.times_opened,
+            'size': self.pool.get_size() if self.pool else 0,
+            'idle': self.pool.get_idle_size() if self.pool else 0,
+            'max_size': self.pool.get_max_size() if self.pool else 0,
+            'acquire_p95': self.acquire_wait.percentile(0.95),
+            'replica_connected': self.read_pool is not None,
+            'replica_lag': self.replica_lag,
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads
+        }
+    
+    async def close(self):
+        """Flush buffered writes and close the pool"""
+        for task in (self._reconnect_task, self._replica_task):
+            if task:
+                task.cancel()
+        await self.score_buffer.stop()
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+        if self.read_pool:
+            await self.read_pool.close()
+            self.read_pool = None
+    
+    async def maintain_partitions(self) -> dict:
+        """Create upcoming monthly partitions and expire old spam-log months"""
+        if not self.available:
+            # Raise so the scheduler records the failure and retries soon
+            raise DatabaseUnavailable("database unavailable, partitions not maintained")
+        now = datetime.now()
+        last_month = _add_months(_month_start(now), PARTITION_CONFIG['months_ahead'])
+        # Months strictly before this one are past retention
+        cutoff = _add_months(_month_start(now), 1 - PARTITION_CONFIG['spam_logs_retention_months'])
+        report = {'created': 0, 'expired': []}
+        
+        async with self.connection('maintain_partitions') as conn:
+            for table in ('captaincat_scores', 'spam_logs'):
+                report['created'] += await ensure_month_partitions(conn, table, now, last_month)
+            
+            partitions = await conn.fetch('''
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'spam_logs'::regclass
+            ''')
+            for row in partitions:
+                match = re.fullmatch(r'spam_logs_p(\d{4})(\d{2})', row['relname'])
+                if not match or datetime(int(match.group(1)), int(match.group(2)), 1) >= cutoff:
+                    continue
+                name = row['relname']
+                async with conn.transaction():
+                    await conn.execute(f'ALTER TABLE spam_logs DETACH PARTITION {name}')
+                    if PARTITION_CONFIG['spam_logs_expired'] == 'archive':
+                        await conn.execute('CREATE SCHEMA IF NOT EXISTS archive')
+                        await conn.execute(f'ALTER TABLE {name} SET SCHEMA archive')
+                    else:
+                        await conn.execute(f'DROP TABLE {name}')
+                report['expired'].append(name)
+        
+        if report['created'] or report['expired']:
+            logger.info(f"Partition maintenance: {report['created']} created, expired {report['expired']}")
+        return report
     
     async def log_spam_action(self, user_id: int, chat_id: int, message: str, score: float, action: str):
         """Log spam detection action"""
-        if not self.pool:
+        if not self.available:
             return
         try:
-            async with self.pool.acquire() as conn:
+            async with self.connection('log_spam_action') as conn:
                 await conn.execute('''
                     INSERT INTO spam_logs (user_id, chat_id, message_text, spam_score, action_taken)
                     VALUES ($1, $2, $3, $4, $5)
@@ -519,122 +1893,1795 @@ class GameDatabase:
         except Exception as e:
             logger.error(f"Error logging spam action: {e}")
     
-    async def log_transaction(self, tx_hash: str, from_address: str, amount: float, timestamp: int):
-        """Log transaction"""
-        if not self.pool:
-            return
+    async def claim_announcement(self, kind: str, key: str) -> Optional[bool]:
+        """True if this announcement was not made before (and is now recorded),
+        False if it was, None if the database can't tell"""
+        if not self.available:
+            return None
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO transaction_logs (tx_hash, from_address, amount, timestamp, notified)
-                    VALUES ($1, $2, $3, $4, $5)
-                    ON CONFLICT (tx_hash) DO NOTHING
-                ''', tx_hash, from_address, amount, timestamp, True)
+            async with self.connection('claim_announcement') as conn:
+                claimed = await conn.fetchval('''
+                    INSERT INTO announcements (kind, key) VALUES ($1, $2)
+                    ON CONFLICT (kind, key) DO NOTHING
+                    RETURNING TRUE
+                ''', kind, key)
+                return bool(claimed)
+        except Exception as e:
+            logger.error(f"Error claiming announcement: {e}")
+            return None
+    
+    async def has_announcements(self, kind: str) -> Optional[bool]:
+        """Whether any announcement of this kind was ever recorded; None if the database can't tell"""
+        if not self.available:
+            return None
+        try:
+            async with self.connection('has_announcements') as conn:
+                return await conn.fetchval('SELECT EXISTS (SELECT 1 FROM announcements WHERE kind = $1)', kind)
+        except Exception as e:
+            logger.error(f"Error checking announcements: {e}")
+            return None
+    
+    async def log_transaction(self, tx_hash: str, from_address: str, amount: float, timestamp: int,
+                              created_at: Optional[datetime] = None):
+        """Log a purchase and update presale_state.
+        Returns the new presale_state row, False for an already-known tx_hash,
+        or None if the purchase could not be written to Postgres (spooled)."""
+        # Keep the purchase time so a spooled row replays with it, not the replay time
+        row = (tx_hash, from_address, amount, timestamp, created_at or datetime.now())
+        if not self.available:
+            await self._spool_transactions([row])
+            return None
+        try:
+            async with self.connection('log_transaction') as conn:
+                state = await conn.fetchrow(RECORD_PURCHASE_SQL, *row)
+                return state if state else False
+        except (DatabaseUnavailable,) + DB_CONNECTION_ERRORS as e:
+            logger.warning(f"Database unreachable ({e}), transaction spooled locally")
+            await self._spool_transactions([row])
         except Exception as e:
             logger.error(f"Error logging transaction: {e}")
+        return None
+    
+    async def write_transaction_batch(self, rows: List[tuple]):
+        """Insert transactions and fold them into presale_state; known tx_hash values are skipped"""
+        async with self.connection('write_transaction_batch') as conn:
+            async with conn.transaction():
+                await conn.executemany(RECORD_PURCHASE_SQL, rows)
+    
+    async def load_presale_state(self, recent_limit: int = 100):
+        """presale_state row, the most recent purchases (newest last) and
+        per-minute purchase buckets for the last 24 hours"""
+        if not self.available:
+            return None, [], [], []
+        try:
+            async with self.connection('load_presale_state') as conn:
+                state = await conn.fetchrow('''
+                    SELECT raised, total_buys, unique_buyers, last_buy_time FROM presale_state WHERE id = 1
+                ''')
+                recent = await conn.fetch('''
+                    SELECT from_address, amount, created_at FROM transaction_logs
+                    ORDER BY created_at DESC LIMIT $1
+                ''', recent_limit)
+                buckets = await conn.fetch('''
+                    SELECT date_trunc('minute', created_at) AS minute,
+                           COUNT(*) AS buys,
+                           SUM(amount) AS volume,
+                           COUNT(*) FILTER (WHERE amount >= $1) AS whales,
+                           COUNT(*) FILTER (WHERE amount >= $2) AS sharks,
+                           MAX(amount) AS biggest
+                    FROM transaction_logs
+                    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '24 hours'
+                    GROUP BY 1
+                    ORDER BY 1
+                ''', PRESALE_CONFIG['minimum_whale'], PRESALE_CONFIG['minimum_shark'])
+                # One row per buyer and minute is enough to rebuild the windowed buyer counters
+                buyers = await conn.fetch('''
+                    SELECT from_address, MAX(created_at) AS created_at
+                    FROM transaction_logs
+                    WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '24 hours'
+                    GROUP BY from_address, date_trunc('minute', created_at)
+                    ORDER BY 2
+                ''')
+                return state, list(reversed(recent)), list(buckets), list(buyers)
+        except Exception as e:
+            logger.error(f"Error loading presale state: {e}")
+            return None, [], [], []
     
     async def save_score(self, user_id, username, first_name, score, level, 
                         coins, enemies, play_time, group_id=None):
-        if not self.pool:
+        row = (user_id, username, first_name, score, level, coins, enemies,
+               play_time, group_id, datetime.now(), uuid.uuid4())
+        if not self.available:
+            if await self._spool_scores([row]):
+                return SCORE_SPOOLED
             logger.warning("Database not available, score not saved")
             return False
-        try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO captaincat_scores 
-                    (user_id, username, first_name, score, level, coins_collected, 
-                     enemies_defeated, play_time, group_id)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                ''', user_id, username, first_name, score, level, coins, enemies, play_time, group_id)
-                return True
-        except Exception as e:
-            logger.error(f"Error saving score: {e}")
-            return False
+        return await self.score_buffer.submit(row)
+    
+    async def write_score_batch(self, rows: List[tuple]) -> int:
+        """Stage a batch with COPY, insert the rows not seen before (by score_uid)
+        and fold them into user_stats, all in one transaction"""
+        columns = ', '.join(SCORE_COLUMNS)
+        async with self.connection('write_score_batch') as conn:
+            async with conn.transaction():
+                await conn.execute(SCORE_STAGING_DDL)
+                await conn.copy_records_to_table('score_staging', records=rows, columns=SCORE_COLUMNS)
+                inserted = await conn.fetch(f'''
+                    INSERT INTO captaincat_scores ({columns})
+                    SELECT {columns} FROM score_staging
+                    ON CONFLICT (score_uid, created_at) DO NOTHING
+                    RETURNING user_id, username, first_name, score, level,
+                              coins_collected, enemies_defeated, group_id, created_at
+                ''')
+                
+                # Aggregate per user so user_stats gets one upsert each
+                per_user: Dict[int, list] = {}
+                for row in inserted:
+                    # The web app may send explicit nulls; a missing level counts as 1 like the backfill
+                    level = row['level'] or 1
+                    agg = per_user.setdefault(row['user_id'], [
+                        row['user_id'], row['score'], level, 0, 0, 0,
+                        row['created_at'], level, row['username'], row['first_name']
+                    ])
+                    # Best game: highest score, latest one on ties (same as the leaderboard)
+                    if row['score'] > agg[1] or (row['score'] == agg[1] and row['created_at'] > agg[6]):
+                        agg[1], agg[6], agg[7], agg[8], agg[9] = (
+                            row['score'], row['created_at'], level, row['username'], row['first_name']
+                        )
+                    agg[2] = max(agg[2], level)
+                    agg[3] += row['coins_collected'] or 0
+                    agg[4] += row['enemies_defeated'] or 0
+                    agg[5] += 1
+                
+                # Sorted to keep lock order stable between flushes.
+                # SET expressions all see the old row, so the CASEs agree on which game is best.
+                await conn.executemany('''
+                    INSERT INTO user_stats AS s
+                    (user_id, best_score, max_level, total_coins, total_enemies, games_played,
+                     best_at, best_level, username, first_name)
+                    VALUES ($1, $2, COALESCE($3, 1), COALESCE($4, 0), COALESCE($5, 0), $6, $7, COALESCE($8, 1), $9, $10)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        best_score = GREATEST(s.best_score, EXCLUDED.best_score),
+                        best_at = CASE WHEN EXCLUDED.best_score > s.best_score THEN EXCLUDED.best_at
+                                       WHEN EXCLUDED.best_score = s.best_score THEN GREATEST(s.best_at, EXCLUDED.best_at)
+                                       ELSE s.best_at END,
+                        best_level = CASE WHEN (EXCLUDED.best_score, EXCLUDED.best_at) >= (s.best_score, s.best_at)
+                                          THEN EXCLUDED.best_level ELSE s.best_level END,
+                        username = CASE WHEN (EXCLUDED.best_score, EXCLUDED.best_at) >= (s.best_score, s.best_at)
+                                        THEN EXCLUDED.username ELSE s.username END,
+                        first_name = CASE WHEN (EXCLUDED.best_score, EXCLUDED.best_at) >= (s.best_score, s.best_at)
+                                          THEN EXCLUDED.first_name ELSE s.first_name END,
+                        max_level = GREATEST(s.max_level, EXCLUDED.max_level),
+                        total_coins = s.total_coins + EXCLUDED.total_coins,
+                        total_enemies = s.total_enemies + EXCLUDED.total_enemies,
+                        games_played = s.games_played + EXCLUDED.games_played,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', [tuple(per_user[user_id]) for user_id in sorted(per_user)])
+        
+        # Write-through so leaderboards don't need another query
+        for row in inserted:
+            self.leaderboard_cache.record(
+                row['user_id'], row['username'], row['first_name'], row['score'],
+                row['level'], row['created_at'], row['group_id']
+            )
+        return len(inserted)
+    
+    async def _spool_scores(self, rows: List[tuple]) -> bool:
+        return bool(DATABASE_URL) and await self.spool.append('score', rows)
+    
+    async def _spool_transactions(self, rows: List[tuple]) -> bool:
+        return bool(DATABASE_URL) and await self.spool.append('transaction', rows)
+    
+    async def replay_spool(self) -> int:
+        """Write spooled rows to Postgres in bulk; safe to repeat after a crash"""
+        replayed = 0
+        transactions_replayed = 0
+        started = time.monotonic()
+        writers = (
+            ('score', self.write_score_batch, _decode_spooled_score),
+            ('transaction', self.write_transaction_batch, _decode_spooled_transaction)
+        )
+        # Retried on the next replay; a timed out batch is not a bad row
+        transient_errors = (DatabaseUnavailable, asyncio.TimeoutError) + DB_CONNECTION_ERRORS
+        for kind, writer, decode in writers:
+            while self.available:
+                batch = await self.spool.read(kind, SPOOL_CONFIG['replay_batch'])
+                if not batch:
+                    break
+                rows = [decode(payload) for _, payload in batch]
+                try:
+                    await writer(rows)
+                except transient_errors:
+                    raise
+                except Exception as e:
+                    # Isolate rows Postgres rejects so they can't block the spool forever
+                    logger.warning(f"Spool replay batch failed ({e}), replaying {kind} rows one by one")
+                    for row in rows:
+                        try:
+                            await writer([row])
+                        except transient_errors:
+                            raise
+                        except Exception as row_error:
+                            logger.error(f"Dropping spooled {kind} row {row!r}: {row_error}")
+                await self.spool.delete([seq for seq, _ in batch])
+                replayed += len(batch)
+                if kind == 'transaction':
+                    transactions_replayed += len(batch)
+        
+        if transactions_replayed and self.on_transactions_replayed:
+            await self.on_transactions_replayed()
+        
+        if replayed:
+            elapsed = time.monotonic() - started
+            logger.info(f"Replayed {replayed} spooled rows in {elapsed:.2f}s ({replayed / max(elapsed, 0.001):.0f} rows/s)")
+        return replayed
+    
+    async def replay_spool_if_pending(self) -> int:
+        """Replay the local spool if it has rows and the database is reachable"""
+        if self.spool.pending and self.available:
+            return await self.replay_spool()
+        return 0
     
     async def get_user_best_score(self, user_id):
-        if not self.pool:
+        # Read right after a save: primary only, a lagging replica could miss it
+        if not self.available:
             return None
         try:
-            async with self.pool.acquire() as conn:
+            async with self.connection('get_user_best_score') as conn:
                 result = await conn.fetchrow('''
-                    SELECT MAX(score) as best_score, MAX(level) as max_level,
-                           SUM(coins_collected) as total_coins, SUM(enemies_defeated) as total_enemies,
-                           COUNT(*) as games_played
-                    FROM captaincat_scores WHERE user_id = $1
+                    SELECT best_score, max_level, total_coins, total_enemies, games_played
+                    FROM user_stats WHERE user_id = $1
                 ''', user_id)
                 return result
         except Exception as e:
             logger.error(f"Error getting user stats: {e}")
             return None
     
+    async def get_player_rank(self, user_id: int, group_id: Optional[int] = None) -> Optional[dict]:
+        """Rank of a player's best score, global or in a group: {'rank', 'players', 'percentile'}"""
+        if not self.available:
+            return None
+        scope = group_id or None
+        try:
+            board = await self.leaderboard_cache.get_board(scope)
+            entry = board.entries.get(user_id)
+            if entry:
+                rank = board.score_rank(entry[3])
+            elif board.complete:
+                # The board holds every player of this scope
+                return None
+            else:
+                rank = await self._count_rank(user_id, scope)
+                if rank is None:
+                    return None
+            
+            players = len(board.keys) if board.complete else await self._count_players(scope)
+            players = max(players, rank)
+            return {
+                'rank': rank,
+                'players': players,
+                # Share of players strictly below this score
+                'percentile': 100.0 * (players - rank) / players
+            }
+        except Exception as e:
+            logger.error(f"Error getting player rank: {e}")
+            return None
+    
+    async def _count_rank(self, user_id: int, group_id: Optional[int]) -> Optional[int]:
+        """Rank from an indexed count of better scores, for players below the in-memory board"""
+        async with self.connection('count_rank') as conn:
+            if group_id:
+                return await conn.fetchval('''
+                    WITH mine AS (
+                        SELECT MAX(score) AS best FROM captaincat_scores
+                        WHERE group_id = $1 AND user_id = $2
+                    )
+                    SELECT (
+                        SELECT COUNT(*) FROM (
+                            SELECT user_id FROM captaincat_scores
+                            WHERE group_id = $1
+                            GROUP BY user_id
+                            HAVING MAX(score) > mine.best
+                        ) better
+                    ) + 1
+                    FROM mine WHERE mine.best IS NOT NULL
+                ''', group_id, user_id)
+            return await conn.fetchval('''
+                SELECT (SELECT COUNT(*) FROM user_stats o WHERE o.best_score > s.best_score) + 1
+                FROM user_stats s WHERE s.user_id = $1
+            ''', user_id)
+    
+    async def _count_players(self, group_id: Optional[int]) -> int:
+        """Players with at least one score in a scope, cached for a short while"""
+        cached = self._player_counts.get(group_id)
+        now = time.monotonic()
+        if cached and cached[1] > now:
+            return cached[0]
+        async with self.connection('count_players') as conn:
+            if group_id:
+                count = await conn.fetchval(
+                    'SELECT COUNT(DISTINCT user_id) FROM captaincat_scores WHERE group_id = $1', group_id
+                )
+            else:
+                count = await conn.fetchval('SELECT COUNT(*) FROM user_stats')
+        self._player_counts[group_id] = (count, now + LEADERBOARD_CACHE['player_count_ttl'])
+        return count
+    
     async def get_group_leaderboard(self, group_id=None, limit=10):
-        if not self.pool:
+        if not self.available:
             return []
         try:
-            async with self.pool.acquire() as conn:
-                if group_id:
-                    query = '''
-                        WITH ranked_scores AS (
-                            SELECT user_id, username, first_name, score, level, created_at,
-                                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY score DESC, created_at DESC) as rn
-                            FROM captaincat_scores 
-                            WHERE group_id = $1
-                        )
-                        SELECT user_id, username, first_name, score, level, created_at
-                        FROM ranked_scores 
-                        WHERE rn = 1
-                        ORDER BY score DESC, created_at ASC
-                        LIMIT $2
-                    '''
-                    results = await conn.fetch(query, group_id, limit)
-                else:
-                    query = '''
-                        WITH ranked_scores AS (
-                            SELECT user_id, username, first_name, score, level, created_at,
-                                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY score DESC, created_at DESC) as rn
-                            FROM captaincat_scores
-                        )
-                        SELECT user_id, username, first_name, score, level, created_at
-                        FROM ranked_scores 
-                        WHERE rn = 1
-                        ORDER BY score DESC, created_at ASC
-                        LIMIT $1
-                    '''
-                    results = await conn.fetch(query, limit)
-                
-                return list(results)
+            return await self.leaderboard_cache.top(group_id or None, limit)
         except Exception as e:
             logger.error(f"Error getting leaderboard: {e}")
             return []
+    
+    async def _fetch_leaderboard(self, group_id=None, limit=10, read: bool = False):
+        """Best score per user straight from the database.
+        Loads the write-through LeaderboardCache, so it reads the primary unless `read` is set:
+        a board loaded from a lagging replica would miss scores committed just before."""
+        async with self.connection('fetch_leaderboard', read=read) as conn:
+            if group_id:
+                query = '''
+                    WITH ranked_scores AS (
+                        SELECT user_id, username, first_name, score, level, created_at,
+                               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY score DESC, created_at DESC) as rn
+                        FROM captaincat_scores 
+                        WHERE group_id = $1
+                    )
+                    SELECT user_id, username, first_name, score, level, created_at
+                    FROM ranked_scores 
+                    WHERE rn = 1
+                    ORDER BY score DESC, created_at ASC
+                    LIMIT $2
+                '''
+                results = await conn.fetch(query, group_id, limit)
+            else:
+                # user_stats already holds each player's best game
+                query = f'''
+                    {USER_STATS_BOARD_SELECT}
+                    ORDER BY (-best_score), best_at, user_id
+                    LIMIT $1
+                '''
+                results = await conn.fetch(query, limit)
+            
+            return list(results)
+    
+    async def _fetch_global_page(self, cursor: Optional[tuple], limit: int, backwards: bool = False) -> list:
+        """Keyset page of the global board from user_stats (idx_user_stats_board)"""
+        async with self.connection('fetch_leaderboard_page', read=True) as conn:
+            if backwards:
+                rows = await conn.fetch(f'''
+                    {USER_STATS_BOARD_SELECT}
+                    WHERE ((-best_score), best_at, user_id) < ($1, $2, $3)
+                    ORDER BY (-best_score) DESC, best_at DESC, user_id DESC
+                    LIMIT $4
+                ''', *cursor, limit)
+                return list(reversed(rows))
+            if cursor is None:
+                return await self._fetch_leaderboard(None, limit, read=True)
+            return list(await conn.fetch(f'''
+                {USER_STATS_BOARD_SELECT}
+                WHERE ((-best_score), best_at, user_id) > ($1, $2, $3)
+                ORDER BY (-best_score), best_at, user_id
+                LIMIT $4
+            ''', *cursor, limit))
+    
+    async def get_leaderboard_page(self, group_id: Optional[int] = None, cursor: Optional[tuple] = None,
+                                   position: int = 0, backwards: bool = False) -> Optional[dict]:
+        """One leaderboard page after (or before) a cursor key, without OFFSET.
+        position is the 0-based place of the cursor row, used when the page comes from the database."""
+        if not self.available:
+            return None
+        limit = LEADERBOARD_CACHE['page_size']
+        scope = group_id or None
+        try:
+            board = await self.leaderboard_cache.get_board(scope)
+            # Group boards are only browsable as deep as they are kept in memory
+            page = board.page(cursor, limit, backwards, strict=scope is None)
+            if page is not None:
+                rows, start, more = page
+            else:
+                rows = await self._fetch_global_page(cursor, limit + 1, backwards)
+                more = len(rows) > limit
+                if backwards:
+                    rows = rows[-limit:]
+                    start = max(0, position - len(rows))
+                else:
+                    rows = rows[:limit]
+                    start = position + 1 if cursor else 0
+            
+            return {
+                'rows': rows,
+                'start': start,
+                'has_prev': more if backwards else start > 0,
+                # Going back always leaves the page we came from ahead
+                'has_next': True if backwards else more
+            }
+        except Exception as e:
+            logger.error(f"Error getting leaderboard page: {e}")
+            return None
+    
+    async def count_players(self, group_id: Optional[int] = None) -> Optional[int]:
+        if not self.available:
+            return None
+        try:
+            return await self._count_players(group_id or None)
+        except Exception as e:
+            logger.error(f"Error counting players: {e}")
+            return None
+
+class HyperLogLog:
+    """HyperLogLog sketch with 2**p one-byte registers (p=12: 4 KB, ~1.6% standard error)"""
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p: int = 12, registers: Optional[bytes] = None):
+        self.p = p
+        self.registers = bytearray(registers) if registers else bytearray(1 << p)
+
+    @staticmethod
+    def _hash(item: str) -> int:
+        return int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, item: str):
+        value = self._hash(item)
+        index = value >> (64 - self.p)
+        rest = value & ((1 << (64 - self.p)) - 1)
+        # Position of the leftmost 1-bit in the remaining 64-p bits
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+class UniqueCounter:
+    """Distinct count that is exact up to a threshold and a HyperLogLog sketch above it"""
+    __slots__ = ('threshold', 'p', 'exact', 'sketch', '_count')
+
+    def __init__(self, threshold: int = 1024, p: int = 12):
+        self.threshold = threshold
+        self.p = p
+        self.exact: Optional[set] = set()
+        self.sketch: Optional[HyperLogLog] = None
+        self._count: Optional[int] = 0
+
+    def add(self, item: str):
+        if self.exact is not None:
+            if item in self.exact:
+                return
+            self.exact.add(item)
+            if len(self.exact) > self.threshold:
+                self._promote()
+        else:
+            self.sketch.add(item)
+        self._count = None
+
+    def _promote(self):
+        self.sketch = HyperLogLog(self.p)
+        for item in self.exact:
+            self.sketch.add(item)
+        self.exact = None
+
+    def merge(self, other: 'UniqueCounter'):
+        if other.exact is not None:
+            for item in other.exact:
+                self.add(item)
+            return
+        if self.exact is not None:
+            self._promote()
+        self.sketch.merge(other.sketch)
+        self._count = None
+
+    def count(self) -> int:
+        if self._count is None:
+            self._count = len(self.exact) if self.exact is not None else self.sketch.count()
+        return self._count
+
+class WindowedUniqueCounter:
+    """Distinct buyers over sliding windows: one UniqueCounter per time slot,
+    merged on demand and cached until a new buyer arrives or the slot changes"""
+    def __init__(self, slot_minutes: int = 10, horizon_minutes: int = 24 * 60):
+        self.slot_minutes = slot_minutes
+        self.horizon_slots = horizon_minutes // slot_minutes
+        self.slots: "OrderedDict[int, UniqueCounter]" = OrderedDict()
+        self.version = 0
+        self._cache: Dict[int, tuple] = {}  # minutes -> (slot, version, count)
+
+    def _slot(self, when: datetime) -> int:
+        return int(when.timestamp() // 60) // self.slot_minutes
+
+    def add(self, item: str, when: datetime):
+        slot = self._slot(when)
+        counter = self.slots.get(slot)
+        if counter is None:
+            counter = self.slots[slot] = UniqueCounter()
+            if len(self.slots) > 1 and next(reversed(self.slots)) != slot:
+                # Late arrival; keep slots ordered oldest first
+                self.slots = OrderedDict(sorted(self.slots.items()))
+        counter.add(item)
+        self.version += 1
+        self._prune(next(reversed(self.slots)))
+
+    def _prune(self, current_slot: int):
+        while self.slots and next(iter(self.slots)) <= current_slot - self.horizon_slots:
+            self.slots.popitem(last=False)
+
+    def count(self, minutes: int, now: Optional[datetime] = None) -> int:
+        """Distinct items in the last `minutes` (rounded up to whole slots)"""
+        current = self._slot(now or datetime.now())
+        cached = self._cache.get(minutes)
+        if cached and cached[0] == current and cached[1] == self.version:
+            return cached[2]
+        
+        self._prune(current)
+        first = current - max(1, math.ceil(minutes / self.slot_minutes)) + 1
+        merged = UniqueCounter()
+        for slot, counter in self.slots.items():
+            if first <= slot <= current:
+                merged.merge(counter)
+        count = merged.count()
+        self._cache[minutes] = (current, self.version, count)
+        return count
+
+    def clear(self):
+        self.slots.clear()
+        self._cache.clear()
+        self.version += 1
+
+class RollingAggregator:
+    """Purchase counters over sliding windows (in minutes), kept in per-minute buckets.
+    Every window keeps running totals and a monotonic deque for its biggest buy,
+    so reads are O(1) and buckets are dropped as they leave the window."""
+    HOUR = 60
+    DAY = 24 * 60
+
+    def __init__(self, windows=(HOUR, DAY)):
+        self.windows = tuple(windows)
+        # Buckets are lists shared by every window: [minute, buys, volume, whales, sharks, biggest]
+        self._buckets = {window: deque() for window in self.windows}
+        self._totals = {window: [0, 0.0, 0, 0] for window in self.windows}  # buys, volume, whales, sharks
+        self._biggest = {window: deque() for window in self.windows}        # (minute, amount), amounts decreasing
+
+    @staticmethod
+    def _minute(when: datetime) -> int:
+        return int(when.timestamp() // 60)
+
+    def add(self, when: datetime, amount: float):
+        whale = int(amount >= PRESALE_CONFIG['minimum_whale'])
+        shark = int(amount >= PRESALE_CONFIG['minimum_shark'])
+        self._merge(self._minute(when), 1, amount, whale, shark, amount)
+
+    def add_bucket(self, when: datetime, buys: int, volume: float, whales: int, sharks: int, biggest: float):
+        """Seed a whole minute at once, e.g. from a GROUP BY minute query"""
+        self._merge(self._minute(when), buys, volume, whales, sharks, biggest)
+
+    def _merge(self, minute: int, buys: int, volume: float, whales: int, sharks: int, biggest: float):
+        longest = self._buckets[self.windows[-1]]
+        if longest and longest[-1][0] >= minute:
+            # Same minute (or a late arrival): fold into the newest bucket
+            bucket = longest[-1]
+            minute = bucket[0]
+            bucket[1] += buys
+            bucket[2] += volume
+            bucket[3] += whales
+            bucket[4] += sharks
+            bucket[5] = max(bucket[5], biggest)
+            fresh = False
+        else:
+            bucket = [minute, buys, volume, whales, sharks, biggest]
+            fresh = True
+        
+        for window in self.windows:
+            if fresh:
+                self._buckets[window].append(bucket)
+            elif not self._buckets[window] or self._buckets[window][-1] is not bucket:
+                # Bucket already expired from this shorter window
+                continue
+            totals = self._totals[window]
+            totals[0] += buys
+            totals[1] += volume
+            totals[2] += whales
+            totals[3] += sharks
+            peaks = self._biggest[window]
+            while peaks and peaks[-1][1] <= biggest:
+                peaks.pop()
+            peaks.append((minute, biggest))
+
+    def _expire(self, window: int, now_minute: int):
+        buckets = self._buckets[window]
+        totals = self._totals[window]
+        oldest = now_minute - window
+        while buckets and buckets[0][0] <= oldest:
+            bucket = buckets.popleft()
+            totals[0] -= bucket[1]
+            totals[1] -= bucket[2]
+            totals[2] -= bucket[3]
+            totals[3] -= bucket[4]
+        if not buckets:
+            # Drop float drift once the window is empty
+            self._totals[window] = [0, 0.0, 0, 0]
+        peaks = self._biggest[window]
+        while peaks and peaks[0][0] <= oldest:
+            peaks.popleft()
+
+    def window(self, minutes: int, now: Optional[datetime] = None) -> dict:
+        """buys, volume, whales, sharks and biggest buy over one of the configured windows"""
+        self._expire(minutes, self._minute(now or datetime.now()))
+        buys, volume, whales, sharks = self._totals[minutes]
+        peaks = self._biggest[minutes]
+        return {
+            'buys': buys,
+            'volume': volume,
+            'whales': whales,
+            'sharks': sharks,
+            'biggest': peaks[0][1] if peaks else 0
+        }
+
+    def last_hour(self) -> dict:
+        return self.window(self.HOUR)
+
+    def last_day(self) -> dict:
+        return self.window(self.DAY)
+
+    def clear(self):
+        for window in self.windows:
+            self._buckets[window].clear()
+            self._biggest[window].clear()
+            self._totals[window] = [0, 0.0, 0, 0]
+
+# ===== CHAT ACTIVITY =====
+class ChatActivity:
+    """Activity of one chat in fixed memory: per-minute message ring, last activity, distinct senders"""
+    __slots__ = ('counts', 'minutes', 'last_activity', 'total', 'senders', 'previous_senders', 'sender_period')
+
+    def __init__(self, now: float):
+        window = CHAT_ACTIVITY_CONFIG['window_minutes']
+        self.counts = [0] * window
+        self.minutes = [-1] * window  # minute each ring slot currently holds
+        self.last_activity = now
+        self.total = 0
+        self.senders = self._sender_counter()
+        self.previous_senders: Optional[UniqueCounter] = None
+        self.sender_period = int(now // CHAT_ACTIVITY_CONFIG['sender_period'])
+
+    @staticmethod
+    def _sender_counter() -> UniqueCounter:
+        return UniqueCounter(CHAT_ACTIVITY_CONFIG['sender_threshold'], CHAT_ACTIVITY_CONFIG['sender_sketch_p'])
+
+    def record(self, sender_id: int, now: float):
+        minute = int(now // 60)
+        slot = minute % len(self.counts)
+        if self.minutes[slot] != minute:
+            self.minutes[slot] = minute
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+        self.total += 1
+        self.last_activity = now
+        
+        period = int(now // CHAT_ACTIVITY_CONFIG['sender_period'])
+        if period != self.sender_period:
+            self.previous_senders = self.senders if period == self.sender_period + 1 else None
+            self.senders = self._sender_counter()
+            self.sender_period = period
+        self.senders.add(str(sender_id))
+
+    def messages(self, minutes: int, now: float) -> int:
+        """Messages in the last `minutes` (at most window_minutes)"""
+        current = int(now // 60)
+        return sum(count for count, minute in zip(self.counts, self.minutes) if current - minutes < minute <= current)
+
+    def rate(self, now: float) -> float:
+        """Messages per hour over the sliding window"""
+        window = len(self.counts)
+        return self.messages(window, now) * 60 / window
+
+    def distinct_senders(self, now: float) -> int:
+        """Approximate distinct senders over the current and previous period"""
+        period = int(now // CHAT_ACTIVITY_CONFIG['sender_period'])
+        if period == self.sender_period:
+            counters = [self.previous_senders, self.senders]
+        elif period == self.sender_period + 1:
+            counters = [self.senders]
+        else:
+            return 0
+        merged = self._sender_counter()
+        for counter in counters:
+            if counter:
+                merged.merge(counter)
+        return merged.count()
+
+class ChatActivityTracker:
+    """ChatActivity per chat, least recently active first so dead chats are cheap to evict"""
+    def __init__(self):
+        self.chats: "OrderedDict[int, ChatActivity]" = OrderedDict()
+        self.started = time.time()
+
+    def _touch(self, chat_id: int, now: float) -> ChatActivity:
+        activity = self.chats.get(chat_id)
+        if activity is None:
+            activity = self.chats[chat_id] = ChatActivity(now)
+            if len(self.chats) > CHAT_ACTIVITY_CONFIG['max_chats']:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_id)
+        return activity
+
+    def record(self, chat_id: int, sender_id: int, now: Optional[float] = None):
+        """A user message in `chat_id`"""
+        now = now or time.time()
+        self._touch(chat_id, now).record(sender_id, now)
+
+    def mark_posted(self, chat_id: int, now: Optional[float] = None):
+        """The bot posted in `chat_id`: resets its quiet timer without counting a message"""
+        now = now or time.time()
+        self._touch(chat_id, now).last_activity = now
+
+    def get(self, chat_id: int) -> Optional[ChatActivity]:
+        return self.chats.get(chat_id)
+
+    def idle_for(self, chat_id: int, now: Optional[float] = None) -> float:
+        """Seconds since the last activity (since startup for chats not seen yet)"""
+        activity = self.chats.get(chat_id)
+        return (now or time.time()) - (activity.last_activity if activity else self.started)
+
+    def quiet_chats(self, chat_ids, quiet_after: float) -> List[int]:
+        now = time.time()
+        return [chat_id for chat_id in chat_ids if chat_id and self.idle_for(chat_id, now) > quiet_after]
+
+    def evict_idle(self) -> int:
+        cutoff = time.time() - CHAT_ACTIVITY_CONFIG['idle_eviction']
+        evicted = 0
+        while self.chats and next(iter(self.chats.values())).last_activity < cutoff:
+            self.chats.popitem(last=False)
+            evicted += 1
+        return evicted
+
+# ===== TIME SERIES =====
+class TimeSeriesTier:
+    """Fixed-size ring of (sum, count, max) buckets at one resolution"""
+    __slots__ = ('name', 'step', 'capacity', 'starts', 'sums', 'counts', 'maxes')
+
+    def __init__(self, name: str, step: int, capacity: int):
+        self.name = name
+        self.step = step
+        self.capacity = capacity
+        self.starts = array('q', [-1]) * capacity  # bucket start each slot holds
+        self.sums = array('d', [0.0]) * capacity
+        self.counts = array('q', [0]) * capacity
+        self.maxes = array('d', [0.0]) * capacity
+
+    def add(self, ts: float, value: float):
+        start = int(ts // self.step) * self.step
+        slot = (start // self.step) % self.capacity
+        if self.starts[slot] != start:
+            if self.starts[slot] > start:
+                return  # older than the retention of this tier
+            self.starts[slot] = start
+            self.sums[slot] = 0.0
+            self.counts[slot] = 0
+            self.maxes[slot] = value
+        self.sums[slot] += value
+        self.counts[slot] += 1
+        self.maxes[slot] = max(self.maxes[slot], value)
+
+    @property
+    def retention(self) -> int:
+        return self.step * self.capacity
+
+    def buckets(self, start: float, end: float) -> List[tuple]:
+        """(bucket_start, sum, count, max) of the buckets in [start, end), oldest first"""
+        first = int(start // self.step) * self.step
+        rows = []
+        for bucket in range(first, int(end), self.step):
+            slot = (bucket // self.step) % self.capacity
+            if self.starts[slot] == bucket:
+                rows.append((bucket, self.sums[slot], self.counts[slot], self.maxes[slot]))
+        return rows
+
+class TimeSeries:
+    """One metric kept at minute, hour and day resolution.
+
+    Every sample is folded into the current bucket of each tier as it arrives, so
+    downsampling is incremental and memory is fixed by the tier sizes.
+    'gauge' points read as the bucket average, 'counter' points as the bucket sum.
+    """
+    def __init__(self, name: str, kind: str = 'gauge'):
+        self.name = name
+        self.kind = kind
+        self.tiers = [TimeSeriesTier(*tier) for tier in TIMESERIES_CONFIG['tiers']]
+        self.last: Optional[Tuple[float, float]] = None
+
+    def add(self, value: float, ts: Optional[float] = None):
+        ts = ts or time.time()
+        for tier in self.tiers:
+            tier.add(ts, value)
+        if self.last is None or ts >= self.last[0]:
+            self.last = (ts, value)
+
+    def _tier_for(self, start: float, now: float, resolution: Optional[str]) -> TimeSeriesTier:
+        if resolution:
+            return next(tier for tier in self.tiers if tier.name == resolution)
+        # Finest tier that still covers the start of the range
+        for tier in self.tiers:
+            if now - start <= tier.retention:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, start: float, end: Optional[float] = None, resolution: Optional[str] = None) -> List[Tuple[float, float]]:
+        """(bucket_start, value) points in [start, end)"""
+        now = time.time()
+        end = end or now + 1
+        tier = self._tier_for(start, now, resolution)
+        return [
+            (bucket, total if self.kind == 'counter' else total / count)
+            for bucket, total, count, _ in tier.buckets(start, end)
+        ]
+
+    def value_at(self, ts: float) -> Optional[float]:
+        """Value of the finest bucket holding `ts`, None if it was not recorded"""
+        points = self.query(ts, ts + 1)
+        return points[0][1] if points else None
+
+    def total(self, start: float, end: Optional[float] = None) -> float:
+        return sum(value for _, value in self.query(start, end))
+
+class TimeSeriesStore:
+    """Named TimeSeries, created on first write"""
+    def __init__(self, kinds: Optional[Dict[str, str]] = None):
+        self.kinds = kinds or {}
+        self.series: Dict[str, TimeSeries] = {}
+
+    def add(self, name: str, value: float, ts: Optional[float] = None):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = TimeSeries(name, self.kinds.get(name, 'gauge'))
+        series.add(value, ts)
+
+    def get(self, name: str) -> Optional[TimeSeries]:
+        return self.series.get(name)
+
+# ===== JOB SCHEDULER =====
+class IntervalTrigger:
+    """Every `seconds`, plus up to `jitter` random seconds; first run after `start_after`"""
+    def __init__(self, seconds: float, jitter: float = 0, start_after: Optional[float] = None):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.start_after = seconds if start_after is None else start_after
+
+    def first(self, now: float) -> float:
+        return now + self.start_after + random.uniform(0, self.jitter)
+
+    def next(self, now: float) -> float:
+        return now + self.seconds + random.uniform(0, self.jitter)
+
+    def describe(self) -> str:
+        text = f"every {self.seconds / 60:g}m"
+        return text + f" +≤{self.jitter / 60:g}m" if self.jitter else text
+
+class CronTrigger:
+    """At the given local hours (and minute) every day, plus up to `jitter` random seconds"""
+    def __init__(self, hours, minute: int = 0, jitter: float = 0):
+        self.hours = sorted(hours)
+        self.minute = minute
+        self.jitter = jitter
+
+    def first(self, now: float) -> float:
+        return self.next(now)
+
+    def next(self, now: float) -> float:
+        current = datetime.fromtimestamp(now)
+        for day in range(2):
+            date = current.date() + timedelta(days=day)
+            for hour in self.hours:
+                fire = datetime(date.year, date.month, date.day, hour, self.minute)
+                if fire > current:
+                    return fire.timestamp() + random.uniform(0, self.jitter)
+        raise ValueError("CronTrigger needs at least one hour")
+
+    def describe(self) -> str:
+        return "at " + ", ".join(f"{hour:02d}:{self.minute:02d}" for hour in self.hours)
+
+class Job:
+    """A scheduled coroutine function with its run policy and last-run stats"""
+    def __init__(self, name: str, func, trigger, timeout: Optional[float] = None,
+                 misfire: str = 'coalesce', misfire_grace: Optional[float] = None, max_instances: int = 1,
+                 retry_after: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.timeout = SCHEDULER_CONFIG['default_timeout'] if timeout is None else timeout  # 0 = no limit
+        # 'coalesce': a late run still happens (once); 'skip': it is dropped
+        self.misfire = misfire
+        self.misfire_grace = SCHEDULER_CONFIG['default_misfire_grace'] if misfire_grace is None else misfire_grace
+        self.max_instances = max_instances
+        # After a failed run, fire again this soon instead of waiting the full trigger period
+        self.retry_after = retry_after
+        self.next_run: Optional[float] = None
+        self.running = 0
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+class JobScheduler:
+    """Runs every background job from one task, ordered by a heap of next fire times"""
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List[tuple] = []  # (fire_at, seq, name)
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()
+
+    def add(self, name: str, func, trigger, **options) -> Job:
+        job = Job(name, func, trigger, **options)
+        self.jobs[name] = job
+        self._push(job, trigger.first(time.time()))
+        return job
+
+    def _push(self, job: Job, fire_at: float):
+        job.next_run = fire_at
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_at, self._seq, job.name))
+        self._wakeup.set()
+
+    def start(self):
+        if not self._task or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def healthy(self) -> bool:
+        """Loop task alive and no idle job overdue by more than the misfire grace"""
+        if not self._task or self._task.done():
+            return False
+        now = time.time()
+        return all(
+            job.running or job.next_run is None or now - job.next_run <= max(job.misfire_grace, 60)
+            for job in self.jobs.values()
+        )
+
+    async def stop(self):
+        tasks = [task for task in [self._task, *self._running] if task]
+        for task in tasks:
+            task.cancel()
+        # Let jobs unwind before the caller closes what they use (e.g. the DB pool)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            fire_at, _, name = self._heap[0]
+            delay = fire_at - time.time()
+            if delay > 0:
+                try:
+                    # Woken early when a job is added
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heapq.heappop(self._heap)
+            job = self.jobs.get(name)
+            if job is None or job.next_run != fire_at:
+                continue
+            now = time.time()
+            if now - fire_at > job.misfire_grace and job.misfire == 'skip':
+                job.skipped += 1
+                logger.warning(f"Job {name} skipped: {now - fire_at:.0f}s late")
+            elif job.running >= job.max_instances:
+                job.skipped += 1
+                logger.warning(f"Job {name} skipped: {job.running} run(s) still in progress")
+            else:
+                task = asyncio.create_task(self._execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+            # Next fire time counts from now, so missed runs never pile up
+            self._push(job, job.trigger.next(now))
+
+    async def _execute(self, job: Job):
+        job.running += 1
+        job.last_started = time.time()
+        started = time.monotonic()
+        try:
+            if job.timeout:
+                await asyncio.wait_for(job.func(), timeout=job.timeout)
+            else:
+                await job.func()
+            job.last_error = None
+        except asyncio.TimeoutError:
+            job.failures += 1
+            job.last_error = f"timed out after {job.timeout:g}s"
+            logger.error(f"Job {job.name} {job.last_error}")
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            logger.error(f"Error in job {job.name}: {e}")
+        finally:
+            if job.last_error and job.retry_after:
+                retry_at = time.time() + job.retry_after
+                if job.next_run is None or retry_at < job.next_run:
+                    self._push(job, retry_at)
+            job.running -= 1
+            job.runs += 1
+            job.last_duration = time.monotonic() - started
+
+# ===== OUTBOUND QUEUE / BROADCAST ENGINE =====
+class TokenBucket:
+    """Token bucket: `rate` tokens per second, bursts up to `capacity`"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hold the bucket for `seconds` (Telegram RetryAfter); one token is ready on resume"""
+        resume = time.monotonic() + seconds
+        self.tokens = min(1, self.capacity)
+        self.updated = max(self.updated, resume)
+        self.paused_until = max(self.paused_until, resume)
+
+    def idle(self, now: float) -> bool:
+        return now >= self.paused_until and \
+            self.tokens + max(0.0, now - self.updated) * self.rate >= self.capacity
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version"""
+    delay = error.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+class MessageDropped(TelegramError):
+    """A queued request waited past its class deadline and was not sent"""
+
+class OutboundQueue(BaseRateLimiter):
+    """Bot API rate limiter: one priority queue in front of the global and per-chat buckets.
+
+    Requests are granted lowest priority value first; a request whose chat bucket is
+    empty is skipped (not blocking other chats) until that bucket refills.
+    """
+    # Queue waits run into minutes: extend the default buckets past the longest max_wait
+    WAIT_BUCKETS = LatencyHistogram.BUCKETS + (30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(OUTBOUND_CONFIG['global_rate'], OUTBOUND_CONFIG['global_rate'])
+        self.chat_buckets: Dict[object, TokenBucket] = {}
+        self._heap: List[tuple] = []  # (priority, seq, chat_key, deadline, future)
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        
+        # Metriche per classe
+        self.wait_latency = {priority: LatencyHistogram(self.WAIT_BUCKETS) for priority in PRIORITY_NAMES}
+        self.sent = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.dropped = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.retried = dict.fromkeys(PRIORITY_NAMES, 0)
+
+    async def initialize(self):
+        self._ensure_dispatcher()
+
+    async def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        while self._heap:
+            future = heapq.heappop(self._heap)[-1]
+            if not future.done():
+                future.set_exception(MessageDropped("Outbound queue shut down"))
+
+    def _ensure_dispatcher(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    def _chat_bucket(self, chat_key) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_key)
+        if bucket is None:
+            if len(self.chat_buckets) >= OUTBOUND_CONFIG['max_chat_buckets']:
+                now = time.monotonic()
+                self.chat_buckets = {key: b for key, b in self.chat_buckets.items() if not b.idle(now)}
+            bucket = TokenBucket(OUTBOUND_CONFIG['per_chat_rate'], OUTBOUND_CONFIG['per_chat_burst'])
+            self.chat_buckets[chat_key] = bucket
+        return bucket
+
+    @staticmethod
+    def _classify(endpoint: str, rate_limit_args) -> int:
+        if isinstance(rate_limit_args, dict) and 'priority' in rate_limit_args:
+            return rate_limit_args['priority']
+        if endpoint in OUTBOUND_CONFIG['moderation_endpoints']:
+            return PRIORITY_MODERATION
+        return PRIORITY_INTERACTIVE
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        # Reads (getChatMember, getMe, ...) don't count against the message limits
+        if endpoint.startswith('get'):
+            return await callback(*args, **kwargs)
+        
+        priority = self._classify(endpoint, rate_limit_args)
+        chat_id = data.get('chat_id')
+        # Per-chat limit applies to groups and channels; private chats only share the global one
+        chat_key = chat_id if isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0) else None
+        enqueued = time.monotonic()
+        max_wait = OUTBOUND_CONFIG['max_wait'].get(priority)
+        deadline = enqueued + max_wait if max_wait else None
+        
+        for attempt in range(OUTBOUND_CONFIG['max_retry_after'] + 1):
+            await self._wait_turn(priority, chat_key, deadline)
+            if attempt == 0:
+                self.wait_latency[priority].observe(time.monotonic() - enqueued)
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent[priority] += 1
+                return result
+            except RetryAfter as e:
+                if attempt == OUTBOUND_CONFIG['max_retry_after']:
+                    raise
+                delay = retry_after_seconds(e)
+                bucket = self._chat_bucket(chat_key) if chat_key is not None else self.global_bucket
+                bucket.pause(delay)
+                self.retried[priority] += 1
+                logger.warning(f"RetryAfter {delay:g}s on {endpoint} to {chat_id}")
+
+    async def _wait_turn(self, priority: int, chat_key, deadline: Optional[float]):
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._heap, (priority, self._seq, chat_key, deadline, future))
+        self._wakeup.set()
+        try:
+            await future
+        except MessageDropped:
+            self.dropped[priority] += 1
+            raise
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            sleep_for = None
+            deferred = []
+            while self._heap:
+                wait = self.global_bucket.wait_time(now)
+                if wait > 0:
+                    sleep_for = wait
+                    break
+                item = heapq.heappop(self._heap)
+                _, _, chat_key, deadline, future = item
+                if future.done():  # caller was cancelled
+                    continue
+                if deadline is not None and now > deadline:
+                    future.set_exception(MessageDropped(f"Dropped after waiting {now - deadline:.0f}s past deadline"))
+                    continue
+                if chat_key is not None:
+                    bucket = self._chat_bucket(chat_key)
+                    chat_wait = bucket.wait_time(now)
+                    if chat_wait > 0:
+                        deferred.append(item)
+                        sleep_for = chat_wait if sleep_for is None else min(sleep_for, chat_wait)
+                        continue
+                    bucket.take(now)
+                self.global_bucket.take(now)
+                future.set_result(None)
+            for item in deferred:
+                heapq.heappush(self._heap, item)
+            
+            if sleep_for is None:
+                await self._wakeup.wait()
+            else:
+                try:
+                    # Woken early by a new request
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=sleep_for)
+                except asyncio.TimeoutError:
+                    pass
+
+    def get_stats(self) -> dict:
+        depth = dict.fromkeys(PRIORITY_NAMES, 0)
+        for priority, *_ in self._heap:
+            depth[priority] += 1
+        return {
+            PRIORITY_NAMES[priority]: {
+                'queued': depth[priority],
+                'sent': self.sent[priority],
+                'dropped': self.dropped[priority],
+                'retried': self.retried[priority],
+                'wait_p50': self.wait_latency[priority].percentile(0.5),
+                'wait_p95': self.wait_latency[priority].percentile(0.95)
+            }
+            for priority in PRIORITY_NAMES
+        }
+
+@dataclass(frozen=True)
+class DeliveryResult:
+    chat_id: int
+    ok: bool
+    attempts: int
+    message_id: Optional[int] = None
+    error: Optional[str] = None
+
+class Broadcaster:
+    """Concurrent fan-out; flood limits and RetryAfter are handled by the bot's OutboundQueue"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_SCHEDULED, **kwargs) -> DeliveryResult:
+        """Send one message, retrying connection errors that happened before it was sent"""
+        error = None
+        max_attempts = BROADCAST_CONFIG['max_attempts']
+        for attempt in range(1, max_attempts + 1):
+            if attempt > 1:
+                self.retries += 1
+            try:
+                message = await self.bot.send_message(
+                    chat_id, text, rate_limit_args={'priority': priority}, **kwargs
+                )
+                self.sent += 1
+                return DeliveryResult(chat_id, True, attempt, message_id=message.message_id)
+            except (BadRequest, Forbidden) as e:
+                # Permanent (chat not found, bot kicked, message too long): retrying won't help.
+                # BadRequest subclasses NetworkError, so it must be caught first
+                error = str(e)
+                break
+            except TimedOut as e:
+                # The message may already be posted; sending it again could duplicate it
+                error = str(e)
+                break
+            except NetworkError as e:
+                error = str(e)
+                if attempt < max_attempts:
+                    await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                # Dropped as stale by the OutboundQueue, or any other API error
+                error = str(e)
+                break
+        self.failed += 1
+        logger.error(f"Error sending broadcast to {chat_id}: {error}")
+        return DeliveryResult(chat_id, False, attempt, error=error)
+
+    async def broadcast(self, chat_ids, text: str, priority: int = PRIORITY_SCHEDULED, **kwargs) -> Dict[int, DeliveryResult]:
+        """Send `text` to every chat concurrently; returns the delivery result per chat"""
+        targets = list(dict.fromkeys(chat_id for chat_id in chat_ids if chat_id))
+        semaphore = asyncio.Semaphore(BROADCAST_CONFIG['concurrency'])
+        
+        async def deliver(chat_id: int) -> DeliveryResult:
+            async with semaphore:
+                try:
+                    return await self.send(chat_id, text, priority, **kwargs)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Error sending broadcast to {chat_id}: {e}")
+                    return DeliveryResult(chat_id, False, 1, error=str(e))
+        
+        results = await asyncio.gather(*(deliver(chat_id) for chat_id in targets))
+        failed = sum(1 for result in results if not result.ok)
+        if failed:
+            logger.warning(f"Broadcast delivered to {len(results) - failed}/{len(results)} channels")
+        return {result.chat_id: result for result in results}
+
+    def get_stats(self) -> dict:
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries
+        }
+
+EVENT_PURCHASE = 'purchase'
+EVENT_MILESTONE_CROSSED = 'milestone_crossed'
+EVENT_SCORE_SAVED = 'score_saved'
+
+class EventBus:
+    """In-process pub/sub; every handler runs in its own task so publishers never wait on it"""
+    def __init__(self):
+        self._handlers: Dict[str, list] = {}
+        self._tasks: set = set()
+        self.published: Dict[str, int] = {}
+
+    def subscribe(self, event: str, handler):
+        """handler is an async callable taking the event payload as keyword arguments"""
+        self._handlers.setdefault(event, []).append(handler)
+
+    def publish(self, event: str, **payload):
+        self.published[event] = self.published.get(event, 0) + 1
+        for handler in self._handlers.get(event, ()):
+            task = asyncio.create_task(self._run(event, handler, payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, event: str, handler, payload: dict):
+        try:
+            await handler(**payload)
+        except Exception as e:
+            logger.error(f"Error in {event} handler {handler.__name__}: {e}")
+
+    async def drain(self):
+        """Wait for handlers still running, e.g. before shutdown"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+@dataclass(frozen=True)
+class PresaleSnapshot:
+    """Immutable presale figures shared by every command and scheduler until the next rebuild"""
+    version: int
+    built_at: datetime
+    raised: float
+    target: float
+    percentage: float
+    remaining: float
+    time_left: timedelta
+    hours_to_complete: float
+    estimated_completion: datetime
+    recent_rate: float          # SOL/hour over the last 24h
+    tokens_sold: float
+    tokens_remaining: float
+    unique_buyers: int
+    buys_last_hour: int
+    buyers_last_hour: int
+    buyers_last_day: int
+    volume_24h: float
+    whales_24h: int
+    sharks_24h: int
+    biggest_24h: float
+
+class PresaleState:
+    """Presale totals kept in memory, loaded from presale_state and updated per purchase"""
+    def __init__(self, raised: float = PRESALE_CONFIG['initial_raised'], max_recent: int = 100):
+        self.raised = raised
+        self.total_buys = 0
+        self.unique_buyers = 0
+        self.last_buy_time: Optional[datetime] = None
+        self.max_recent = max_recent
+        # Latest purchases for display only; window stats come from momentum
+        self.recent_buyers: List[dict] = []
+        self.momentum = RollingAggregator()
+        # Distinct buyers in the last 1h/24h; the all-time count is unique_buyers (exact, from the database)
+        self.buyers_window = WindowedUniqueCounter()
+        self.loaded = False
+        self.version = 0
+        self._snapshot: Optional[PresaleSnapshot] = None
+        self._snapshot_expires = 0.0
+
+    def load(self, state, recent: list, buckets: list = (), buyers: list = ()):
+        """Replace in-memory totals with the database ones"""
+        if state:
+            self.apply_totals(state)
+        self.recent_buyers = [
+            {'amount': tx['amount'], 'buyer': tx['from_address'], 'time': tx['created_at']}
+            for tx in recent
+        ][-self.max_recent:]
+        self.momentum.clear()
+        for bucket in buckets:
+            self.momentum.add_bucket(
+                bucket['minute'], bucket['buys'], bucket['volume'],
+                bucket['whales'], bucket['sharks'], bucket['biggest']
+            )
+        self.buyers_window.clear()
+        for tx in buyers:
+            self.buyers_window.add(tx['from_address'], tx['created_at'])
+        self.loaded = True
+        self._snapshot = None
+
+    def apply_totals(self, state):
+        self.raised = state['raised']
+        self.total_buys = state['total_buys']
+        self.unique_buyers = state['unique_buyers']
+        self.last_buy_time = state['last_buy_time']
+
+    def record(self, amount: float, buyer: str, when: datetime, totals=None):
+        """Add a purchase; totals is the presale_state row returned by the database, if any"""
+        if totals:
+            self.apply_totals(totals)
+        else:
+            # unique_buyers can't be told from the last few buyers; it stays as is until
+            # the totals are reloaded (the spool replay reloads them)
+            self.raised += amount
+            self.total_buys += 1
+            self.last_buy_time = when
+        
+        self.momentum.add(when, amount)
+        self.buyers_window.add(buyer, when)
+        self.recent_buyers.append({
+            'amount': amount,
+            'buyer': buyer,
+            'time': when
+        })
+        if len(self.recent_buyers) > self.max_recent:
+            self.recent_buyers = self.recent_buyers[-self.max_recent:]
+        self._snapshot = None
+
+    @property
+    def snapshot(self) -> PresaleSnapshot:
+        """Current snapshot, rebuilt after a purchase or once the tick has passed"""
+        if self._snapshot is None or time.monotonic() >= self._snapshot_expires:
+            self._snapshot = self._build_snapshot()
+            self._snapshot_expires = time.monotonic() + PRESALE_CONFIG['snapshot_tick']
+        return self._snapshot
+
+    def _build_snapshot(self) -> PresaleSnapshot:
+        now = datetime.now()
+        target = PRESALE_CONFIG['target']
+        remaining = target - self.raised
+        last_hour = self.momentum.window(RollingAggregator.HOUR, now)
+        last_day = self.momentum.window(RollingAggregator.DAY, now)
+        
+        # Estimate completion time based on recent rate
+        recent_rate = last_day['volume'] / 24
+        if recent_rate > 0:
+            hours_to_complete = remaining / recent_rate
+            estimated_completion = now + timedelta(hours=hours_to_complete)
+        else:
+            hours_to_complete = float('inf')
+            estimated_completion = PRESALE_CONFIG['end_date']
+        
+        self.version += 1
+        return PresaleSnapshot(
+            version=self.version,
+            built_at=now,
+            raised=self.raised,
+            target=target,
+            percentage=round(self.raised / target * 100, 1),
+            remaining=remaining,
+            time_left=PRESALE_CONFIG['end_date'] - now,
+            hours_to_complete=hours_to_complete,
+            estimated_completion=estimated_completion,
+            recent_rate=recent_rate,
+            tokens_sold=self.raised * PRESALE_CONFIG['token_price'],
+            tokens_remaining=remaining * PRESALE_CONFIG['token_price'],
+            unique_buyers=self.unique_buyers,
+            buys_last_hour=last_hour['buys'],
+            buyers_last_hour=self.buyers_window.count(RollingAggregator.HOUR, now),
+            buyers_last_day=self.buyers_window.count(RollingAggregator.DAY, now),
+            volume_24h=last_day['volume'],
+            whales_24h=last_day['whales'],
+            sharks_24h=last_day['sharks'],
+            biggest_24h=last_day['biggest']
+        )
+
+class RenderCache:
+    """Rendered (text, reply_markup) pairs keyed by command, snapshot version, chat type
+    and variant; TTL-expired and LRU-evicted"""
+    def __init__(self, max_entries: int = RENDER_CACHE['max_entries'], ttl: float = RENDER_CACHE['ttl']):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires_at, text, markup)
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: tuple, render, ttl: Optional[float] = None) -> tuple:
+        """Cached (text, markup) for key, calling render() on a miss"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+        
+        self.misses += 1
+        text, markup = render()
+        self._entries[key] = (now + (self.ttl if ttl is None else ttl), text, markup)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return text, markup
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
 
 # ===== ENHANCED FOMO BOT CLASS =====
+class MetricsWriter:
+    """Builds a Prometheus text-format exposition"""
+    def __init__(self):
+        self.lines: List[str] = []
+
+    @staticmethod
+    def _labels(labels: Optional[dict], **extra) -> str:
+        merged = {**(labels or {}), **extra}
+        if not merged:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in merged.items()) + '}'
+
+    def metric(self, name: str, kind: str, help_text: str, samples):
+        """samples: a number, or (labels, value) pairs"""
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        if isinstance(samples, (int, float)):
+            samples = [(None, samples)]
+        for labels, value in samples:
+            self.lines.append(f"{name}{self._labels(labels)} {float(value):g}")
+
+    def histogram(self, name: str, help_text: str, histograms):
+        """histograms: (labels, LatencyHistogram) pairs"""
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                self.lines.append(f"{name}_bucket{self._labels(labels, le=bound)} {cumulative}")
+            self.lines.append(f"{name}_bucket{self._labels(labels, le='+Inf')} {histogram.count}")
+            self.lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum:g}")
+            self.lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+# ===== ADMIN CACHE =====
+class AdminCache:
+    """Administrator ids per chat from get_chat_administrators, kept for a TTL.
+
+    Concurrent lookups of the same chat share one in-flight fetch; chat_member
+    updates patch cached entries so promotions and demotions apply immediately.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # chat -> (expires_at, admin ids)
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, chat_id: int) -> frozenset:
+        entry = self._entries.get(chat_id)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(chat_id)
+            return entry[1]
+        
+        self.misses += 1
+        task = self._inflight.get(chat_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch(chat_id))
+            self._inflight[chat_id] = task
+            task.add_done_callback(lambda done: self._inflight.pop(chat_id, None) if self._inflight.get(chat_id) is done else None)
+        # shield: one cancelled caller must not cancel the fetch the others wait on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, chat_id: int) -> frozenset:
+        administrators = await self.bot.get_chat_administrators(chat_id)
+        admins = frozenset(member.user.id for member in administrators)
+        # Skip storing if the entry was invalidated while the request was in flight
+        if self._inflight.get(chat_id) is asyncio.current_task():
+            self._entries[chat_id] = (time.monotonic() + ADMIN_CACHE['ttl'], admins)
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > ADMIN_CACHE['max_chats']:
+                self._entries.popitem(last=False)
+        return admins
+
+    def apply(self, chat_id: int, user_id: int, is_admin: bool):
+        """A chat_member update: patch the cached list (if any) in place"""
+        self._inflight.pop(chat_id, None)
+        entry = self._entries.get(chat_id)
+        if entry:
+            admins = entry[1] | {user_id} if is_admin else entry[1] - {user_id}
+            self._entries[chat_id] = (entry[0], admins)
+
+    def invalidate(self, chat_id: int):
+        self._inflight.pop(chat_id, None)
+        self._entries.pop(chat_id, None)
+
+    def get_stats(self) -> dict:
+        return {'chats': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+# ===== UPDATE PROCESSING =====
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently and those of one chat in arrival order.
+
+    An update takes its chat lock before the base in-flight slot and the worker semaphore,
+    so a flood in one chat holds at most one slot and one worker.
+    """
+    def __init__(self, max_in_flight: int, workers: int):
+        super().__init__(max_in_flight)
+        self.workers = workers
+        self._workers: Optional[asyncio.Semaphore] = None
+        self._chats: Dict[int, list] = {}  # chat -> [lock, updates holding or waiting for it]
+        self.in_flight = 0
+
+    async def initialize(self):
+        self._workers = asyncio.Semaphore(self.workers)
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Queued behind its chat without holding a slot; the base semaphore comes after
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def do_process_update(self, update, coroutine):
+        if self._workers is None:
+            self._workers = asyncio.Semaphore(self.workers)
+        self.in_flight += 1
+        try:
+            async with self._workers:
+                await coroutine
+        finally:
+            self.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'chats': len(self._chats),
+            'waiting': sum(count - 1 for _, count in self._chats.values())
+        }
+
+# ===== WEB SERVER =====
+class WebServer:
+    """aiohttp server shared by the Telegram webhook, the health check and the game static files"""
+    def __init__(self, bot: 'CaptainCatFOMOBot'):
+        self.bot = bot
+        self.secret = WEBHOOK_SECRET or hashlib.sha256(f"webhook:{bot.token}".encode()).hexdigest()
+        # /metrics is on the public URL: scrapers send "Authorization: Bearer <token>"
+        self.metrics_token = METRICS_TOKEN or hashlib.sha256(f"metrics:{self.secret}".encode()).hexdigest()
+        self.runner: Optional[web.AppRunner] = None
+        self.updates_received = 0
+        self.updates_rejected = 0
+        
+        self.app = web.Application()
+        self.app.router.add_get('/', self.health)
+        self.app.router.add_get('/healthz', self.health)
+        self.app.router.add_get('/readyz', self.ready)
+        self.app.router.add_get('/metrics', self.metrics)
+        self.app.router.add_post(WEBHOOK_CONFIG['path'], self.telegram_update)
+        if os.path.isdir(WEBAPP_DIR):
+            self.app.router.add_get('/webapp', self.webapp_index)
+            self.app.router.add_get('/webapp/', self.webapp_index)
+            self.app.router.add_static('/webapp/', WEBAPP_DIR)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '0.0.0.0', PORT).start()
+        logger.info(f"Web server listening on port {PORT}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok', 'mode': self.bot.mode})
+
+    def readiness(self) -> Dict[str, str]:
+        """Component -> 'ok' / 'disabled' / failure reason"""
+        bot = self.bot
+        checks = {'updates': 'ok' if bot.app.running else 'not running'}
+        if not DATABASE_URL:
+            checks['database'] = 'disabled'
+        elif bot.db.available:
+            checks['database'] = 'ok'
+        else:
+            checks['database'] = f"unavailable (circuit {bot.db.breaker.state}, {bot.db.spool.pending} spooled)"
+        if bot.sol_monitor.api_key and bot.sol_monitor.contract_address and bot.sol_monitor.notification_chat:
+            checks['sol_monitor'] = 'ok' if bot.sol_monitor.monitoring else 'stopped'
+        else:
+            checks['sol_monitor'] = 'disabled'
+        checks['scheduler'] = 'ok' if bot.scheduler.healthy else 'stalled'
+        return checks
+
+    async def ready(self, request: web.Request) -> web.Response:
+        checks = self.readiness()
+        ready = all(status in ('ok', 'disabled') for status in checks.values())
+        return web.json_response({'ready': ready, 'checks': checks}, status=200 if ready else 503)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        expected = f"Bearer {self.metrics_token}"
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected.encode()):
+            return web.Response(status=401, headers={'WWW-Authenticate': 'Bearer'})
+        return web.Response(text=self.bot.collect_metrics(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def webapp_index(self, request: web.Request) -> web.FileResponse:
+        return web.FileResponse(os.path.join(WEBAPP_DIR, 'index.html'))
+
+    async def telegram_update(self, request: web.Request) -> web.Response:
+        if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            self.updates_rejected += 1
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.bot.app.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+        self.updates_received += 1
+        # Answer Telegram right away; the Application processes the queue
+        await self.bot.app.update_queue.put(update)
+        return web.Response()
+
 class CaptainCatFOMOBot:
     def __init__(self, token: str):
         self.token = token
-        self.app = Application.builder().token(token).build()
+        # Every Bot API call is queued by priority (moderation > replies > purchases > scheduled)
+        self.outbound = OutboundQueue()
+        self.updates = ChatOrderedUpdateProcessor(UPDATE_PROCESSING['max_in_flight'], UPDATE_PROCESSING['workers'])
+        self.app = Application.builder().token(token).rate_limiter(self.outbound).concurrent_updates(self.updates).build()
         self.db = GameDatabase()
         self.anti_spam = AntiSpamSystem()
         self.sol_monitor = SOLMonitor(self)
         self._web_app_url = os.environ.get('WEBAPP_URL', 'https://gioco-iz17.onrender.com')
+        self.web = WebServer(self)
+        self.mode = 'starting'
+        self.updates_processed: Dict[str, int] = {}
         
-        # FOMO System State
-        self.fomo_stats = {
-            'raised': 0.077168252,  # Aggiungi la transazione vista nei log
-            'last_buy_time': datetime.now(),
-            'recent_buyers': [],
-            'whale_alerts': [],
-            'community_milestones': [],
-            'scheduled_messages': {}
-        }
+        # Presale state, loaded from the database at startup
+        self.presale = PresaleState()
+        self.render_cache = RenderCache()
+        self.db.on_transactions_replayed = self.load_presale_state
+        
+        # Purchases, milestones and scores are pushed to subscribers as they happen
+        self.events = EventBus()
+        self.events.subscribe(EVENT_PURCHASE, self.announce_whale)
+        self.events.subscribe(EVENT_MILESTONE_CROSSED, self.announce_milestone)
+        self._local_announcements: set = set()  # used while the database is unreachable
+        
+        self.scheduler = JobScheduler()
         
-        # Chat animation state
+        # Metric history for the momentum logic and /trend
+        self.metrics = TimeSeriesStore({'game_plays': 'counter'})
+        self.events.subscribe(EVENT_SCORE_SAVED, self.count_game_play)
+        
+        # Chat animation state; activity is tracked per chat
         self.chat_animation = {
             'enabled': True,
-            'last_message_time': datetime.now(),
-            'message_count': 0,
-            'active_users': set(),
             'last_fact': None
         }
+        self.activity = ChatActivityTracker()
         
         # FOMO Channels - aggiungi i tuoi gruppi target
         self.fomo_channels = []
@@ -642,11 +3689,21 @@ class CaptainCatFOMOBot:
             self.fomo_channels.append(int(os.environ.get('MAIN_GROUP_ID')))
         if os.environ.get('ANNOUNCEMENT_CHANNEL_ID'):
             self.fomo_channels.append(int(os.environ.get('ANNOUNCEMENT_CHANNEL_ID')))
+        # Gruppi partner extra, separati da virgola: FOMO_CHANNEL_IDS=-100123,-100456
+        for channel_id in os.environ.get('FOMO_CHANNEL_IDS', '').split(','):
+            if channel_id.strip() and int(channel_id) not in self.fomo_channels:
+                self.fomo_channels.append(int(channel_id))
+        self.broadcaster = Broadcaster(self.app.bot)
+        self.admins = AdminCache(self.app.bot)
         
         self.setup_handlers()
         self.setup_fomo_handlers()
 
     def setup_handlers(self):
+        # Update throughput, counted before any other handler runs
+        self.app.add_handler(TypeHandler(Update, self.count_update), group=-1)
+        self.app.add_handler(ChatMemberHandler(self.track_chat_member, ChatMemberHandler.ANY_CHAT_MEMBER))
+        
         # Basic handlers
         self.app.add_handler(CommandHandler("start", self.start_command))
         self.app.add_handler(CommandHandler("help", self.help_command))
@@ -691,17 +3748,32 @@ class CaptainCatFOMOBot:
         
         # Chat animation commands
         self.app.add_handler(CommandHandler("chatboost", self.chatboost_command))
+        self.app.add_handler(CommandHandler("jobs", self.jobs_command))
+        self.app.add_handler(CommandHandler("trend", self.trend_command))
         self.app.add_handler(CommandHandler("fact", self.crypto_fact_command))
         self.app.add_handler(CommandHandler("motivate", self.motivate_command))
 
     async def is_admin(self, user_id: int, chat_id: int) -> bool:
-        """Check if user is admin"""
+        """Check if user is admin (cached administrator list of the chat)"""
+        if chat_id > 0:  # private chats have no administrators
+            return False
         try:
-            member = await self.app.bot.get_chat_member(chat_id, user_id)
-            return member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]
-        except:
+            return user_id in await self.admins.get(chat_id)
+        except Exception as e:
+            logger.error(f"Error fetching administrators of {chat_id}: {e}")
             return False
 
+    async def track_chat_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Keep the admin cache in step with promotions, demotions and the bot's own status"""
+        change = update.chat_member or update.my_chat_member
+        if not change:
+            return
+        member = change.new_chat_member
+        if update.my_chat_member and member.status in [ChatMember.LEFT, ChatMember.BANNED]:
+            self.admins.invalidate(change.chat.id)
+            return
+        self.admins.apply(change.chat.id, member.user.id, member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER])
+
     async def _send_game_fallback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Fallback when Web App doesn't work"""
         user = update.effective_user
@@ -717,68 +3789,84 @@ class CaptainCatFOMOBot:
 3. Have fun and climb the leaderboard!
 
 🏆 Scores will be saved for this group!
-        """
-        
-        keyboard = [
-            [InlineKeyboardButton("🤖 Private Chat", url=f"https://t.me/{context.bot.username}")],
-            [InlineKeyboardButton("🔗 Direct Link", url=self._web_app_url)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        try:
-            if update.callback_query:
-                await update.callback_query.edit_message_text(fallback_text, reply_markup=reply_markup, parse_mode='Markdown')
-            else:
-                await update.message.reply_text(fallback_text, reply_markup=reply_markup, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Error sending fallback: {e}")
-
-    # ===== PRESALE TRACKING =====
-    def get_presale_progress(self) -> dict:
-        """Calculate current presale progress"""
-        raised = self.fomo_stats['raised']
-        target = PRESALE_CONFIG['target']
-        percentage = (raised / target) * 100
-        remaining = target - raised
-        
-        # Calculate time left
-        now = datetime.now()
-        time_left = PRESALE_CONFIG['end_date'] - now
-        
-        # Estimate completion time based on recent rate
-        recent_rate = self.calculate_recent_rate()
-        if recent_rate > 0:
-            hours_to_complete = remaining / recent_rate
-            estimated_completion = now + timedelta(hours=hours_to_complete)
-        else:
-            hours_to_complete = float('inf')
-            estimated_completion = PRESALE_CONFIG['end_date']
-        
-        return {
-            'raised': raised,
-            'target': target,
-            'percentage': round(percentage, 1),
-            'remaining': remaining,
-            'time_left': time_left,
-            'hours_to_complete': hours_to_complete,
-            'estimated_completion': estimated_completion,
-            'recent_rate': recent_rate,
-            'tokens_sold': raised * PRESALE_CONFIG['token_price'],
-            'tokens_remaining': remaining * PRESALE_CONFIG['token_price']
-        }
-
-    def calculate_recent_rate(self) -> float:
-        """Calculate SOL/hour rate from recent transactions"""
-        # Get transactions from last 24h
-        recent = [tx for tx in self.fomo_stats['recent_buyers'] 
-                 if datetime.now() - tx['time'] < timedelta(hours=24)]
+        """
         
-        if not recent:
-            return 0.0
+        keyboard = [
+            [InlineKeyboardButton("🤖 Private Chat", url=f"https://t.me/{context.bot.username}")],
+            [InlineKeyboardButton("🔗 Direct Link", url=self._web_app_url)]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
         
-        total_amount = sum(tx['amount'] for tx in recent)
-        hours_elapsed = 24
-        return total_amount / hours_elapsed
+        try:
+            if update.callback_query:
+                await update.callback_query.edit_message_text(fallback_text, reply_markup=reply_markup, parse_mode='Markdown')
+            else:
+                await update.message.reply_text(fallback_text, reply_markup=reply_markup, parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Error sending fallback: {e}")
+
+    # ===== PRESALE TRACKING =====
+    async def load_presale_state(self):
+        """Load presale totals and recent buyers from the database"""
+        state, recent, buckets, buyers = await self.db.load_presale_state(self.presale.max_recent)
+        if state:
+            self.presale.load(state, recent, buckets, buyers)
+            logger.info(f"Presale state loaded: {self.presale.raised:.2f} SOL from {self.presale.total_buys} buys")
+            await self.announce_missed_milestones()
+
+    async def announce_missed_milestones(self):
+        """Milestones crossed while the bot was down or by spool replay, after a (re)load.
+        Only the highest one is announced; lower ones are marked as made without posting."""
+        if not self.db.available:
+            # Claims would only be kept in memory and repeated after the next restart
+            return
+        snapshot = self.presale.snapshot
+        reached = [m for m in PRESALE_CONFIG['announce_milestones'] if m <= snapshot.percentage]
+        if not reached:
+            return
+        announced_before = await self.db.has_announcements('milestone')
+        if announced_before is None:
+            return
+        if not announced_before:
+            # First run with announcements: what is already raised is not news
+            for milestone in reached:
+                await self._claim_announcement('milestone', str(milestone))
+            logger.info(f"Milestones {reached} already reached, recorded without announcing")
+            return
+        for milestone in reached[:-1]:
+            await self._claim_announcement('milestone', str(milestone))
+        # announce_milestone claims it, so an already announced one is skipped
+        self.events.publish(EVENT_MILESTONE_CROSSED, milestone=reached[-1], snapshot=snapshot)
+
+    async def record_purchase(self, tx_data: dict) -> bool:
+        """Persist a purchase and update presale state; False if it was already known"""
+        if not self.presale.loaded and self.db.available:
+            # Database came up after startup
+            await self.load_presale_state()
+        bought_at = datetime.now()
+        totals = await self.db.log_transaction(
+            tx_data['hash'], tx_data['from_address'],
+            tx_data['amount'], tx_data['timestamp'], bought_at
+        )
+        if totals is False:
+            return False
+        before = self.presale.snapshot.percentage
+        self.presale.record(tx_data['amount'], tx_data['from_address'], bought_at, totals or None)
+        
+        snapshot = self.presale.snapshot
+        self.events.publish(EVENT_PURCHASE, tx=tx_data, snapshot=snapshot)
+        for milestone in PRESALE_CONFIG['announce_milestones']:
+            if before < milestone <= snapshot.percentage:
+                self.events.publish(EVENT_MILESTONE_CROSSED, milestone=milestone, snapshot=snapshot)
+        return True
+
+    async def _claim_announcement(self, kind: str, key: str) -> bool:
+        """Whether this announcement still has to be made; records it as made"""
+        claimed = await self.db.claim_announcement(kind, key)
+        if claimed is None:
+            claimed = (kind, key) not in self._local_announcements
+        self._local_announcements.add((kind, key))
+        return claimed
 
     def create_progress_visual(self, percentage: float) -> str:
         """Create visual progress bar"""
@@ -804,38 +3892,39 @@ class CaptainCatFOMOBot:
     @handle_errors
     async def live_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show live presale statistics with FOMO elements"""
-        progress = self.get_presale_progress()
-        recent_buyers = len([tx for tx in self.fomo_stats['recent_buyers'] 
-                           if datetime.now() - tx['time'] < timedelta(hours=1)])
+        text, reply_markup = self._render_cached('live_stats', update, self._render_live_stats)
+        await self._send_rendered(update, text, reply_markup)
+
+    def _render_live_stats(self, progress: PresaleSnapshot) -> tuple:
+        recent_buyers = progress.buys_last_hour
         
         # Get whale count
-        whale_count = len([tx for tx in self.fomo_stats['recent_buyers']
-                         if tx['amount'] >= PRESALE_CONFIG['minimum_whale']])
+        whale_count = progress.whales_24h
         
         stats_message = f"""
 🔥 **CAPTAINCAT PRESALE LIVE STATS** 🔥
 
-{self.create_progress_visual(progress['percentage'])}
+{self.create_progress_visual(progress.percentage)}
 
-💰 **Raised:** {progress['raised']}/{progress['target']} SOL
-📊 **Progress:** {progress['percentage']}%
-⏰ **Time Left:** {progress['time_left'].days}d {progress['time_left'].seconds//3600}h
+💰 **Raised:** {progress.raised}/{progress.target} SOL
+📊 **Progress:** {progress.percentage}%
+⏰ **Time Left:** {progress.time_left.days}d {progress.time_left.seconds//3600}h
 
 📈 **MOMENTUM INDICATORS:**
-• **Last Hour:** {recent_buyers} new investors
-• **24h Rate:** {progress['recent_rate']:.2f} SOL/hour
+• **Last Hour:** {progress.buyers_last_hour} new investors
+• **24h Rate:** {progress.recent_rate:.2f} SOL/hour
 • **Whales:** {whale_count} joined ({whale_count * PRESALE_CONFIG['minimum_whale']}+ SOL)
-• **Completion ETA:** {progress['hours_to_complete']:.1f} hours
+• **Completion ETA:** {progress.hours_to_complete:.1f} hours
 
 🚨 **CRITICAL LEVELS:**
-{"⚡ FOMO ZONE - Filling rapidly!" if progress['percentage'] > 70 else ""}
+{"⚡ FOMO ZONE - Filling rapidly!" if progress.percentage > 70 else ""}
 {"🔥 MOMENTUM BUILDING!" if recent_buyers > 5 else ""}
 {"🐋 WHALE ALERT ACTIVE!" if whale_count > 0 else ""}
 
-💎 **Tokens Sold:** {progress['tokens_sold']:,.0f} CAT
-🎯 **Still Available:** {progress['tokens_remaining']:,.0f} CAT
+💎 **Tokens Sold:** {progress.tokens_sold:,.0f} CAT
+🎯 **Still Available:** {progress.tokens_remaining:,.0f} CAT
 
-⚠️ **WARNING:** At current rate, presale ends in {progress['hours_to_complete']:.0f} hours!
+⚠️ **WARNING:** At current rate, presale ends in {progress.hours_to_complete:.0f} hours!
 """
         
         keyboard = [
@@ -843,18 +3932,12 @@ class CaptainCatFOMOBot:
             [InlineKeyboardButton("📊 Check Progress", callback_data="presale_progress"),
              InlineKeyboardButton("🔥 Recent Buys", callback_data="recent_buyers")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Handle both message and callback query
-        if update.callback_query:
-            await update.callback_query.edit_message_text(stats_message, reply_markup=reply_markup, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(stats_message, reply_markup=reply_markup, parse_mode='Markdown')
+        return stats_message, InlineKeyboardMarkup(keyboard)
 
     @handle_errors
     async def whobought_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show recent buyers to create FOMO"""
-        recent = sorted(self.fomo_stats['recent_buyers'], 
+        recent = sorted(self.presale.recent_buyers, 
                        key=lambda x: x['time'], reverse=True)[:10]
         
         if not recent:
@@ -1031,25 +4114,25 @@ class CaptainCatFOMOBot:
     @handle_errors
     async def fomo_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Ultimate FOMO summary message"""
-        progress = self.get_presale_progress()
-        recent_buyers = len([tx for tx in self.fomo_stats['recent_buyers'] 
-                           if datetime.now() - tx['time'] < timedelta(hours=1)])
-        
-        # Random FOMO facts
-        fomo_facts = [
-            f"🔥 {recent_buyers} people bought in the last hour!",
-            f"⚡ Only {progress['remaining']} SOL spots left!",
-            f"🚀 {progress['percentage']:.1f}% already sold!",
-            f"💎 Last buyer got {random.randint(100000, 150000)} CAT!",
-            f"⏰ Presale ends in {progress['time_left'].days} days!",
-            f"🐋 Biggest buy today: {max([tx['amount'] for tx in self.fomo_stats['recent_buyers']] or [0])} SOL!"
-        ]
-        
-        message = f"""
-🚨🔥 **CAPTAINCAT FOMO ALERT** 🔥🚨
-
-{random.choice(fomo_facts)}
+        progress = self.presale.snapshot
+        body, reply_markup = self._render_cached('fomo', update, self._render_fomo)
+        # The random fact is picked per request, so the cache doesn't freeze it
+        text = f"\n🚨🔥 **CAPTAINCAT FOMO ALERT** 🔥🚨\n\n{self._fomo_fact(progress)}\n{body}"
+        await self._send_rendered(update, text, reply_markup)
+
+    def _fomo_fact(self, progress: PresaleSnapshot) -> str:
+        return random.choice(FOMO_FACTS).format(
+            recent_buyers=progress.buys_last_hour,
+            remaining=progress.remaining,
+            percent=progress.percentage,
+            last_buyer_tokens=random.randint(100000, 150000),
+            days_left=progress.time_left.days,
+            biggest=progress.biggest_24h
+        )
 
+    def _render_fomo(self, progress: PresaleSnapshot) -> tuple:
+        """Everything below the random fact"""
+        message = f"""
 **❓ WHY EVERYONE'S BUYING:**
 
 1️⃣ **MASSIVE POTENTIAL**
@@ -1058,12 +4141,12 @@ class CaptainCatFOMOBot:
 • Stronger community growth
 
 2️⃣ **LIMITED SUPPLY**
-• Only {progress['remaining']} SOL spots left
-• {progress['percentage']:.1f}% already gone
+• Only {progress.remaining} SOL spots left
+• {progress.percentage:.1f}% already gone
 • These prices = NEVER AGAIN
 
 3️⃣ **SMART MONEY MOVING**
-• {len([tx for tx in self.fomo_stats['recent_buyers'] if tx['amount'] >= 50])} whales joined
+• {progress.whales_24h} whales joined
 • Top traders accumulating
 • Influencers coming onboard
 
@@ -1094,19 +4177,15 @@ This is your LAST CHANCE at presale prices!
             [InlineKeyboardButton("📊 Check Stats", callback_data="live_stats"),
              InlineKeyboardButton("💰 Recent Buys", callback_data="recent_buyers")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Handle both message and callback query
-        if update.callback_query:
-            await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+        return message, InlineKeyboardMarkup(keyboard)
 
     @handle_errors
     async def milestone_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show upcoming milestones"""
-        progress = self.get_presale_progress()
-        
+        text, reply_markup = self._render_cached('milestones', update, self._render_milestones)
+        await self._send_rendered(update, text, reply_markup)
+
+    def _render_milestones(self, progress: PresaleSnapshot) -> tuple:
         milestones = [
             {'percent': 50, 'reward': 'Unlock Game Beta', 'emoji': '🎮'},
             {'percent': 60, 'reward': 'Partnership Reveal', 'emoji': '🤝'},
@@ -1119,7 +4198,7 @@ This is your LAST CHANCE at presale prices!
         message = "🏆 **PRESALE MILESTONES** 🏆\n\n"
         
         for milestone in milestones:
-            if progress['percentage'] >= milestone['percent']:
+            if progress.percentage >= milestone['percent']:
                 status = "✅ UNLOCKED"
                 style = "**"
             else:
@@ -1128,98 +4207,100 @@ This is your LAST CHANCE at presale prices!
             
             message += f"{milestone['emoji']} {style}{milestone['percent']}% - {milestone['reward']}{style} {status}\n"
         
-        message += f"\n📊 **Current Progress:** {progress['percentage']:.1f}%"
-        message += f"\n🎯 **Next Milestone:** {next((m['percent'] for m in milestones if m['percent'] > progress['percentage']), 100)}%"
+        message += f"\n📊 **Current Progress:** {progress.percentage:.1f}%"
+        message += f"\n🎯 **Next Milestone:** {next((m['percent'] for m in milestones if m['percent'] > progress.percentage), 100)}%"
         message += "\n\n⚡ **Help us reach next milestone!**"
         
         keyboard = [
             [InlineKeyboardButton("🚀 Contribute Now!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")],
             [InlineKeyboardButton("📊 Live Progress", callback_data="live_stats")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+        return message, InlineKeyboardMarkup(keyboard)
+
+    def _render_cached(self, command: str, update: Update, render, variant=None, ttl: Optional[float] = None) -> tuple:
+        """(text, reply_markup) from the render cache, rendering against the current snapshot on a miss"""
+        snapshot = self.presale.snapshot
+        key = (command, snapshot.version, update.effective_chat.type, variant)
+        return self.render_cache.get_or_render(key, lambda: render(snapshot), ttl)
+
+    async def _send_rendered(self, update: Update, text: str, reply_markup=None):
         # Handle both message and callback query
         if update.callback_query:
-            await update.callback_query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
         else:
-            await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
     # ===== AUTOMATED FOMO MESSAGES =====
     async def start_fomo_scheduler(self):
-        """Start automated FOMO message scheduler"""
-        asyncio.create_task(self.hourly_fomo_blast())
-        asyncio.create_task(self.momentum_tracker())
-        asyncio.create_task(self.whale_watcher())
-        asyncio.create_task(self.milestone_announcer())
-        asyncio.create_task(self.countdown_timer())
-        asyncio.create_task(self.chat_animator())
-        asyncio.create_task(self.community_engager())
-        asyncio.create_task(self.random_fact_sender())
+        """Register the automated FOMO jobs (and DB housekeeping) and start the scheduler"""
+        jobs = self.scheduler
+        jobs.add('sample_metrics', self.sample_metrics,
+                 IntervalTrigger(TIMESERIES_CONFIG['sample_interval'], start_after=0), misfire='skip')
+        jobs.add('hourly_fomo_blast', self.hourly_fomo_blast, IntervalTrigger(3600))
+        jobs.add('momentum_tracker', self.momentum_tracker, IntervalTrigger(1800))
+        # Once per day at noon
+        jobs.add('countdown_timer', self.countdown_timer, CronTrigger([12]), misfire='skip', misfire_grace=3600)
+        jobs.add('chat_animator', self.chat_animator, IntervalTrigger(300, jitter=300, start_after=600))
+        jobs.add('community_engager', self.community_engager,
+                 CronTrigger(COMMUNITY_ENGAGER_MESSAGES.keys(), jitter=600), misfire='skip', misfire_grace=1800)
+        jobs.add('random_fact_sender', self.random_fact_sender, IntervalTrigger(7200, jitter=3600, start_after=1800))
+        jobs.add('chat_activity_eviction', self.evict_idle_chats, IntervalTrigger(3600))
+        if DATABASE_URL:
+            jobs.add('partition_maintenance', self.db.maintain_partitions,
+                     IntervalTrigger(PARTITION_CONFIG['maintenance_interval'], start_after=0),
+                     retry_after=PARTITION_CONFIG['retry_interval'])
+            # Replaying a large spool can take a while; never cut it short
+            jobs.add('spool_replay', self.db.replay_spool_if_pending,
+                     IntervalTrigger(SPOOL_CONFIG['replay_interval']), timeout=0)
+        jobs.start()
         logger.info("FOMO scheduler started!")
 
     async def hourly_fomo_blast(self):
         """Send hourly FOMO updates"""
-        while True:
-            try:
-                await asyncio.sleep(3600)  # 1 hour
-                
-                progress = self.get_presale_progress()
-                message_type = random.choice(['urgency', 'social_proof', 'scarcity', 'price_action'])
-                
-                # Select and format message
-                template = random.choice(FOMO_MESSAGES[message_type])
-                
-                # Format with real data
-                message = template.format(
-                    percent=progress['percentage'],
-                    remaining=progress['remaining'],
-                    time_left=f"{progress['time_left'].days}d {progress['time_left'].seconds//3600}h",
-                    recent_buyers=len([tx for tx in self.fomo_stats['recent_buyers'] 
-                                     if datetime.now() - tx['time'] < timedelta(hours=1)]),
-                    estimated_hours=progress['hours_to_complete'],
-                    total_holders=len(set(tx['buyer'] for tx in self.fomo_stats['recent_buyers'])),
-                    whale_count=len([tx for tx in self.fomo_stats['recent_buyers'] 
-                                   if tx['amount'] >= PRESALE_CONFIG['minimum_whale']]),
-                    growth_rate=random.randint(20, 50),
-                    tokens_left=(progress['remaining'] * PRESALE_CONFIG['token_price']) / 1_000_000,
-                    percent_left=100 - progress['percentage'],
-                    bonus=PRESALE_CONFIG['early_bird_bonus']
-                )
-                
-                # Add call to action
-                message += "\n\n🔥 **Don't miss out!**"
-                message += f"\n👉 @Captain_cat_Cain"
-                
-                # Send to all FOMO channels
-                for channel_id in self.fomo_channels:
-                    if channel_id:
-                        try:
-                            keyboard = [[InlineKeyboardButton("💎 BUY NOW!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
-                            await self.app.bot.send_message(
-                                channel_id, 
-                                message, 
-                                reply_markup=InlineKeyboardMarkup(keyboard),
-                                parse_mode='Markdown'
-                            )
-                        except Exception as e:
-                            logger.error(f"Error sending FOMO blast to {channel_id}: {e}")
-                
-            except Exception as e:
-                logger.error(f"Error in hourly FOMO blast: {e}")
-                await asyncio.sleep(60)
+        progress = self.presale.snapshot
+        message_type = random.choice(['urgency', 'social_proof', 'scarcity', 'price_action'])
+        
+        # Select and format message
+        template = random.choice(FOMO_MESSAGES[message_type])
+        
+        # Format with real data
+        message = template.format(
+            percent=progress.percentage,
+            remaining=progress.remaining,
+            time_left=f"{progress.time_left.days}d {progress.time_left.seconds//3600}h",
+            recent_buyers=progress.buys_last_hour,
+            estimated_hours=progress.hours_to_complete,
+            total_holders=progress.unique_buyers,
+            whale_count=progress.whales_24h,
+            growth_rate=random.randint(20, 50),
+            tokens_left=(progress.remaining * PRESALE_CONFIG['token_price']) / 1_000_000,
+            percent_left=100 - progress.percentage,
+            bonus=PRESALE_CONFIG['early_bird_bonus']
+        )
+        
+        # Add call to action
+        message += "\n\n🔥 **Don't miss out!**"
+        message += f"\n👉 @Captain_cat_Cain"
+        
+        # Send to all FOMO channels
+        keyboard = [[InlineKeyboardButton("💎 BUY NOW!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
+        await self.broadcaster.broadcast(
+            self.fomo_channels,
+            message,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
 
     async def momentum_tracker(self):
         """Track and announce momentum changes"""
-        last_rate = 0
+        series = self.metrics.get('buy_rate')
+        if not series or not series.last:
+            return
+        current_rate = series.last[1]
+        last_rate = series.value_at(time.time() - 1800)  # 30 minutes ago
         
-        while True:
-            try:
-                await asyncio.sleep(1800)  # 30 minutes
-                
-                current_rate = self.calculate_recent_rate()
-                
-                if current_rate > last_rate * 1.5 and current_rate > 1:  # 50% increase in rate
-                    message = f"""
+        if last_rate and current_rate > last_rate * 1.5 and current_rate > 1:  # 50% increase in rate
+            message = f"""
 🚀 **MOMENTUM ALERT** 🚀
 
 📈 **Buying rate EXPLODED!**
@@ -1228,44 +4309,42 @@ This is your LAST CHANCE at presale prices!
 • Increase: {((current_rate/last_rate - 1) * 100):.0f}%!
 
 🔥 **FOMO is building! Join the wave!**
-                    """
-                    
-                    for channel_id in self.fomo_channels:
-                        if channel_id:
-                            try:
-                                await self.app.bot.send_message(channel_id, message, parse_mode='Markdown')
-                            except:
-                                pass
-                
-                last_rate = current_rate
-                
-            except Exception as e:
-                logger.error(f"Error in momentum tracker: {e}")
-                await asyncio.sleep(60)
-
-    async def whale_watcher(self):
-        """Special alerts for whale purchases"""
-        while True:
-            try:
-                await asyncio.sleep(60)  # Check every minute
-                
-                # Check for new whales in recent buyers
-                for tx in self.fomo_stats['recent_buyers']:
-                    if tx['amount'] >= PRESALE_CONFIG['minimum_whale'] and not tx.get('announced'):
-                        tx['announced'] = True
-                        
-                        # Create whale alert
-                        if tx['amount'] >= 200:
-                            emoji = "🐋🐋🐋"
-                            title = "MEGA WHALE ALERT"
-                        elif tx['amount'] >= 100:
-                            emoji = "🐋🐋"
-                            title = "WHALE ALERT"
-                        else:
-                            emoji = "🐋"
-                            title = "WHALE SPOTTED"
-                        
-                        message = f"""
+            """
+            
+            await self.broadcaster.broadcast(self.fomo_channels, message, parse_mode='Markdown')
+
+    async def sample_metrics(self):
+        """Record the gauges of the metric history"""
+        now = time.time()
+        progress = self.presale.snapshot
+        self.metrics.add('raised', progress.raised, now)
+        self.metrics.add('buy_rate', progress.recent_rate, now)
+        # Sum of per-chat distinct senders over the last 1-2h
+        chatters = sum(activity.distinct_senders(now) for activity in self.activity.chats.values())
+        self.metrics.add('active_chatters', chatters, now)
+
+    async def count_game_play(self, **payload):
+        self.metrics.add('game_plays', 1)
+
+    async def announce_whale(self, tx: dict, snapshot: PresaleSnapshot):
+        """Whale alert for a purchase, sent as soon as it is recorded"""
+        if tx['amount'] < PRESALE_CONFIG['minimum_whale']:
+            return
+        if not await self._claim_announcement('whale', tx['hash']):
+            return
+        
+        # Create whale alert
+        if tx['amount'] >= 200:
+            emoji = "🐋🐋🐋"
+            title = "MEGA WHALE ALERT"
+        elif tx['amount'] >= 100:
+            emoji = "🐋🐋"
+            title = "WHALE ALERT"
+        else:
+            emoji = "🐋"
+            title = "WHALE SPOTTED"
+        
+        message = f"""
 {emoji} **{title}** {emoji}
 
 💰 **Amount:** {tx['amount']} SOL
@@ -1277,134 +4356,94 @@ This is your LAST CHANCE at presale prices!
 🎯 **Whales know something...**
 
 Don't let them buy it all!
-                        """
-                        
-                        keyboard = [[InlineKeyboardButton("🐋 Join the Whales!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
-                        
-                        for channel_id in self.fomo_channels:
-                            if channel_id:
-                                try:
-                                    await self.app.bot.send_message(
-                                        channel_id, 
-                                        message,
-                                        reply_markup=InlineKeyboardMarkup(keyboard),
-                                        parse_mode='Markdown'
-                                    )
-                                except:
-                                    pass
-                
-            except Exception as e:
-                logger.error(f"Error in whale watcher: {e}")
-                await asyncio.sleep(60)
+        """
+        
+        keyboard = [[InlineKeyboardButton("🐋 Join the Whales!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
+        
+        await self.broadcaster.broadcast(
+            self.fomo_channels,
+            message,
+            PRIORITY_PURCHASE,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
 
-    async def milestone_announcer(self):
-        """Announce when milestones are reached"""
-        announced_milestones = set()
+    async def announce_milestone(self, milestone: int, snapshot: PresaleSnapshot):
+        """Milestone announcement, sent when a purchase crosses the threshold"""
+        if not await self._claim_announcement('milestone', str(milestone)):
+            return
         
-        milestones = [25, 50, 60, 70, 75, 80, 85, 90, 95, 98, 99]
+        # Special messages for different milestones
+        if milestone >= 90:
+            urgency = "🚨🚨🚨 FINAL HOURS 🚨🚨🚨"
+            action = "LAST CHANCE - BUY NOW OR CRY LATER!"
+        elif milestone >= 75:
+            urgency = "⚡⚡ ALMOST GONE ⚡⚡"
+            action = "Hurry! Only few spots left!"
+        else:
+            urgency = "🎯 MILESTONE REACHED 🎯"
+            action = "Join before it's too late!"
         
-        while True:
-            try:
-                await asyncio.sleep(300)  # Check every 5 minutes
-                
-                progress = self.get_presale_progress()
-                current_percent = progress['percentage']
-                
-                for milestone in milestones:
-                    if current_percent >= milestone and milestone not in announced_milestones:
-                        announced_milestones.add(milestone)
-                        
-                        # Special messages for different milestones
-                        if milestone >= 90:
-                            urgency = "🚨🚨🚨 FINAL HOURS 🚨🚨🚨"
-                            action = "LAST CHANCE - BUY NOW OR CRY LATER!"
-                        elif milestone >= 75:
-                            urgency = "⚡⚡ ALMOST GONE ⚡⚡"
-                            action = "Hurry! Only few spots left!"
-                        else:
-                            urgency = "🎯 MILESTONE REACHED 🎯"
-                            action = "Join before it's too late!"
-                        
-                        message = f"""
+        message = f"""
 {urgency}
 
 🏆 **PRESALE {milestone}% COMPLETE!** 🏆
 
 📊 **Stats:**
-• Raised: {progress['raised']}/{progress['target']} SOL
-• Remaining: Only {progress['remaining']} SOL!
-• Investors: {len(set(tx['buyer'] for tx in self.fomo_stats['recent_buyers']))}+
+• Raised: {snapshot.raised}/{snapshot.target} SOL
+• Remaining: Only {snapshot.remaining} SOL!
+• Investors: {snapshot.unique_buyers}+
 
 {action}
 
 #CaptainCat #Presale #SOL
-                        """
-                        
-                        keyboard = [[InlineKeyboardButton("🚀 GET IN NOW!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
-                        
-                        for channel_id in self.fomo_channels:
-                            if channel_id:
-                                try:
-                                    await self.app.bot.send_message(
-                                        channel_id,
-                                        message,
-                                        reply_markup=InlineKeyboardMarkup(keyboard),
-                                        parse_mode='Markdown'
-                                    )
-                                except:
-                                    pass
-                
-            except Exception as e:
-                logger.error(f"Error in milestone announcer: {e}")
-                await asyncio.sleep(60)
+        """
+        
+        keyboard = [[InlineKeyboardButton("🚀 GET IN NOW!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
+        
+        await self.broadcaster.broadcast(
+            self.fomo_channels,
+            message,
+            PRIORITY_PURCHASE,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
 
     async def countdown_timer(self):
-        """Special countdown messages for final days"""
-        while True:
-            try:
-                time_left = PRESALE_CONFIG['end_date'] - datetime.now()
-                days_left = time_left.days
-                
-                # Special messages for final countdown
-                if days_left <= 7 and days_left > 0:
-                    if datetime.now().hour == 12:  # Once per day at noon
-                        
-                        if days_left == 1:
-                            message = "🚨 **24 HOURS LEFT!** 🚨\n\nThis is your FINAL CHANCE!"
-                        elif days_left <= 3:
-                            message = f"⏰ **ONLY {days_left} DAYS LEFT!** ⏰\n\nTime is running out!"
-                        else:
-                            message = f"📅 **{days_left} DAYS REMAINING** 📅\n\nDon't procrastinate!"
-                        
-                        progress = self.get_presale_progress()
-                        message += f"\n\n💎 Still available: {progress['remaining']} SOL"
-                        message += f"\n🔥 Current progress: {progress['percentage']:.1f}%"
-                        message += "\n\n⚡ **Every second counts now!**"
-                        
-                        keyboard = [[InlineKeyboardButton("⏰ BUY BEFORE TIME RUNS OUT!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
-                        
-                        for channel_id in self.fomo_channels:
-                            if channel_id:
-                                try:
-                                    await self.app.bot.send_message(
-                                        channel_id,
-                                        message,
-                                        reply_markup=InlineKeyboardMarkup(keyboard),
-                                        parse_mode='Markdown'
-                                    )
-                                except Exception as e:
-                                    logger.error(f"Error sending countdown message to {channel_id}: {e}")
-                
-                await asyncio.sleep(3600)  # Check every hour
-                
-            except Exception as e:
-                logger.error(f"Error in countdown timer: {e}")
-                await asyncio.sleep(3600)
+        """Special countdown messages for final days (runs daily at noon)"""
+        time_left = PRESALE_CONFIG['end_date'] - datetime.now()
+        days_left = time_left.days
+        
+        # Special messages for final countdown
+        if not 0 < days_left <= 7:
+            return
+        
+        if days_left == 1:
+            message = "🚨 **24 HOURS LEFT!** 🚨\n\nThis is your FINAL CHANCE!"
+        elif days_left <= 3:
+            message = f"⏰ **ONLY {days_left} DAYS LEFT!** ⏰\n\nTime is running out!"
+        else:
+            message = f"📅 **{days_left} DAYS REMAINING** 📅\n\nDon't procrastinate!"
+        
+        progress = self.presale.snapshot
+        message += f"\n\n💎 Still available: {progress.remaining} SOL"
+        message += f"\n🔥 Current progress: {progress.percentage:.1f}%"
+        message += "\n\n⚡ **Every second counts now!**"
+        
+        keyboard = [[InlineKeyboardButton("⏰ BUY BEFORE TIME RUNS OUT!", url="https://pump.fun/coin/645KfggWctSTynpqaVCGut4cmR3XQ5bwtiHjpg8Epump")]]
+        
+        await self.broadcaster.broadcast(
+            self.fomo_channels,
+            message,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
     
     # ===== CHAT ANIMATION FEATURES =====
     async def chat_animator(self):
         """Animate chat with light engaging messages"""
-        await asyncio.sleep(600)  # Wait 10 min after start
+        if not self.chat_animation['enabled']:
+            return
         
         engagement_messages = [
             "🎯 Quick question fam: Who's already in the game? Drop a 🐱 if you're a CAT holder!",
@@ -1437,98 +4476,43 @@ Don't let them buy it all!
             "💡 Any suggestions for the project? We're listening!"
         ]
         
-        while self.chat_animation['enabled']:
-            try:
-                # Check chat activity
-                time_since_last = datetime.now() - self.chat_animation['last_message_time']
-                
-                # If chat is quiet for 20-40 min, send something
-                if time_since_last.seconds > random.randint(1200, 2400):
-                    # Choose message type
-                    message_type = random.choice(['engagement', 'question', 'motivation'])
-                    
-                    if message_type == 'engagement':
-                        message = random.choice(engagement_messages)
-                    elif message_type == 'question':
-                        message = random.choice(questions)
-                    else:
-                        message = await self.get_motivation_message()
-                    
-                    for channel_id in self.fomo_channels:
-                        if channel_id:
-                            try:
-                                await self.app.bot.send_message(
-                                    channel_id,
-                                    message,
-                                    parse_mode='Markdown'
-                                )
-                                self.chat_animation['last_message_time'] = datetime.now()
-                            except:
-                                pass
-                
-                # Wait before next check
-                await asyncio.sleep(random.randint(300, 600))  # 5-10 min
-                
-            except Exception as e:
-                logger.error(f"Error in chat animator: {e}")
-                await asyncio.sleep(600)
+        # Only chats quiet for 20-40 min get something
+        quiet = self.activity.quiet_chats(self.fomo_channels, random.randint(1200, 2400))
+        if quiet:
+            # Choose message type
+            message_type = random.choice(['engagement', 'question', 'motivation'])
+            
+            if message_type == 'engagement':
+                message = random.choice(engagement_messages)
+            elif message_type == 'question':
+                message = random.choice(questions)
+            else:
+                message = await self.get_motivation_message()
+            
+            results = await self.broadcaster.broadcast(quiet, message, parse_mode='Markdown')
+            for result in results.values():
+                if result.ok:
+                    self.activity.mark_posted(result.chat_id)
 
     async def community_engager(self):
-        """Send periodic community building messages"""
-        await asyncio.sleep(900)  # Wait 15 min
+        """Send community building messages at the COMMUNITY_ENGAGER_MESSAGES hours"""
+        messages = COMMUNITY_ENGAGER_MESSAGES.get(datetime.now().hour)
+        if not messages:
+            return
         
-        while True:
-            try:
-                hour = datetime.now().hour
-                
-                # Time-based messages
-                if hour == 9:  # Morning
-                    messages = [
-                        "☀️ **GM CAT FAM!** ☀️\n\nNew day, new opportunities! Let's make it count! 🚀",
-                        "🌅 **Rise and shine CaptainCats!**\n\nWho's ready to conquer the crypto world today? 💪",
-                        "☕ **Morning coffee + Chart checking = Perfect combo!**\n\nHow's everyone feeling? 📈"
-                    ]
-                elif hour == 13:  # Afternoon  
-                    messages = [
-                        "🍔 **Lunch break check-in!**\n\nDon't forget to play a quick game! 🎮",
-                        "⚡ **Afternoon energy boost!**\n\nPresale progress looking amazing! Who's excited? 🔥",
-                        "📊 **Mid-day update!**\n\nWe're growing fast! Welcome all new members! 🎉"
-                    ]
-                elif hour == 18:  # Evening
-                    messages = [
-                        "🌆 **Evening vibes with the best community!**\n\nHow was your day, CAT fam? 💫",
-                        "🍻 **After work = CAT time!**\n\nWho's checking the game leaderboard? 🏆",
-                        "🎯 **Daily reminder:**\n\nYou're early to something special! 🚀"
-                    ]
-                elif hour == 22:  # Night
-                    messages = [
-                        "🌙 **Goodnight from CaptainCat!**\n\nRest well, tomorrow we moon! 🚀",
-                        "⭐ **Night shift crew, where you at?**\n\nChart never sleeps! 📈",
-                        "😴 **Sweet dreams of green candles!**\n\nSee you tomorrow, legends! 💎"
-                    ]
-                else:
-                    messages = None
-                
-                if messages:
-                    message = random.choice(messages)
-                    for channel_id in self.fomo_channels:
-                        if channel_id:
-                            try:
-                                await self.app.bot.send_message(channel_id, message, parse_mode='Markdown')
-                            except:
-                                pass
-                
-                # Wait 3-4 hours
-                await asyncio.sleep(random.randint(10800, 14400))
-                
-            except Exception as e:
-                logger.error(f"Error in community engager: {e}")
-                await asyncio.sleep(3600)
+        # Don't talk over a live conversation
+        quiet = self.activity.quiet_chats(self.fomo_channels, CHAT_ACTIVITY_CONFIG['engager_quiet_after'])
+        if not quiet:
+            return
+        
+        message = random.choice(messages)
+        results = await self.broadcaster.broadcast(quiet, message, parse_mode='Markdown')
+        for result in results.values():
+            if result.ok:
+                self.activity.mark_posted(result.chat_id)
 
     async def random_fact_sender(self):
         """Send interesting crypto/cat facts"""
-        await asyncio.sleep(1800)  # Wait 30 min
-        
         facts = [
             "🧠 **Did you know?** The first Bitcoin transaction was for pizza! 10,000 BTC for 2 pizzas. Today that's worth $400M+ 🍕",
             "🐱 **Cat Fact:** Cats spend 70% of their lives sleeping. That's 13-16 hours a day! Just like HODLers checking charts! 😴",
@@ -1555,43 +4539,35 @@ Don't let them buy it all!
             "🧠 **Mindset Tip:** Think in years, not days. Patience pays! ⏳"
         ]
         
-        while True:
-            try:
-                # Send fact or tip
-                if random.choice([True, False]):
-                    message = random.choice(facts)
-                else:
-                    message = random.choice(tips)
-                
-                # Avoid repeating
-                if message != self.chat_animation.get('last_fact'):
-                    self.chat_animation['last_fact'] = message
-                    
-                    for channel_id in self.fomo_channels:
-                        if channel_id:
-                            try:
-                                await self.app.bot.send_message(channel_id, message, parse_mode='Markdown')
-                            except:
-                                pass
-                
-                # Wait 2-3 hours
-                await asyncio.sleep(random.randint(7200, 10800))
-                
-            except Exception as e:
-                logger.error(f"Error in fact sender: {e}")
-                await asyncio.sleep(3600)
+        # Send fact or tip
+        if random.choice([True, False]):
+            message = random.choice(facts)
+        else:
+            message = random.choice(tips)
+        
+        # Avoid repeating
+        if message != self.chat_animation.get('last_fact'):
+            self.chat_animation['last_fact'] = message
+            
+            await self.broadcaster.broadcast(self.fomo_channels, message, parse_mode='Markdown')
+
+    async def evict_idle_chats(self):
+        """Forget activity of chats silent for longer than CHAT_ACTIVITY_CONFIG['idle_eviction']"""
+        evicted = self.activity.evict_idle()
+        if evicted:
+            logger.info(f"Evicted activity of {evicted} idle chats")
 
     async def get_motivation_message(self) -> str:
         """Get motivational message"""
-        progress = self.get_presale_progress()
+        progress = self.presale.snapshot
         
         motivations = [
-            f"🔥 **LFG CAT FAM!** We're {progress['percentage']:.1f}% to our goal! Every contribution matters! 🚀",
-            f"💪 **Stay strong CaptainCats!** Only {progress['remaining']} SOL to go! We got this! 💎",
+            f"🔥 **LFG CAT FAM!** We're {progress.percentage:.1f}% to our goal! Every contribution matters! 🚀",
+            f"💪 **Stay strong CaptainCats!** Only {progress.remaining} SOL to go! We got this! 💎",
             "🌟 **Remember:** The best time to plant a tree was 20 years ago. The second best time is now! 🌳",
             "🚀 **Greatness awaits those who dare!** You're part of something special! ⭐",
             "💎 **Diamond hands are forged under pressure!** Stay strong, stay CAT! 💪",
-            f"📈 **Progress update:** {progress['percentage']:.1f}% complete! History in the making! 📚",
+            f"📈 **Progress update:** {progress.percentage:.1f}% complete! History in the making! 📚",
             "🎯 **Focus on the goal:** DEX listing is coming! Then we fly! 🦅",
             "⚡ **Energy breeds energy!** Keep the momentum going, legends! 🔥",
             "🌙 **To the moon? No, we're going to build our own galaxy!** 🌌",
@@ -1619,8 +4595,19 @@ Don't let them buy it all!
             await update.message.reply_text("🔊 Chat animation enabled!")
         else:
             status = "🟢 ON" if self.chat_animation['enabled'] else "🔴 OFF"
+            now = time.time()
+            activity = self.activity.get(chat_id)
+            if activity:
+                chat_info = (
+                    f"📈 This chat: {activity.rate(now):.0f} msg/hour, "
+                    f"{activity.distinct_senders(now)} active users, "
+                    f"last message {(now - activity.last_activity) / 60:.0f} min ago\n\n"
+                )
+            else:
+                chat_info = "📈 No activity tracked in this chat yet\n\n"
             await update.message.reply_text(
-                f"💬 **Chat Animation Status:** {status}\n\n"
+                f"💬 **Chat Animation Status:** {status}\n"
+                f"{chat_info}"
                 f"Commands:\n"
                 f"/chatboost on - Enable animation\n"
                 f"/chatboost off - Disable animation",
@@ -1663,21 +4650,7 @@ Don't let them buy it all!
         from_addr = tx_data['from_address']
         tx_hash = tx_data['hash']
         
-        # Update stats
-        self.fomo_stats['raised'] += amount
-        self.fomo_stats['last_buy_time'] = datetime.now()
-        self.fomo_stats['recent_buyers'].append({
-            'amount': amount,
-            'buyer': from_addr,
-            'time': datetime.now(),
-            'announced': False
-        })
-        
-        # Keep only last 100 transactions
-        if len(self.fomo_stats['recent_buyers']) > 100:
-            self.fomo_stats['recent_buyers'] = self.fomo_stats['recent_buyers'][-100:]
-        
-        progress = self.get_presale_progress()
+        progress = self.presale.snapshot
         
         # Shorten address for display
         short_addr = f"{from_addr[:8]}...{from_addr[-8:]}" if len(from_addr) > 16 else from_addr
@@ -1717,9 +4690,9 @@ Don't let them buy it all!
 ⏰ **Time:** {datetime.now().strftime('%H:%M:%S')}
 
 📊 **PRESALE STATUS:**
-• Progress: {progress['percentage']:.1f}% FILLED!
-• Remaining: Only {progress['remaining']:.0f} SOL left!
-• Recent buyers: {len([tx for tx in self.fomo_stats['recent_buyers'] if datetime.now() - tx['time'] < timedelta(hours=1)])} in last hour
+• Progress: {progress.percentage:.1f}% FILLED!
+• Remaining: Only {progress.remaining:.0f} SOL left!
+• Recent buyers: {progress.buys_last_hour} in last hour
 
 {fomo_msg}
 🎯 **Don't miss your chance!**
@@ -1733,42 +4706,42 @@ Don't let them buy it all!
     @handle_errors
     async def presale_status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Detailed presale status for groups"""
-        progress = self.get_presale_progress()
-        
+        text, reply_markup = self._render_cached('presale_status', update, self._render_presale_status)
+        await self._send_rendered(update, text, reply_markup)
+
+    def _render_presale_status(self, progress: PresaleSnapshot) -> tuple:
         # Calculate various stats
-        total_investors = len(set(tx['buyer'] for tx in self.fomo_stats['recent_buyers']))
-        avg_investment = progress['raised'] / max(total_investors, 1)
+        total_investors = progress.unique_buyers
+        avg_investment = progress.raised / max(total_investors, 1)
         
-        recent_24h = [tx for tx in self.fomo_stats['recent_buyers'] 
-                     if datetime.now() - tx['time'] < timedelta(hours=24)]
-        volume_24h = sum(tx['amount'] for tx in recent_24h)
+        volume_24h = progress.volume_24h
         
         status_msg = f"""
 📊 **CAPTAINCAT PRESALE DETAILED STATUS** 📊
 
-{self.create_progress_visual(progress['percentage'])}
+{self.create_progress_visual(progress.percentage)}
 
 **💰 FINANCIAL METRICS:**
-• Total Raised: {progress['raised']:.1f}/{progress['target']} SOL
-• USD Value: ${progress['raised'] * 5.5:,.0f} (at $188.3/SOL)
-• Tokens Sold: {progress['tokens_sold']:,.0f} CAT
+• Total Raised: {progress.raised:.1f}/{progress.target} SOL
+• USD Value: ${progress.raised * 5.5:,.0f} (at $188.3/SOL)
+• Tokens Sold: {progress.tokens_sold:,.0f} CAT
 • Avg Investment: {avg_investment:.1f} SOL
 
 **📈 MOMENTUM METRICS:**
 • 24h Volume: {volume_24h:.1f} SOL
-• 24h Investors: {len(recent_24h)}
-• Hourly Rate: {progress['recent_rate']:.2f} SOL/h
-• Completion ETA: {progress['hours_to_complete']:.0f} hours
+• 24h Investors: {progress.buyers_last_day}
+• Hourly Rate: {progress.recent_rate:.2f} SOL/h
+• Completion ETA: {progress.hours_to_complete:.0f} hours
 
 **👥 COMMUNITY METRICS:**
 • Total Investors: {total_investors}
-• Whale Count (50+ SOL): {len([tx for tx in self.fomo_stats['recent_buyers'] if tx['amount'] >= 50])}
-• Shark Count (25+ SOL): {len([tx for tx in self.fomo_stats['recent_buyers'] if tx['amount'] >= 25])}
+• Whale Count (50+ SOL): {progress.whales_24h}
+• Shark Count (25+ SOL): {progress.sharks_24h}
 
 **⏰ TIME METRICS:**
 • Started: {PRESALE_CONFIG['start_date'].strftime('%d %b %Y')}
 • Ends: {PRESALE_CONFIG['end_date'].strftime('%d %b %Y')}
-• Time Left: {progress['time_left'].days}d {progress['time_left'].seconds//3600}h
+• Time Left: {progress.time_left.days}d {progress.time_left.seconds//3600}h
 
 **🎯 NEXT TARGETS:**
 • 80% - NFT Collection Preview
@@ -1783,17 +4756,12 @@ Don't let them buy it all!
             [InlineKeyboardButton("📊 Live Updates", callback_data="live_stats"),
              InlineKeyboardButton("🏆 Milestones", callback_data="milestones")]
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Handle both message and callback query
-        if update.callback_query:
-            await update.callback_query.edit_message_text(status_msg, reply_markup=reply_markup, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(status_msg, reply_markup=reply_markup, parse_mode='Markdown')
+        return status_msg, InlineKeyboardMarkup(keyboard)
 
     # ===== BASIC COMMANDS FROM ORIGINAL BOT =====
     @handle_errors
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        progress = self.presale.snapshot
         keyboard = [
             [InlineKeyboardButton("🎮 CaptainCat Game!", callback_data="game"),
              InlineKeyboardButton("💎 Presale", callback_data="presale")],
@@ -1815,7 +4783,7 @@ Hello future hero! I'm CaptainCat AI, the superhero of meme coins!
 🎮 **NEW: CaptainCat Adventure Game!**
 Play, collect CAT coins and climb the leaderboard!
 
-🚀 **PRESALE {self.get_presale_progress()['percentage']:.1f}% FILLED!**
+🚀 **PRESALE {progress.percentage:.1f}% FILLED!**
 💎 **Target: 500 SOL**
 🎯 **Community: 10K+ and growing!**
 
@@ -1885,13 +4853,13 @@ Examples: "how much?", "when listing?", "price prediction?"
 
     @handle_errors
     async def price_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        progress = self.get_presale_progress()
+        progress = self.presale.snapshot
         
         price_info = f"""
 💎 **CAPTAINCAT TOKENOMICS**
 
-🔥 **Presale {progress['percentage']:.1f}% FILLED!**
-💰 **Raised: {progress['raised']}/{progress['target']} SOL**
+🔥 **Presale {progress.percentage:.1f}% FILLED!**
+💰 **Raised: {progress.raised}/{progress.target} SOL**
 📊 **Total Supply: 1,000,000,000 CAT**
 
 📈 **Distribution:**
@@ -1907,7 +4875,7 @@ Examples: "how much?", "when listing?", "price prediction?"
 
 🚀 **Next step: LISTING on major DEXes!**
 
-⚠️ **Only {progress['remaining']} SOL spots left!**
+⚠️ **Only {progress.remaining} SOL spots left!**
         """
         
         keyboard = [
@@ -1920,18 +4888,17 @@ Examples: "how much?", "when listing?", "price prediction?"
 
     @handle_errors
     async def presale_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        progress = self.get_presale_progress()
-        recent_buyers = len([tx for tx in self.fomo_stats['recent_buyers'] 
-                           if datetime.now() - tx['time'] < timedelta(hours=1)])
+        progress = self.presale.snapshot
+        recent_buyers = progress.buys_last_hour
         
         presale_info = f"""
 💎 **CAPTAINCAT PRESALE** 💎
 
 🔥 **LIVE STATUS:**
-{self.create_progress_visual(progress['percentage'])}
+{self.create_progress_visual(progress.percentage)}
 
-💰 **Raised: {progress['raised']}/{progress['target']} SOL**
-⏰ **Time remaining: {progress['time_left'].days} days**
+💰 **Raised: {progress.raised}/{progress.target} SOL**
+⏰ **Time remaining: {progress.time_left.days} days**
 🚀 **Recent activity: {recent_buyers} buyers last hour!**
 
 🎯 **Presale Bonuses:**
@@ -1946,7 +4913,7 @@ Examples: "how much?", "when listing?", "price prediction?"
 3. Choose amount
 4. Receive CAT + bonuses!
 
-⚡ **At current rate: SOLD OUT in {progress['hours_to_complete']:.0f} hours!**
+⚡ **At current rate: SOLD OUT in {progress.hours_to_complete:.0f} hours!**
 
 🚨 **Don't miss the opportunity!**
         """
@@ -1965,6 +4932,7 @@ Examples: "how much?", "when listing?", "price prediction?"
 
     @handle_errors
     async def roadmap_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        progress = self.presale.snapshot
         roadmap_info = f"""
 🗺️ **CAPTAINCAT ROADMAP**
 
@@ -1974,7 +4942,7 @@ Examples: "how much?", "when listing?", "price prediction?"
 • Telegram community
 • Website and branding
 
-🔄 **Phase 2 - Presale** (IN PROGRESS - {self.get_presale_progress()['percentage']:.1f}%)
+🔄 **Phase 2 - Presale** (IN PROGRESS - {progress.percentage:.1f}%)
 • Private presale
 • Strategic partnerships  
 • Marketing campaign
@@ -2061,8 +5029,8 @@ Developers specialized in Web3 gaming
 
     @handle_errors
     async def community_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        progress = self.get_presale_progress()
-        total_holders = len(set(tx['buyer'] for tx in self.fomo_stats['recent_buyers']))
+        progress = self.presale.snapshot
+        total_holders = progress.unique_buyers
         
         community_info = f"""
 📱 **CAPTAINCAT COMMUNITY**
@@ -2072,7 +5040,7 @@ Developers specialized in Web3 gaming
 💎 **Holders: {total_holders}+ heroes**
 🎮 **Active Players: Increasing daily!**
 
-📊 **PRESALE: {progress['percentage']:.1f}% FILLED!**
+📊 **PRESALE: {progress.percentage:.1f}% FILLED!**
 
 🔗 **Official Links:**
         """
@@ -2152,27 +5120,47 @@ Developers specialized in Web3 gaming
 
     @handle_errors
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        db_status = "✅ Connected" if self.db.pool else "⚠️ Not available"
-        ton_status = "🟢 Active" if self.ton_monitor.monitoring else "🔴 Inactive"
-        progress = self.get_presale_progress()
+        if not self.db.pool:
+            db_status = "⚠️ Not available"
+        elif self.db.breaker.state != 'closed':
+            db_status = "🟠 Degraded (circuit open)"
+        else:
+            db_status = "✅ Connected"
+        sol_status = "🟢 Active" if self.sol_monitor.monitoring else "🔴 Inactive"
+        
+        # "Updated" is the render time; a new service status renders a new entry
+        status_msg, _ = self._render_cached(
+            'status', update,
+            lambda progress: (self._render_status(
+                progress, db_status, sol_status, datetime.now().strftime('%d/%m/%Y %H:%M')
+            ), None),
+            variant=(db_status, sol_status), ttl=RENDER_CACHE['status_ttl']
+        )
         
-        status_msg = f"""
+        if await self.is_admin(update.effective_user.id, update.effective_chat.id):
+            status_msg += self._format_db_metrics()
+            status_msg += self._format_outbound_metrics()
+        
+        await update.message.reply_text(status_msg, parse_mode='Markdown')
+
+    def _render_status(self, progress: PresaleSnapshot, db_status: str, sol_status: str, updated: str) -> str:
+        return f"""
 🤖 **CAPTAINCAT BOT STATUS**
 
 ✅ **Bot Online and Working**
 🎮 **CaptainCat Game: ACTIVE**
 📡 **Server: Render.com**
 ⏰ **Uptime: 24/7**
-🔄 **Last update: {datetime.now().strftime('%d/%m/%Y %H:%M')}**
+🔄 **Last update: {updated}**
 🗃️ **Database: {db_status}**
 🛡️ **Anti-Spam: ACTIVE**
 💎 **SOL Monitor: {sol_status}**
 🔧 **Error Handling: OPTIMIZED**
 
 📊 **PRESALE STATUS:**
-• Progress: {progress['percentage']:.1f}%
-• Raised: {progress['raised']}/{progress['target']} SOL
-• Recent activity: {len([tx for tx in self.fomo_stats['recent_buyers'] if datetime.now() - tx['time'] < timedelta(hours=1)])} buyers/hour
+• Progress: {progress.percentage:.1f}%
+• Raised: {progress.raised}/{progress.target} SOL
+• Recent activity: {progress.buys_last_hour} buyers/hour
 
 🔥 **FOMO Features:**
 • Automated alerts: ACTIVE
@@ -2182,8 +5170,117 @@ Developers specialized in Web3 gaming
 
 💪 **Ready to help the community reach the moon!**
         """
+
+    def _format_db_metrics(self) -> str:
+        """Pool and per-statement latency summary for admins"""
+        pool = self.db.get_pool_stats()
+        text = "\n🗃️ **DATABASE METRICS:**\n"
+        text += f"• Pool: {pool['size'] - pool['idle']}/{pool['max_size']} busy, {pool['idle']} idle\n"
+        text += f"• Circuit breaker: `{pool['breaker']}` (opened {pool['breaker_opened']}x)\n"
+        text += f"• Acquire wait p95: {pool['acquire_p95'] * 1000:.0f} ms\n"
+        renders = self.render_cache.get_stats()
+        text += f"• Render cache: {renders['entries']} entries, {renders['hits']} hits / {renders['misses']} misses\n"
+        if DATABASE_READ_URL:
+            lag = f"{pool['replica_lag']:.1f}s lag" if pool['replica_lag'] is not None else "unreachable"
+            text += f"• Read replica: {lag}, {pool['replica_reads']} reads (primary {pool['primary_reads']})\n"
+        for statement, histogram in sorted(self.db.query_latency.items()):
+            text += (
+                f"• `{statement}`: {histogram.count} calls, "
+                f"p50 {histogram.percentile(0.5) * 1000:.0f} ms, "
+                f"p95 {histogram.percentile(0.95) * 1000:.0f} ms\n"
+            )
+        return text
+
+    def _format_outbound_metrics(self) -> str:
+        """Outbound queue depth and wait time per priority class for admins"""
+        text = "\n📤 **OUTBOUND QUEUE:**\n"
+        for name, stats in self.outbound.get_stats().items():
+            text += (
+                f"• {name}: {stats['queued']} queued, {stats['sent']} sent, "
+                f"{stats['dropped']} dropped, {stats['retried']} retried, "
+                f"wait p95 {stats['wait_p95'] * 1000:.0f} ms\n"
+            )
+        broadcasts = self.broadcaster.get_stats()
+        text += f"• Broadcasts: {broadcasts['sent']} delivered, {broadcasts['failed']} failed\n"
+        return text
+
+    @handle_errors
+    async def jobs_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Scheduled jobs overview (admin only)"""
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
         
-        await update.message.reply_text(status_msg, parse_mode='Markdown')
+        if not await self.is_admin(user_id, chat_id):
+            await update.message.reply_text("🔒 This command is for admins only.")
+            return
+        
+        now = time.time()
+        text = "⏱️ **SCHEDULED JOBS**\n\n"
+        for job in sorted(self.scheduler.jobs.values(), key=lambda job: job.next_run or 0):
+            status = "🟢 running" if job.running else "⚪ idle"
+            text += f"{status} `{job.name}` ({job.trigger.describe()})\n"
+            if job.next_run:
+                text += f"• Next: in {max(0, job.next_run - now) / 60:.0f} min\n"
+            if job.last_duration is not None:
+                text += f"• Last run: {job.last_duration * 1000:.0f} ms\n"
+            text += f"• Runs: {job.runs} | Failures: {job.failures} | Skipped: {job.skipped}\n"
+            if job.last_error:
+                # Code span: table/partition names in errors would break Markdown entities
+                error = job.last_error[:100].replace('`', "'")
+                text += f"• Last error: `{error}`\n"
+            text += "\n"
+        if not self.scheduler.jobs:
+            text += "No jobs scheduled.\n"
+        
+        await update.message.reply_text(text, parse_mode='Markdown')
+
+    @handle_errors
+    async def trend_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Metric history: /trend [raised|buy_rate|active_chatters|game_plays] [hours] (admin only)"""
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+        
+        if not await self.is_admin(user_id, chat_id):
+            await update.message.reply_text("🔒 This command is for admins only.")
+            return
+        
+        args = context.args or []
+        name = args[0] if args else 'raised'
+        series = self.metrics.get(name)
+        if series is None:
+            available = ", ".join(sorted(self.metrics.series)) or "none yet"
+            await update.message.reply_text(f"📉 Unknown series. Available: {available}")
+            return
+        try:
+            hours = max(1, int(args[1])) if len(args) > 1 else 24
+        except ValueError:
+            hours = 24
+        # No history exists beyond the coarsest tier's retention
+        hours = min(hours, series.tiers[-1].retention // 3600)
+        
+        points = series.query(time.time() - hours * 3600)
+        if not points:
+            await update.message.reply_text(f"📉 No data for {name} in the last {hours}h yet.")
+            return
+        values = [value for _, value in points]
+        # One sparkline character per group of points, at most 24
+        group = math.ceil(len(values) / 24)
+        grouped = [values[i:i + group] for i in range(0, len(values), group)]
+        if series.kind == 'counter':
+            grouped = [sum(chunk) for chunk in grouped]
+        else:
+            grouped = [sum(chunk) / len(chunk) for chunk in grouped]
+        low, high = min(grouped), max(grouped)
+        bars = "▁▂▃▄▅▆▇█"
+        spark = "".join(bars[int((value - low) / (high - low) * 7) if high > low else 0] for value in grouped)
+        
+        text = f"📈 `{name}` - last {hours}h\n\n`{spark}`\n\n"
+        text += f"• Min: {min(values):.2f} | Max: {max(values):.2f}\n"
+        if series.kind == 'counter':
+            text += f"• Total: {sum(values):.0f}\n"
+        else:
+            text += f"• First: {values[0]:.2f} | Last: {values[-1]:.2f}\n"
+        await update.message.reply_text(text, parse_mode='Markdown')
 
     # ===== ANTI-SPAM COMMANDS =====
     @handle_errors
@@ -2459,7 +5556,7 @@ Hello {user.first_name}! Ready for the crypto adventure?
 🪙 **CAT Coins Collected:** {stats['total_coins']:,}
 💀 **Bear Markets Defeated:** {stats['total_enemies']:,}
 🎮 **Games Played:** {stats['games_played']}
-
+{await self._format_ranks(user_id, update.effective_chat.id)}
 🔥 **Next Goal:**
 {self._get_next_goal(stats['best_score'])}
         """
@@ -2476,6 +5573,20 @@ Hello {user.first_name}! Ready for the crypto adventure?
         else:
             await update.message.reply_text(stats_text, reply_markup=reply_markup, parse_mode='Markdown')
 
+    async def _format_ranks(self, user_id: int, chat_id: int) -> str:
+        """Global rank lines, plus the group one when called from a group"""
+        scopes = [("🌍 Global Rank", None)]
+        if chat_id < 0:
+            scopes.append(("👥 Group Rank", chat_id))
+        
+        lines = []
+        for label, group_id in scopes:
+            info = await self.db.get_player_rank(user_id, group_id)
+            if info:
+                top = max(1, math.ceil(100 * info['rank'] / info['players']))
+                lines.append(f"{label}: #{info['rank']:,} of {info['players']:,} (top {top}%)")
+        return "\n" + "\n".join(lines) + "\n" if lines else ""
+
     def _get_next_goal(self, current_score):
         """Calculate player's next goal"""
         if current_score < 1000:
@@ -2495,11 +5606,21 @@ Hello {user.first_name}! Ready for the crypto adventure?
     @handle_errors
     async def leaderboard_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Optimized game leaderboard"""
+        await self._send_leaderboard_page(update)
+
+    async def _send_leaderboard_page(self, update: Update, callback_data: Optional[str] = None):
+        """Leaderboard page; callback_data carries the keyset cursor of prev/next buttons"""
         chat_id = update.effective_chat.id
         is_group = chat_id < 0
+        scope = chat_id if is_group else None
+        
+        cursor, position, backwards = None, 0, False
+        if callback_data:
+            cursor, position, backwards = decode_leaderboard_cursor(callback_data)
         
         # Get leaderboard (group-specific if in a group)
-        leaderboard = await self.db.get_group_leaderboard(chat_id if is_group else None, 10)
+        page = await self.db.get_leaderboard_page(scope, cursor, position, backwards)
+        leaderboard = page['rows'] if page else []
         
         if not leaderboard:
             no_players_text = f"""
@@ -2535,7 +5656,7 @@ Be the first hero to:
             leaderboard_text += "🌍 **Global Leaderboard** 🌍\n\n"
         
         medals = ["🥇", "🥈", "🥉"]
-        for i, player in enumerate(leaderboard):
+        for i, player in enumerate(leaderboard, page['start']):
             if i < 3:
                 medal = medals[i]
             else:
@@ -2561,13 +5682,25 @@ Be the first hero to:
             
             leaderboard_text += f"{medal} {grade_emoji} **{name}** - {score:,} pts (Lv.{level})\n"
         
+        players = await self.db.count_players(scope)
         leaderboard_text += f"\n🎮 **Want to join the leaderboard? Play now!**"
-        leaderboard_text += f"\n🏆 **{len(leaderboard)} heroes have already played!**"
+        leaderboard_text += f"\n🏆 **{players or len(leaderboard):,} heroes have already played!**"
         
         keyboard = [
             [InlineKeyboardButton("🎮 Play Now!", callback_data="game")],
             [InlineKeyboardButton("📊 My Stats", callback_data="mystats")]
         ]
+        navigation = []
+        if page['has_prev']:
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Prev", callback_data=encode_leaderboard_cursor('p', page['start'], leaderboard[0])
+            ))
+        if page['has_next']:
+            navigation.append(InlineKeyboardButton(
+                "Next ➡️", callback_data=encode_leaderboard_cursor('n', page['start'] + len(leaderboard) - 1, leaderboard[-1])
+            ))
+        if navigation:
+            keyboard.insert(0, navigation)
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Handle both messages and callbacks
@@ -2601,6 +5734,12 @@ Be the first hero to:
                     group_id=chat_id if is_group else None
                 )
                 
+                if saved is True:
+                    self.events.publish(
+                        EVENT_SCORE_SAVED, user_id=user.id, chat_id=chat_id,
+                        score=data.get('score', 0), level=data.get('level', 1)
+                    )
+                
                 # Congratulations message
                 score = data.get('score', 0)
                 level = data.get('level', 1)
@@ -2633,15 +5772,20 @@ Be the first hero to:
                 stats_detail += f"💀 Bear Markets defeated: {enemies}\n"
                 stats_detail += f"🎯 Level reached: {level}\n"
                 
-                if not saved:
+                if saved == SCORE_SPOOLED:
+                    stats_detail += "\n⏳ *Score queued - it will reach the leaderboard once the database is back*"
+                elif not saved:
                     stats_detail += "\n⚠️ *Score not saved - database temporarily unavailable*"
                 
                 # Check if it's a new group record
-                if is_group and saved:
+                if is_group and saved is True:
                     leaderboard = await self.db.get_group_leaderboard(chat_id, 1)
                     if leaderboard and leaderboard[0]['score'] <= score and leaderboard[0]['user_id'] == user.id:
                         message += f"\n\n🏆 **NEW GROUP RECORD!** 🏆 {celebration}"
                 
+                if saved is True:
+                    stats_detail += await self._format_ranks(user.id, chat_id)
+                
                 message += stats_detail
                 
                 keyboard = [
@@ -2714,6 +5858,8 @@ Be the first hero to:
             await self.mystats_command(update, context)
         elif query.data == "leaderboard":
             await self.leaderboard_command(update, context)
+        elif query.data.startswith("lb:"):
+            await self._send_leaderboard_page(update, query.data)
         # Other existing buttons
         elif query.data == "presale":
             await self.presale_command(update, context)
@@ -2760,7 +5906,8 @@ Be the first hero to:
                         await context.bot.send_message(
                             chat_id=chat_id,
                             text=warning_msg,
-                            parse_mode='Markdown'
+                            parse_mode='Markdown',
+                            rate_limit_args={'priority': PRIORITY_MODERATION}
                         )
                     
                     logger.info(f"Spam message deleted from user {user_id}, score: {spam_info['score']}")
@@ -2774,6 +5921,9 @@ Be the first hero to:
                 )
                 return
         
+        # Track activity for chat animation
+        self.activity.record(chat_id, user_id)
+        
         # Process normal message
         message = message_text.lower()
         
@@ -2782,10 +5932,11 @@ Be the first hero to:
         game_words = ['game', 'play', 'adventure', 'score', 'leaderboard', 'stats']
         
         if any(word in message for word in fomo_words):
+            progress = self.presale.snapshot
             responses = [
-                f"🚀 {user_name}! Presale is {self.get_presale_progress()['percentage']:.1f}% filled! Don't miss out!",
-                f"💎 {user_name}, only {self.get_presale_progress()['remaining']} SOL spots left! Time is running out!",
-                f"🔥 {user_name}, smart money is moving! {len([tx for tx in self.fomo_stats['recent_buyers'] if tx['amount'] >= 50])} whales already joined!"
+                f"🚀 {user_name}! Presale is {progress.percentage:.1f}% filled! Don't miss out!",
+                f"💎 {user_name}, only {progress.remaining} SOL spots left! Time is running out!",
+                f"🔥 {user_name}, smart money is moving! {progress.whales_24h} whales already joined!"
             ]
             response = random.choice(responses)
             response += "\n\n🎯 Use /stats for live updates or /predict for price predictions!"
@@ -2803,40 +5954,35 @@ Be the first hero to:
         else:
             response = self.generate_ai_response(message, user_name)
             await update.message.reply_text(response, parse_mode='Markdown')
-        
-        # Track activity for chat animation
-        self.chat_animation['last_message_time'] = datetime.now()
-        self.chat_animation['message_count'] += 1
-        self.chat_animation['active_users'].add(user_id)
 
     def generate_ai_response(self, message: str, user_name: str) -> str:
         """Generate AI response with FOMO elements"""
         greetings = ['hello', 'hi', 'hey', 'good morning', 'good evening', 'greetings']
         price_words = ['price', 'cost', 'how much', 'value', 'worth']
         
-        progress = self.get_presale_progress()
+        progress = self.presale.snapshot
         
         if any(word in message for word in greetings):
             responses = [
-                f"🐱‍🦸 Hello {user_name}! Welcome to CaptainCat! Did you know presale is {progress['percentage']:.1f}% filled?",
+                f"🐱‍🦸 Hello {user_name}! Welcome to CaptainCat! Did you know presale is {progress.percentage:.1f}% filled?",
                 f"🚀 Meow {user_name}! I'm CaptainCat AI! Have you checked our price predictions? Use /predict!",
-                f"⚡ Greetings {user_name}! Ready to join {len(set(tx['buyer'] for tx in self.fomo_stats['recent_buyers']))} other investors?"
+                f"⚡ Greetings {user_name}! Ready to join {progress.unique_buyers} other investors?"
             ]
             return random.choice(responses) + "\n\n🎮 Don't forget to try CaptainCat Adventure Game!"
         elif any(word in message for word in price_words):
             return f"""💎 **Current Presale Price:**
 • 1 SOL = 26,787,781 CAT
-• Progress: {progress['percentage']:.1f}% filled
-• Remaining: {progress['remaining']} SOL
+• Progress: {progress.percentage:.1f}% filled
+• Remaining: {progress.remaining} SOL
 
 🚀 After presale, price will NEVER be this low!
 Use /predict to see potential returns!"""
         else:
             responses = [
-                f"Interesting question, {user_name}! While I think about it, did you see we're {progress['percentage']:.1f}% sold?",
-                f"{user_name}, great question! BTW, {len([tx for tx in self.fomo_stats['recent_buyers'] if datetime.now() - tx['time'] < timedelta(hours=1)])} people bought in the last hour!",
-                f"Hello {user_name}! I'll help you! Quick update: only {progress['remaining']} SOL spots left in presale!",
-                f"{user_name}, let me help! Fun fact: last buyer got {self.fomo_stats['recent_buyers'][-1]['amount'] * PRESALE_CONFIG['token_price']:,.0f} CAT tokens!" if self.fomo_stats['recent_buyers'] else f"{user_name}, I'm here to help! Presale is filling fast!"
+                f"Interesting question, {user_name}! While I think about it, did you see we're {progress.percentage:.1f}% sold?",
+                f"{user_name}, great question! BTW, {progress.buys_last_hour} people bought in the last hour!",
+                f"Hello {user_name}! I'll help you! Quick update: only {progress.remaining} SOL spots left in presale!",
+                f"{user_name}, let me help! Fun fact: last buyer got {self.presale.recent_buyers[-1]['amount'] * PRESALE_CONFIG['token_price']:,.0f} CAT tokens!" if self.presale.recent_buyers else f"{user_name}, I'm here to help! Presale is filling fast!"
             ]
             return random.choice(responses) + f"\n\n❓ Try: /stats, /whobought, /predict, /fomo"
 
@@ -2845,39 +5991,171 @@ Use /predict to see potential returns!"""
         """Initialize database on startup"""
         await self.db.init_pool()
 
+    async def shutdown(self, application: Application):
+        """Flush pending writes before the process exits"""
+        await self.scheduler.stop()
+        await self.sol_monitor.close()
+        await self.events.drain()
+        await self.db.close()
+        logger.info("Database closed")
+
+    async def count_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.callback_query:
+            kind = 'callback_query'
+        elif update.message:
+            kind = 'command' if (update.message.text or '').startswith('/') else 'message'
+        else:
+            kind = 'other'
+        self.updates_processed[kind] = self.updates_processed.get(kind, 0) + 1
+
+    def collect_metrics(self) -> str:
+        """Prometheus exposition of the bot's runtime state"""
+        out = MetricsWriter()
+        out.metric('captaincat_updates_total', 'counter', 'Updates processed by type',
+                   [({'type': kind}, count) for kind, count in sorted(self.updates_processed.items())])
+        processing = self.updates.get_stats()
+        out.metric('captaincat_updates_in_flight', 'gauge', 'Updates holding a processing slot', processing['in_flight'])
+        out.metric('captaincat_updates_waiting_on_chat', 'gauge', 'Updates queued behind an earlier update of the same chat', processing['waiting'])
+        out.metric('captaincat_webhook_requests_total', 'counter', 'Webhook requests by outcome',
+                   [({'result': 'accepted'}, self.web.updates_received), ({'result': 'rejected'}, self.web.updates_rejected)])
+        out.histogram('captaincat_handler_latency_seconds', 'Handler latency',
+                      [({'handler': name}, histogram) for name, histogram in sorted(HANDLER_LATENCY.items())])
+        
+        # Outbound queue
+        outbound = self.outbound.get_stats()
+        for field, kind, help_text in (('queued', 'gauge', 'Requests waiting in the outbound queue'),
+                                       ('sent', 'counter', 'Outbound requests sent'),
+                                       ('dropped', 'counter', 'Outbound requests dropped past their deadline'),
+                                       ('retried', 'counter', 'Outbound requests retried after RetryAfter')):
+            name = 'captaincat_outbound_queue_depth' if field == 'queued' else f'captaincat_outbound_{field}_total'
+            out.metric(name, kind, help_text, [({'priority': cls}, stats[field]) for cls, stats in outbound.items()])
+        out.histogram('captaincat_outbound_wait_seconds', 'Time requests wait in the outbound queue',
+                      [({'priority': PRIORITY_NAMES[priority]}, histogram) for priority, histogram in self.outbound.wait_latency.items()])
+        broadcasts = self.broadcaster.get_stats()
+        out.metric('captaincat_broadcast_deliveries_total', 'counter', 'Broadcast deliveries by result',
+                   [({'result': 'sent'}, broadcasts['sent']), ({'result': 'failed'}, broadcasts['failed'])])
+        
+        # Anti-spam
+        out.metric('captaincat_antispam_entries', 'gauge', 'Entries held by the anti-spam system', [
+            ({'state': 'users'}, len(self.anti_spam.user_messages)),
+            ({'state': 'banned'}, len(self.anti_spam.banned_users)),
+            ({'state': 'message_hashes'}, len(self.anti_spam.message_hashes)),
+            ({'state': 'spam_scores'}, len(self.anti_spam.spam_scores))
+        ])
+        
+        # Database
+        pool = self.db.get_pool_stats()
+        out.metric('captaincat_db_available', 'gauge', 'Database reachable and circuit closed', int(self.db.available))
+        out.metric('captaincat_db_pool_connections', 'gauge', 'Pool connections by state', [
+            ({'state': 'busy'}, pool['size'] - pool['idle']),
+            ({'state': 'idle'}, pool['idle']),
+            ({'state': 'max'}, pool['max_size'])
+        ])
+        out.metric('captaincat_db_spool_pending', 'gauge', 'Writes spooled locally while the database is down', self.db.spool.pending)
+        if pool['replica_lag'] is not None:
+            out.metric('captaincat_db_replica_lag_seconds', 'gauge', 'Read replica replay lag', pool['replica_lag'])
+        out.histogram('captaincat_db_acquire_seconds', 'Pool acquire wait', [(None, self.db.acquire_wait)])
+        out.histogram('captaincat_db_query_seconds', 'Query latency by statement',
+                      [({'statement': statement}, histogram) for statement, histogram in sorted(self.db.query_latency.items())])
+        
+        # SOL RPC
+        out.histogram('captaincat_rpc_latency_seconds', 'Solana RPC latency', [(None, self.sol_monitor.rpc_latency)])
+        out.metric('captaincat_rpc_errors_total', 'counter', 'Solana RPC errors', self.sol_monitor.rpc_errors)
+        
+        # Scheduler, caches, events
+        jobs = sorted(self.scheduler.jobs.values(), key=lambda job: job.name)
+        out.metric('captaincat_job_runs_total', 'counter', 'Scheduled job runs', [({'job': job.name}, job.runs) for job in jobs])
+        out.metric('captaincat_job_failures_total', 'counter', 'Scheduled job failures', [({'job': job.name}, job.failures) for job in jobs])
+        admins = self.admins.get_stats()
+        out.metric('captaincat_admin_cache_requests_total', 'counter', 'Admin cache lookups',
+                   [({'result': 'hit'}, admins['hits']), ({'result': 'miss'}, admins['misses'])])
+        renders = self.render_cache.get_stats()
+        out.metric('captaincat_render_cache_requests_total', 'counter', 'Render cache lookups',
+                   [({'result': 'hit'}, renders['hits']), ({'result': 'miss'}, renders['misses'])])
+        out.metric('captaincat_events_published_total', 'counter', 'Events published on the bus',
+                   [({'event': event}, count) for event, count in sorted(self.events.published.items())])
+        out.metric('captaincat_chats_tracked', 'gauge', 'Chats with tracked activity', len(self.activity.chats))
+        
+        # Presale
+        progress = self.presale.snapshot
+        out.metric('captaincat_presale_raised_sol', 'gauge', 'SOL raised', progress.raised)
+        out.metric('captaincat_presale_unique_buyers', 'gauge', 'Distinct buyers', progress.unique_buyers)
+        return out.text()
+
     # ===== RUN METHOD =====
-    def run(self):
-        print("🐱‍🦸 CaptainCat FOMO Bot starting...")
+    async def startup(self):
+        """Database, presale state, scheduler and SOL monitor"""
+        await self.initialize_database()
+        logger.info("Database initialized")
+        await self.load_presale_state()
+        
+        # Start FOMO automation (also runs partition maintenance and spool replay)
+        await self.start_fomo_scheduler()
+        logger.info("FOMO automation started")
+        
+        # Start SOL monitoring if configured
+        if self.sol_monitor.api_key and self.sol_monitor.contract_address:
+            asyncio.create_task(self.sol_monitor.monitor_transactions())
+            logger.info("SOL monitoring started")
+
+    async def start_updates(self):
+        """Register the webhook, or fall back to long polling"""
+        if BOT_MODE == 'webhook' and WEBHOOK_URL:
+            try:
+                await self.app.bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip('/') + WEBHOOK_CONFIG['path'],
+                    secret_token=self.web.secret,
+                    allowed_updates=ALLOWED_UPDATES,
+                    max_connections=WEBHOOK_CONFIG['max_connections'],
+                    drop_pending_updates=True
+                )
+                self.mode = 'webhook'
+                logger.info("Receiving updates via webhook")
+                return
+            except TelegramError as e:
+                logger.error(f"Webhook setup failed, falling back to polling: {e}")
         
-        # Initialize everything including FOMO scheduler
-        async def startup():
-            await self.initialize_database()
-            logger.info("Database initialized")
-            
-            # Start FOMO automation
-            await self.start_fomo_scheduler()
-            logger.info("FOMO automation started")
-            
-            # Start SOL monitoring if configured
-            if self.sol_monitor.api_key and self.sol_monitor.contract_address:
-                asyncio.create_task(self.sol_monitor.monitor_transactions())
-                logger.info("SOL monitoring started")
+        # start_polling removes any webhook left over from a previous deploy
+        await self.app.updater.start_polling(
+            drop_pending_updates=True,
+            allowed_updates=ALLOWED_UPDATES,
+            poll_interval=1.0,
+            timeout=10
+        )
+        self.mode = 'polling'
+        logger.info("Receiving updates via polling")
+
+    async def serve(self):
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
         
+        # Health check and webhook share the server; bind it first so the platform sees us up
+        await self.web.start()
+        await self.app.initialize()
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(startup())
+            await self.startup()
         except Exception as e:
             logger.error(f"Startup error: {e}")
         
-        # Run bot
-        self.app.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=["message", "callback_query"],
-            poll_interval=1.0,
-            timeout=10,
-            close_loop=False
-        )
+        await self.start_updates()
+        await self.app.start()
+        try:
+            await stop.wait()
+        finally:
+            if self.app.updater.running:
+                await self.app.updater.stop()
+            await self.app.stop()
+            await self.web.stop()
+            await self.shutdown(self.app)
+            await self.app.shutdown()
+
+    def run(self):
+        print("🐱‍🦸 CaptainCat FOMO Bot starting...")
+        asyncio.run(self.serve())
 
 # ===== MAIN EXECUTION =====
 if __name__ == "__main__":
@@ -2894,6 +6172,7 @@ if __name__ == "__main__":
         print("- WEBAPP_URL (for game)")
         print("- MAIN_GROUP_ID (for FOMO messages)")
         print("- ANNOUNCEMENT_CHANNEL_ID (for FOMO messages)")
+        print("- WEBHOOK_URL (public URL for webhook mode; RENDER_EXTERNAL_URL is used on Render)")
     else:
         print(f"🚀 Starting CaptainCat FOMO Bot...")
         bot = CaptainCatFOMOBot(BOT_TOKEN)